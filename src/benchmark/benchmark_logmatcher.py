@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# coding: UTF-8
+
+# Copyright 2012 Keita Kita
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark of throughput and latency of matching log.
+#
+# Each workload feeds a synthetic logcat stream to LogMatcher while a thread
+# waits, and measures lines per second, peak memory and latency from
+# arrival of a line to its matching. Each workload runs on the direct path,
+# where received lines are matched at once, and on the batched path, where
+# they are matched in batches by matchingLatency. Each run is executed in its
+# own process so that peak memory is not shared by runs. Results are written
+# as JSON to be compared between revisions.
+#
+# Usage :
+#     python benchmark_logmatcher.py [--lines 10000,100000]
+#         [--paths direct,batched] [--output FILE]
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import logmatcher
+
+try:
+    import resource
+except ImportError:
+    # resource is not available on Windows.
+    resource = None
+
+# Workloads that can be run.
+workloads = ['literal', 'regex', 'manyPatterns']
+
+# Default numbers of lines of each run.
+defaultLineCounts = [10000, 100000, 1000000, 10000000]
+
+# Paths of matching that are run. The direct path matches received lines at
+# once, and the batched path matches them in batches by matchingLatency.
+feedingPaths = ['direct', 'batched']
+
+# Default matchingLatency of the batched path.
+defaultMatchingLatency = 0.01
+
+# Number of lines that are received at once.
+defaultBatchSize = 100
+
+# Number of lines of which latency is measured.
+defaultProbeCount = 100
+
+# Number of patterns of the manyPatterns workload. It also waits the same
+# number of strings.
+manyPatternCount = 200
+
+# Number of distinct synthetic lines that are repeated.
+templateCount = 1000
+
+# Timeout of waiting that is long enough for the whole stream.
+benchmarkTimeout = 3600
+
+class NullLogcatThread:
+    u'''
+    LogcatThread that does not execute adb.
+    '''
+
+    def start(self):
+        pass
+
+    def terminate(self):
+        pass
+
+class BenchmarkLogMatcher(logmatcher.LogMatcher):
+    u'''
+    LogMatcher whose log is fed by the benchmark.
+    '''
+
+    def createLogcatThread(self, logcatArgument):
+        return NullLogcatThread()
+
+def createTemplates():
+    u'''
+    Create synthetic lines of "threadtime" format.
+    '''
+    tags = ['ActivityManager', 'dalvikvm', 'SurfaceFlinger', 'WindowManager']
+    levels = 'VDIWE'
+    templates = []
+    for index in range(templateCount):
+        pid = 1000 + index % len(tags)
+        templates.append(
+            '10-18 12:00:%02d.%03d %5d %5d %s %s: synthetic line %d\n' % (
+                index % 60, index, pid, pid, levels[index % len(levels)],
+                tags[index % len(tags)], index))
+    return templates
+
+def waitWorkload(matcher, workload):
+    u'''
+    Wait until the last line of the stream is matched.
+
+    Arguments :
+        matcher : LogMatcher.
+        workload : Name of the workload.
+    Return :
+        True if the last line is matched.
+    '''
+    if workload == 'literal':
+        return bool(matcher.wait(u'benchmark finished', benchmarkTimeout))
+    if workload == 'regex':
+        return bool(matcher.waitPattern(
+            ur'benchmark (finish|complet)ed in \d+', benchmarkTimeout))
+
+    # Strings and patterns that are not found until the last line.
+    matches = [u'never found %d' % index for index in range(manyPatternCount)]
+    patterns = [ur'missing \d+ pattern %d' % index
+        for index in range(manyPatternCount - 1)]
+    patterns.append(ur'benchmark finished in \d+')
+    return bool(matcher.waitAny(matches, patterns, benchmarkTimeout))
+
+def startProbe(matcher, workload, index, latencies):
+    u'''
+    Start waiting for a probe line that does not block, and record
+    the time when it is matched.
+
+    Arguments :
+        matcher : LogMatcher.
+        workload : Name of the workload.
+        index : Index of the probe.
+        latencies : List of pairs of the probe index and the matched time.
+    '''
+    def onMatched(result):
+        if result:
+            latencies.append((index, time.time()))
+
+    if workload == 'literal':
+        matcher.waitAsync(
+            u'probe %d arrived' % index, benchmarkTimeout, onMatched)
+    else:
+        matcher.waitPatternAsync(
+            ur'probe %d arrive[ds]' % index, benchmarkTimeout, onMatched)
+
+def runWorkload(workload, lineCount, batchSize, probeCount, options):
+    u'''
+    Run a workload in this process.
+
+    Arguments :
+        workload : Name of the workload.
+        lineCount : Number of lines of the stream.
+        batchSize : Number of lines that are received at once.
+        probeCount : Number of lines of which latency is measured.
+        options : Options of the command line.
+    Return :
+        dict of the result.
+    '''
+    matcher = BenchmarkLogMatcher()
+    matcher.start(persistent = True, matchesBytes = options.matchesBytes,
+        maximumLogSize = options.maximumLogSize,
+        matchingLatency = options.matchingLatency)
+
+    templates = createTemplates()
+    batches = [templates[index:index + batchSize]
+        for index in range(0, len(templates), batchSize)]
+    batchCount = max(1, lineCount // batchSize)
+    probeInterval = max(1, batchCount // max(1, probeCount))
+
+    results = {}
+    def waitLog():
+        results['matched'] = waitWorkload(matcher, workload)
+        results['matchedTime'] = time.time()
+
+    waitingThread = threading.Thread(target = waitLog)
+    waitingThread.start()
+    time.sleep(0.1)
+
+    arrivals = {}
+    latencies = []
+    startTime = time.time()
+    for batchIndex in range(batchCount):
+        lines = batches[batchIndex % len(batches)]
+
+        # Replace the last line of the batch by a probe line.
+        if batchIndex % probeInterval == 0 and len(arrivals) < probeCount:
+            probeIndex = len(arrivals)
+            startProbe(matcher, workload, probeIndex, latencies)
+            lines = lines[:-1] + ['probe %d arrived\n' % probeIndex]
+            arrivals[probeIndex] = time.time()
+
+        if options.perLine:
+            for line in lines:
+                matcher.onLogReceived(line)
+        else:
+            matcher.onLogsReceived(lines)
+
+    matcher.onLogReceived('benchmark finished in %d\n' % batchCount)
+    feedingTime = time.time() - startTime
+    waitingThread.join()
+    elapsedTime = results['matchedTime'] - startTime
+    matcher.stop()
+
+    fedLineCount = batchCount * batchSize + 1
+    return {
+        'workload' : workload,
+        'lines' : fedLineCount,
+        'batchSize' : batchSize,
+        'perLine' : options.perLine,
+        'matchesBytes' : options.matchesBytes,
+        'matchingLatency' : options.matchingLatency,
+        'matched' : results['matched'],
+        'elapsedSeconds' : elapsedTime,
+        'feedingSeconds' : feedingTime,
+        'linesPerSecond' : fedLineCount / max(elapsedTime, 1e-9),
+        'peakMemoryKilobytes' : getPeakMemory(),
+        'latencySeconds' : summarizeLatencies(
+            [matchedTime - arrivals[index]
+                for index, matchedTime in latencies]),
+    }
+
+def getPeakMemory():
+    u'''
+    Get peak resident memory of this process in kilobytes, or None if it
+    is not available.
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # ru_maxrss is bytes on Mac OS X.
+        peak //= 1024
+    return peak
+
+def summarizeLatencies(latencies):
+    u'''
+    Summarize latencies by percentiles.
+
+    Arguments :
+        latencies : List of seconds.
+    Return :
+        dict of the count, percentiles and the maximum.
+    '''
+    latencies = sorted(latencies)
+    summary = {'count' : len(latencies)}
+    if not latencies:
+        return summary
+
+    for percentile in (50, 90, 99):
+        index = int(round(percentile / 100.0 * (len(latencies) - 1)))
+        summary['p%d' % percentile] = latencies[index]
+    summary['max'] = latencies[-1]
+    return summary
+
+def getRevision():
+    u'''
+    Get the git revision of the working tree, or None.
+    '''
+    try:
+        popen = subprocess.Popen(['git', 'rev-parse', 'HEAD'],
+            cwd = os.path.dirname(os.path.abspath(__file__)),
+            stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        revision = popen.communicate()[0].strip()
+    except OSError:
+        return None
+    return revision or None
+
+def runInProcess(workload, lineCount, feedingPath, options):
+    u'''
+    Run a workload in a new process.
+
+    Arguments :
+        workload : Name of the workload.
+        lineCount : Number of lines of the stream.
+        feedingPath : Path of matching in feedingPaths.
+        options : Options of the command line.
+    Return :
+        dict of the result.
+    '''
+    arguments = [sys.executable, os.path.abspath(__file__),
+        '--run', workload, '--lines', str(lineCount),
+        '--batch-size', str(options.batchSize),
+        '--probes', str(options.probeCount)]
+    if options.perLine:
+        arguments.append('--per-line')
+    if options.matchesBytes:
+        arguments.append('--matches-bytes')
+    if options.maximumLogSize is not None:
+        arguments += ['--maximum-log-size', str(options.maximumLogSize)]
+    if feedingPath == 'batched':
+        arguments += ['--matching-latency', str(options.matchingLatency)]
+
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [path for path in sys.path if path])
+    popen = subprocess.Popen(
+        arguments, stdout = subprocess.PIPE, env = environment)
+    output = popen.communicate()[0]
+    if popen.returncode != 0:
+        raise RuntimeError(u'Benchmark of %s failed' % workload)
+
+    result = json.loads(output)
+    result['path'] = feedingPath
+    return result
+
+def parseOptions(arguments):
+    u'''
+    Parse arguments of the command line.
+    '''
+    parser = optparse.OptionParser(usage = u'%prog [options]')
+    parser.add_option('--workloads', default = ','.join(workloads),
+        help = u'Comma separated workloads. Default : %default')
+    parser.add_option('--lines',
+        default = ','.join([str(count) for count in defaultLineCounts]),
+        help = u'Comma separated numbers of lines. Default : %default')
+    parser.add_option('--batch-size', dest = 'batchSize', type = 'int',
+        default = defaultBatchSize,
+        help = u'Lines that are received at once. Default : %default')
+    parser.add_option('--probes', dest = 'probeCount', type = 'int',
+        default = defaultProbeCount,
+        help = u'Lines of which latency is measured. Default : %default')
+    parser.add_option('--per-line', dest = 'perLine', action = 'store_true',
+        default = False, help = u'Feed lines by onLogReceived one by one.')
+    parser.add_option('--matches-bytes', dest = 'matchesBytes',
+        action = 'store_true', default = False,
+        help = u'Match log without decoding.')
+    parser.add_option('--maximum-log-size', dest = 'maximumLogSize',
+        type = 'int', default = None,
+        help = u'Maximum bytes of log kept in memory.')
+    parser.add_option('--paths', default = ','.join(feedingPaths),
+        help = u'Comma separated paths of matching. Default : %default')
+    parser.add_option('--matching-latency', dest = 'matchingLatency',
+        type = 'float', default = None,
+        help = u'Maximum seconds that lines wait for matching on '
+            u'the batched path. Default : %g' % defaultMatchingLatency)
+    parser.add_option('--output', default = None,
+        help = u'File of the JSON result. Default : standard output')
+    parser.add_option('--run', default = None,
+        help = u'Run a workload in this process. Used internally.')
+    return parser.parse_args(arguments)[0]
+
+def main(arguments):
+    options = parseOptions(arguments)
+
+    if options.run:
+        result = runWorkload(options.run, int(options.lines),
+            options.batchSize, options.probeCount, options)
+        json.dump(result, sys.stdout)
+        return 0
+
+    if options.matchingLatency is None:
+        options.matchingLatency = defaultMatchingLatency
+
+    results = []
+    for workload in options.workloads.split(','):
+        for lineCount in options.lines.split(','):
+            for feedingPath in options.paths.split(','):
+                if feedingPath not in feedingPaths:
+                    raise ValueError(u'Unknown path : ' + feedingPath)
+                result = runInProcess(
+                    workload, int(lineCount), feedingPath, options)
+                sys.stderr.write('%s %s %d lines : %.0f lines/s\n' % (
+                    workload, feedingPath, result['lines'],
+                    result['linesPerSecond']))
+                results.append(result)
+
+    report = {
+        'revision' : getRevision(),
+        'python' : sys.version,
+        'platform' : sys.platform,
+        'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results' : results,
+    }
+    if options.output:
+        output = open(options.output, 'w')
+        try:
+            json.dump(report, output, indent = 2, sort_keys = True)
+        finally:
+            output.close()
+    else:
+        json.dump(report, sys.stdout, indent = 2, sort_keys = True)
+        sys.stdout.write('\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -60,5 +60,32 @@ class TestIntegrationLogmatcher(unittest.TestCase):
 
         self.assert_(logmatcher.wait(u'日本語のログ'))
 
+    def testMatchingWithMarkerStartMode(self):
+        u'''
+        Test when log is matched without clearing log by the marker.
+        '''
+        adb('shell log -t LogMatcherTest before')
+        logmatcher.start(startMode = logmatcher.markerStartMode)
+
+        adb('shell log -t LogMatcherTest after')
+
+        self.assert_(not logmatcher.wait('before', 2))
+
+        logmatcher.start(startMode = logmatcher.markerStartMode)
+
+        adb('shell log -t LogMatcherTest after')
+
+        self.assert_(logmatcher.wait('after', 10))
+
+    def testMatchingWithTimeStartMode(self):
+        u'''
+        Test when log is matched without clearing log from the current time.
+        '''
+        logmatcher.start(startMode = logmatcher.timeStartMode)
+
+        adb('shell am start -a aaa')
+
+        self.assert_(logmatcher.wait('Am', 10))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -20,11 +20,48 @@
 
 from __future__ import with_statement
 
+import array
+import bisect
+import heapq
 import os
 import re
+import select
+import socket
+import sre_compile
+import sre_constants
+import sre_parse
 import subprocess
 import sys
-from threading import Event, Thread, RLock
+import tempfile
+import time
+import traceback
+from collections import deque
+from contextlib import closing
+from threading import Condition, Event, Thread, RLock
+
+try:
+    import json
+except ImportError:
+    # json is not available on Jython 2.5.
+    json = None
+
+try:
+    import cProfile
+except ImportError:
+    # cProfile is not available on Jython.
+    cProfile = None
+
+try:
+    import mmap
+except ImportError:
+    # mmap is not available on Jython.
+    mmap = None
+
+try:
+    import multiprocessing
+except ImportError:
+    # multiprocessing is not available on Python 2.5 and Jython.
+    multiprocessing = None
 
 # Whether this script is running on Jython.
 isJython = sys.platform.startswith('java')
@@ -37,6 +74,9 @@ if isJython:
 else:
     isWindows = sys.platform.startswith('win')
 
+# Whether pipes of many processes can be read by select.
+isMultiplexingSupported = not isJython and not isWindows
+
 ### Version Depending Function ###
 
 def kill(popen):
@@ -60,123 +100,5159 @@ def kill(popen):
         # Popen.kill can be used from Python 2.6.
         popen.kill()
 
-###
+def dumpJson(value):
+    u'''
+    Convert a value to a JSON string.
+
+    On Jython 2.5, which does not have json module, dict, list, tuple,
+    strings, numbers, bool and None are converted by this function.
+
+    Arguments :
+        value : Value that is converted.
+    Return :
+        str of JSON.
+    '''
+    if json:
+        return json.dumps(value, sort_keys = True)
+
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, (int, long, float)):
+        return repr(value)
+    if isinstance(value, basestring):
+        if isinstance(value, str):
+            value = value.decode('utf-8', 'replace')
+        characters = []
+        for character in value:
+            if u' ' <= character < u'\x7f' and character not in u'"\\':
+                characters.append(str(character))
+            else:
+                characters.append('\\u%04x' % ord(character))
+        return '"' + ''.join(characters) + '"'
+    if isinstance(value, dict):
+        keys = value.keys()
+        keys.sort()
+        return '{' + ', '.join([dumpJson(unicode(key)) + ': ' +
+            dumpJson(value[key]) for key in keys]) + '}'
+    return '[' + ', '.join([dumpJson(item) for item in value]) + ']'
+
+###
+
+# Default waiting timeout.
+defaultTimeout = 5
+
+# Modes to start logcat.
+#
+# clearStartMode clears the log buffer of the device before starting logcat.
+# timeStartMode starts logcat from the current time of the device with -T.
+# It requires Android 5.0 or above.
+# markerStartMode writes a marker to the log of the device and ignores log
+# before the marker.
+clearStartMode = u'clear'
+timeStartMode = u'time'
+markerStartMode = u'marker'
+
+# Tag of the marker log for markerStartMode.
+markerTag = u'LogMatcherMarker'
+
+# Format of date of the device for timeStartMode. Old devices whose date
+# does not support "%N" start logcat from the head of the current second.
+deviceDateFormat = u'+%m-%d %H:%M:%S.%N'
+
+# Buffers of logcat that include the main buffer, where the marker is
+# written.
+markerBuffers = (u'main', u'default', u'all')
+
+# Policies when the queue between reading and matching is full.
+#
+# blockPolicy blocks reading until the queue has room.
+# dropOldestPolicy drops the oldest lines in the queue.
+# dropNewestPolicy drops received lines and counts them.
+blockPolicy = u'block'
+dropOldestPolicy = u'dropOldest'
+dropNewestPolicy = u'dropNewest'
+
+# Default number of lines in the queue between reading and matching.
+defaultQueueSize = 100000
+
+# Maximum seconds that waiting waits for lines that are queued before
+# timeout to be matched.
+maximumDrainingTime = 5
+
+# Seconds between checks of queued lines by waiting that does not block.
+drainingCheckInterval = 0.01
+
+# Maximum number of lines that are matched at once by matchingLatency.
+maximumBatchSize = 10000
+
+# Number of lines in a segment of LogBuffer.
+segmentLength = 256
+
+# Default bytes that are read from logcat at once.
+defaultReadingSize = 65536
+
+# Number of removed lines after which arrays of LogIndex are trimmed.
+indexPruningLineCount = 4096
+
+# Estimated bytes of a key of LogIndex with its array and its dict entry.
+indexKeySize = 100
+
+# Share of maximumLogSize that LogIndex may use. The size of the index is
+# counted in maximumLogSize, and older lines are found without the index.
+indexSizeRatio = 0.5
+
+# Lock of appending statistics, which is shared by sessions so that lines of
+# sessions writing to the same file are not mixed.
+statisticsLock = RLock()
+
+# Default bytes of a range of lines of a log file that is scanned by
+# a worker process at once.
+defaultScanRangeLength = 16 * 1024 * 1024
+
+# Default address of the adb server.
+defaultAdbHost = u'127.0.0.1'
+defaultAdbPort = 5037
+
+# Default maximum number of connections to the adb server that are kept
+# in the pool of AdbClient.
+defaultAdbPoolSize = 4
+
+# Stages that are profiled.
+readingStage = u'reading'
+decodingStage = u'decoding'
+matchingStage = u'matching'
+
+# Upper bounds of buckets of the histogram of seconds from receiving a line
+# to matching it. The last bucket counts the rest.
+latencyHistogramBounds = [
+    0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5]
+
+# Default length of the tail of log that is carried over to the next matching
+# of a pattern. A pattern that matches longer string than this length
+# across received lines cannot be found.
+defaultCarryOverLength = 4096
+
+class StringMatcher:
+    u'''
+    Incremental matcher that finds a string in log.
+
+    Only newly received log and the tail of the previous log that may contain
+    the head of the string are searched. Therefore, the cost of matching
+    per line does not depend on the length of the whole log.
+    '''
+
+    def __init__(self, match):
+        u'''
+        Constructor.
+
+        Arguments :
+            match : Searching unicode string.
+        '''
+        self.__match = match
+        self.__carryOverLength = max(len(match) - 1, 0)
+        self.__carryOver = match[:0]
+
+    def feed(self, log):
+        u'''
+        Match newly received log.
+
+        Arguments :
+            log : unicode that is received after the last feeding.
+        Return :
+            True if the string is found, False otherwise.
+        '''
+        searchedLog = self.__carryOver + log
+        if 0 <= searchedLog.find(self.__match):
+            return True
+
+        # Keep the tail that may contain the head of the string.
+        if self.__carryOverLength:
+            self.__carryOver = searchedLog[-self.__carryOverLength:]
+
+        return False
+
+    def getString(self):
+        u'''
+        Get the searching string.
+        '''
+        return self.__match
+
+class PatternMatcher:
+    u'''
+    Incremental matcher that searches a regular expression pattern in log.
+
+    Only newly received log and the tail of the previous log are searched.
+    The tail is the incomplete last line unless the pattern can span lines,
+    and it is limited to carryOverLength characters. Positions of
+    the returned Match object are relative to the searched string.
+    The pattern is created by createIncrementalPattern, so the result does
+    not depend on how log is split.
+    '''
+
+    def __init__(self, pattern, carryOverLength = None):
+        u'''
+        Constructor.
+
+        Arguments :
+            pattern : Compiled regular expression pattern.
+            carryOverLength : Length of the tail of log that is searched again
+                with newly received log. If it is None,
+                defaultCarryOverLength is used.
+        '''
+        if carryOverLength is None:
+            carryOverLength = defaultCarryOverLength
+
+        self.__pattern = createIncrementalPattern(pattern)
+        self.__spansLines = canSpanLines(pattern)
+        self.__carryOverLength = carryOverLength
+        self.__carryOver = u''
+        self.__searchBegin = 0
+
+    def feed(self, log):
+        u'''
+        Match newly received log.
+
+        Arguments :
+            log : unicode that is received after the last feeding.
+        Return :
+            Match object if the pattern is matched, None otherwise.
+        '''
+        searchedLog = self.__carryOver + log
+        result = self.__pattern.search(searchedLog, self.__searchBegin)
+        if result:
+            return result
+
+        context, begin = findCarryOver(
+            searchedLog, self.__spansLines, self.__carryOverLength)
+        self.__carryOver = searchedLog[context:]
+        self.__searchBegin = begin - context
+
+        return None
+
+class FunctionMatcher:
+    u'''
+    Matcher that calls a function with the whole log.
+
+    This matcher is for matching functions of LogMatcher.waitFunction.
+    It is not incremental, so the cost of matching per line grows with
+    the length of the log.
+    '''
+
+    def __init__(self, matchFunction, getLog):
+        u'''
+        Constructor.
+
+        Arguments :
+            matchFunction : Matching function.
+                It has an argument that received log.
+            getLog : Function that returns the whole log.
+        '''
+        self.__matchFunction = matchFunction
+        self.__getLog = getLog
+
+    def feed(self, log):
+        u'''
+        Match the whole log including newly received log.
+
+        Arguments :
+            log : unicode that is received after the last feeding.
+        Return :
+            Result of the matching function.
+        '''
+        return self.__matchFunction(self.__getLog())
+
+def findRequiredLiterals(pattern):
+    u'''
+    Find literals that are contained in any string matched with a pattern.
+
+    Arguments :
+        pattern : Compiled regular expression pattern.
+    Return :
+        List of unicode literals. It is empty if no literal is found or
+        the pattern ignores case.
+    '''
+    if pattern.flags & (re.IGNORECASE | re.LOCALE):
+        return []
+
+    parsedPattern = sre_parse.parse(pattern.pattern, pattern.flags)
+    if parsedPattern.pattern.flags & (re.IGNORECASE | re.LOCALE):
+        return []
+
+    literals = []
+    isBytes = isinstance(pattern.pattern, str)
+    collectRequiredLiterals(parsedPattern, literals, isBytes)
+    return [literal for literal in literals if literal is not None]
+
+def collectRequiredLiterals(subpattern, literals, isBytes):
+    u'''
+    Collect required literals from a parsed pattern.
+
+    Arguments :
+        subpattern : Pattern that is parsed by sre_parse.
+        literals : List that literals are appended to. None is appended if
+            the literal cannot be represented as unicode.
+        isBytes : True if the pattern is str.
+    '''
+    characters = []
+    def appendLiteral():
+        if characters:
+            literals.append(u''.join(characters))
+            del characters[:]
+
+    for operation, argument in subpattern:
+        if operation == sre_constants.LITERAL:
+            if isBytes and 0x80 <= argument:
+                # A byte of str pattern is not a character.
+                appendLiteral()
+                literals.append(None)
+            else:
+                characters.append(unichr(argument))
+            continue
+
+        appendLiteral()
+        if operation == sre_constants.SUBPATTERN:
+            collectRequiredLiterals(argument[-1], literals, isBytes)
+        elif operation in (sre_constants.MAX_REPEAT,
+                sre_constants.MIN_REPEAT) and 1 <= argument[0]:
+            collectRequiredLiterals(argument[-1], literals, isBytes)
+
+    appendLiteral()
+
+# Categories of sre_parse that match a line break.
+lineBreakCategories = (sre_constants.CATEGORY_SPACE,
+    sre_constants.CATEGORY_NOT_DIGIT, sre_constants.CATEGORY_NOT_WORD,
+    sre_constants.CATEGORY_LINEBREAK)
+
+def canSpanLines(pattern):
+    u'''
+    Check whether a pattern can match a string that contains a line break.
+
+    Back references are assumed to match a line break.
+
+    Arguments :
+        pattern : Compiled regular expression pattern.
+    '''
+    parsedPattern = sre_parse.parse(pattern.pattern, pattern.flags)
+    return matchesLineBreak(
+        parsedPattern, parsedPattern.pattern.flags & re.DOTALL)
+
+def matchesLineBreak(subpattern, isDotAll):
+    u'''
+    Check whether a parsed pattern can match a line break.
+
+    Arguments :
+        subpattern : Pattern that is parsed by sre_parse.
+        isDotAll : True if "." matches a line break.
+    '''
+    for operation, argument in subpattern:
+        if operation == sre_constants.LITERAL:
+            if argument == ord('\n'):
+                return True
+        elif operation == sre_constants.NOT_LITERAL:
+            if argument != ord('\n'):
+                return True
+        elif operation == sre_constants.ANY:
+            if isDotAll:
+                return True
+        elif operation == sre_constants.IN:
+            if setMatchesLineBreak(argument):
+                return True
+        elif operation == sre_constants.CATEGORY:
+            if argument in lineBreakCategories:
+                return True
+        elif operation in (sre_constants.SUBPATTERN,
+                sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            if matchesLineBreak(argument[-1], isDotAll):
+                return True
+        elif operation == sre_constants.BRANCH:
+            for branch in argument[1]:
+                if matchesLineBreak(branch, isDotAll):
+                    return True
+        elif operation == sre_constants.GROUPREF_EXISTS:
+            for branch in argument[1:]:
+                if branch and matchesLineBreak(branch, isDotAll):
+                    return True
+        elif operation == sre_constants.GROUPREF:
+            return True
+    return False
+
+def setMatchesLineBreak(items):
+    u'''
+    Check whether a parsed character set such as "[^a-z]" matches
+    a line break.
+
+    Arguments :
+        items : List of items of the set that is parsed by sre_parse.
+    '''
+    isNegated = False
+    containsLineBreak = False
+    for operation, argument in items:
+        if operation == sre_constants.NEGATE:
+            isNegated = True
+        elif operation == sre_constants.LITERAL:
+            containsLineBreak |= argument == ord('\n')
+        elif operation == sre_constants.RANGE:
+            containsLineBreak |= argument[0] <= ord('\n') <= argument[1]
+        elif operation == sre_constants.CATEGORY:
+            containsLineBreak |= argument in lineBreakCategories
+    return containsLineBreak != isNegated
+
+# Patterns that replace assertions at the end of the searched string.
+# "$" matches before a line break, "\Z" never matches, and "\b" and "\B"
+# require the next character.
+endAssertionReplacements = {
+    sre_constants.AT_END : ur'(?=\n)',
+    sre_constants.AT_END_STRING : ur'(?!)',
+    sre_constants.AT_BOUNDARY : ur'(?:(?<=\w)(?=\W)|(?<!\w)(?=\w))',
+    sre_constants.AT_NON_BOUNDARY : ur'(?:(?<=\w)(?=\w)|(?<!\w)(?=\W))'}
+
+def createIncrementalPattern(pattern):
+    u'''
+    Create a pattern that gives the same result however received log is
+    split into fed log.
+
+    The end of fed log is not the end of the log, so assertions are
+    replaced so that they do not match there. "$" matches before a line
+    break with or without MULTILINE, as each line used to be matched as
+    the end of log. "\Z" never matches because the watched log does not
+    end. "\b" and "\B" require the next character. "^" and "\A" are kept
+    and match at the head of the waited log, because findCarryOver keeps
+    the character before the tail that is searched again.
+
+    Arguments :
+        pattern : Compiled regular expression pattern.
+    Return :
+        Compiled pattern, or pattern itself if it has no such assertion.
+        The pattern attribute of the created pattern is None.
+    '''
+    parsedPattern = sre_parse.parse(pattern.pattern, pattern.flags)
+    flags = parsedPattern.pattern.flags
+    replacements = {}
+    for code, replacement in endAssertionReplacements.items():
+        if isinstance(pattern.pattern, str):
+            replacement = str(replacement)
+        replacements[code] = sre_parse.parse(replacement, flags).data
+    if not replaceEndAssertions(parsedPattern, replacements):
+        return pattern
+    return sre_compile.compile(parsedPattern, flags)
+
+def replaceEndAssertions(subpattern, replacements):
+    u'''
+    Replace assertions at the end of the searched string in a parsed
+    pattern.
+
+    Arguments :
+        subpattern : Pattern that is parsed by sre_parse. It is modified.
+        replacements : dict of parsed items that replace assertions by
+            their codes.
+    Return :
+        True if any assertion is replaced.
+    '''
+    isReplaced = False
+    index = 0
+    while index < len(subpattern.data):
+        operation, argument = subpattern.data[index]
+        if operation == sre_constants.AT and argument in replacements:
+            items = replacements[argument]
+            subpattern.data[index:index + 1] = items
+            index += len(items)
+            isReplaced = True
+            continue
+
+        if operation in (sre_constants.SUBPATTERN,
+                sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            isReplaced |= replaceEndAssertions(argument[-1], replacements)
+        elif operation == sre_constants.BRANCH:
+            for branch in argument[1]:
+                isReplaced |= replaceEndAssertions(branch, replacements)
+        elif operation == sre_constants.GROUPREF_EXISTS:
+            for branch in argument[1:]:
+                if branch:
+                    isReplaced |= replaceEndAssertions(branch, replacements)
+        index += 1
+    return isReplaced
+
+def findCarryOver(searchedLog, spansLines, carryOverLength):
+    u'''
+    Find the tail of searched log that is searched again with newly
+    received log.
+
+    If the pattern cannot span lines, only the incomplete last line is
+    searched again. Otherwise, the last carryOverLength characters are
+    searched again. The head of the line before the searched tail is kept
+    as context, so that anchors such as "(?m)^" and lookbehinds do not
+    match in the middle of a line when the tail is searched from
+    the position. The character before the context is also kept, so that
+    the head of the carried over log is not the head of the log for "^"
+    and "\A".
+
+    Arguments :
+        searchedLog : Searched str or unicode log.
+        spansLines : True if the pattern can span lines.
+        carryOverLength : Maximum length of the searched tail and
+            the context.
+    Return :
+        Tuple of the offset of the kept context and the offset where
+        the next search begins.
+    '''
+    length = len(searchedLog)
+    begin = searchedLog.rfind('\n') + 1
+    if spansLines or carryOverLength < length - begin:
+        begin = max(length - carryOverLength, 0)
+    context = max(searchedLog.rfind('\n', 0, begin) + 1,
+        begin - carryOverLength)
+    if context:
+        context -= 1
+    return context, begin
+
+class BytesStringMatcher(StringMatcher):
+    u'''
+    Incremental matcher that finds a string in raw log encoded in UTF-8.
+
+    Log is not decoded for matching.
+    '''
+
+    acceptsBytes = True
+
+    def __init__(self, match):
+        u'''
+        Constructor.
+
+        Arguments :
+            match : Searching unicode string.
+        '''
+        StringMatcher.__init__(self, match.encode('utf8'))
+
+class BytesPatternMatcher:
+    u'''
+    Incremental matcher that searches a regular expression pattern in raw log
+    encoded in UTF-8.
+
+    Literals that are required by the pattern are searched in raw log.
+    Only if all of them are found, the log is decoded and the pattern is
+    searched. Therefore, the pattern must have required literals.
+    '''
+
+    acceptsBytes = True
+
+    def __init__(self, pattern, literals, carryOverLength = None):
+        u'''
+        Constructor.
+
+        Arguments :
+            pattern : Compiled regular expression pattern.
+            literals : List of unicode literals that are required by
+                the pattern. It is created by findRequiredLiterals.
+            carryOverLength : Bytes of the tail of log that is searched again
+                with newly received log. If it is None,
+                defaultCarryOverLength is used.
+        '''
+        if carryOverLength is None:
+            carryOverLength = defaultCarryOverLength
+
+        self.__pattern = createIncrementalPattern(pattern)
+        self.__spansLines = canSpanLines(pattern)
+        self.__literals = [literal.encode('utf8') for literal in literals]
+        self.__carryOverLength = carryOverLength
+        self.__carryOver = ''
+        self.__searchBegin = 0
+
+    def feed(self, log):
+        u'''
+        Match newly received log.
+
+        Arguments :
+            log : str that is received after the last feeding.
+        Return :
+            Match object of decoded log if the pattern is matched,
+            None otherwise.
+        '''
+        searchedLog = self.__carryOver + log
+
+        for literal in self.__literals:
+            if searchedLog.find(literal, self.__searchBegin) < 0:
+                break
+        else:
+            result = self.__pattern.search(
+                unicode(searchedLog, 'utf8', 'replace'),
+                len(unicode(searchedLog[:self.__searchBegin], 'utf8',
+                    'replace')))
+            if result:
+                return result
+
+        context, begin = findCarryOver(
+            searchedLog, self.__spansLines, self.__carryOverLength)
+
+        # Do not split a character at the head of the tail and the context.
+        while begin < len(searchedLog) and \
+                '\x80' <= searchedLog[begin] <= '\xbf':
+            begin += 1
+        while 0 < context and '\x80' <= searchedLog[context] <= '\xbf':
+            context -= 1
+        self.__carryOver = searchedLog[context:]
+        self.__searchBegin = begin - context
+
+        return None
+
+class AhoCorasick:
+    u'''
+    Automaton that finds many strings in a single pass over text.
+
+    The state of the automaton is kept between searches, so strings that span
+    searched texts are also found.
+    '''
+
+    def __init__(self, keywords):
+        u'''
+        Constructor.
+
+        Arguments :
+            keywords : List of unicode strings that are not empty.
+        '''
+        # Transitions, failure links and indexes of keywords that end at
+        # each state. The state 0 is the root.
+        self.__transitions = [{}]
+        self.__failures = [0]
+        self.__outputs = [[]]
+
+        for keywordIndex, keyword in enumerate(keywords):
+            state = 0
+            for character in keyword:
+                nextState = self.__transitions[state].get(character)
+                if nextState is None:
+                    nextState = len(self.__transitions)
+                    self.__transitions[state][character] = nextState
+                    self.__transitions.append({})
+                    self.__failures.append(0)
+                    self.__outputs.append([])
+                state = nextState
+            self.__outputs[state].append(keywordIndex)
+
+        # Build failure links by breadth first search.
+        queue = list(self.__transitions[0].values())
+        for state in queue:
+            for character, nextState in self.__transitions[state].items():
+                queue.append(nextState)
+
+                failure = self.__failures[state]
+                while failure and character not in self.__transitions[failure]:
+                    failure = self.__failures[failure]
+                failure = self.__transitions[failure].get(character, 0)
+
+                self.__failures[nextState] = failure
+                self.__outputs[nextState] = \
+                    self.__outputs[nextState] + self.__outputs[failure]
+
+        self.__state = 0
+
+    def search(self, text):
+        u'''
+        Search keywords in text that follows the previous searched text.
+
+        Arguments :
+            text : Searched unicode string.
+        Return :
+            List of tuples of index of the keyword and the position after
+            the keyword in text.
+        '''
+        transitions = self.__transitions
+        failures = self.__failures
+        outputs = self.__outputs
+
+        found = []
+        state = self.__state
+        for position, character in enumerate(text):
+            while state and character not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(character, 0)
+
+            if outputs[state]:
+                for keywordIndex in outputs[state]:
+                    found.append((keywordIndex, position + 1))
+
+        self.__state = state
+        return found
+
+class PatternHit:
+    u'''
+    A string or a pattern that is found in log.
+
+    Attributes :
+        match : The string or the compiled pattern that is found.
+        start : Offset of the head of the found string in the waited log.
+        end : Offset after the found string in the waited log.
+        matchObject : Match object if match is a pattern, None otherwise.
+    '''
+
+    def __init__(self, match, start, end, matchObject = None):
+        self.match = match
+        self.start = start
+        self.end = end
+        self.matchObject = matchObject
+
+    def __repr__(self):
+        return 'PatternHit(%r, %d, %d)' % (self.match, self.start, self.end)
+
+# Regular expression that finds back references, conditional references
+# and global flags in a pattern. Patterns that have them cannot be combined
+# into one pattern because groups are numbered again.
+uncombinablePattern = re.compile(
+    r'\\[1-9]|\(\?P=|\(\?\(|\(\?[iLmsux]+\)')
+
+# Maximum number of groups of a combined pattern. Python 2 cannot compile
+# a pattern that has more than 100 groups.
+maximumCombinedGroups = 100
+
+class MultiMatcher:
+    u'''
+    Incremental matcher that finds many strings and patterns in a single pass.
+
+    Strings are found by an Aho-Corasick automaton. Patterns that have
+    the same flags are combined into one pattern that filters log before
+    each pattern is searched. Patterns that cannot span lines search
+    the incomplete last line again with newly received log, and the others
+    search the tail of carryOverLength characters again.
+    '''
+
+    def __init__(self, matches, patterns, requiresAll,
+            carryOverLength = None):
+        u'''
+        Constructor.
+
+        Arguments :
+            matches : List of unicode strings.
+            patterns : List of compiled regular expression patterns.
+            requiresAll : True if all strings and patterns must be found.
+                Otherwise, any of them is enough.
+            carryOverLength : Length of the tail of log that is searched again
+                by patterns with newly received log. If it is None,
+                defaultCarryOverLength is used.
+        '''
+        if carryOverLength is None:
+            carryOverLength = defaultCarryOverLength
+
+        self.__matches = list(matches)
+        self.__patterns = list(patterns)
+        self.__searchedPatterns = [createIncrementalPattern(pattern)
+            for pattern in self.__patterns]
+        self.__requiresAll = requiresAll
+        self.__carryOverLength = carryOverLength
+        self.__carryOver = u''
+        self.__offset = 0
+
+        # Offsets in the carried over log where patterns that cannot span
+        # lines and the others begin the next search.
+        self.__lineSearchBegin = 0
+        self.__spanSearchBegin = 0
+
+        # Found hits indexed by strings and then patterns.
+        self.__hits = [None] * (len(self.__matches) + len(self.__patterns))
+        self.__hitCount = 0
+
+        # Empty strings are found at the head of log.
+        keywords = []
+        self.__keywordIndexes = []
+        self.__emptyMatchIndexes = []
+        for index, match in enumerate(self.__matches):
+            if match:
+                keywords.append(match)
+                self.__keywordIndexes.append(index)
+            else:
+                self.__emptyMatchIndexes.append(index)
+        self.__automaton = AhoCorasick(keywords)
+
+        # Combine patterns by flags and whether they can span lines.
+        # Patterns that have back references are searched alone.
+        combinedPatterns = {}
+        self.__filters = []
+        self.__spansLines = False
+        for index, pattern in enumerate(self.__patterns):
+            spansLines = canSpanLines(pattern)
+            self.__spansLines |= spansLines
+            if uncombinablePattern.search(pattern.pattern):
+                self.__filters.append(
+                    (self.__searchedPatterns[index], [index], spansLines))
+            else:
+                combinedPatterns.setdefault(
+                    (pattern.flags, spansLines), []).append(index)
+
+        for (flags, spansLines), indexes in combinedPatterns.items():
+            # Split the patterns so that each combined pattern does not
+            # have too many groups.
+            combinedIndexes = []
+            groupCount = 0
+            for index in indexes:
+                groups = self.__patterns[index].groups
+                if combinedIndexes and \
+                        maximumCombinedGroups < groupCount + groups:
+                    self.__combinePatterns(combinedIndexes, flags, spansLines)
+                    combinedIndexes = []
+                    groupCount = 0
+                combinedIndexes.append(index)
+                groupCount += groups
+            self.__combinePatterns(combinedIndexes, flags, spansLines)
+
+    def __combinePatterns(self, indexes, flags, spansLines):
+        u'''
+        Add a filter that combines patterns.
+
+        The combined pattern is compiled with MULTILINE, so that "^" and "$"
+        of the patterns match wherever the patterns from
+        createIncrementalPattern can match. If the patterns cannot be
+        combined, each pattern is added as a filter.
+
+        Arguments :
+            indexes : List of indexes of the patterns.
+            flags : Flags of the patterns.
+            spansLines : True if the patterns can span lines.
+        '''
+        try:
+            combinedPattern = re.compile(u'|'.join(
+                [u'(?:%s)' % self.__patterns[index].pattern
+                    for index in indexes]), flags | re.MULTILINE)
+            self.__filters.append((combinedPattern, indexes, spansLines))
+        except (re.error, UnicodeError, AssertionError):
+            for index in indexes:
+                self.__filters.append(
+                    (self.__searchedPatterns[index], [index], spansLines))
+
+    def __addHit(self, index, hit):
+        u'''
+        Add a hit if the string or the pattern is not found yet.
+        '''
+        if self.__hits[index] is None:
+            self.__hits[index] = hit
+            self.__hitCount += 1
+
+    def feed(self, log):
+        u'''
+        Match newly received log.
+
+        Arguments :
+            log : unicode that is received after the last feeding.
+        Return :
+            List of PatternHit objects if it is matched, None otherwise.
+            If any of them is required, the list contains strings and patterns
+            that are found in the log in order of their positions.
+            If all of them are required, the list contains the first hit of
+            each string and pattern in order of arguments.
+        '''
+        previousHitCount = self.__hitCount
+        matchCount = len(self.__matches)
+
+        for index in self.__emptyMatchIndexes:
+            self.__addHit(index, PatternHit(u'', self.__offset, self.__offset))
+
+        # Find strings.
+        for keywordIndex, end in self.__automaton.search(log):
+            index = self.__keywordIndexes[keywordIndex]
+            match = self.__matches[index]
+            self.__addHit(index, PatternHit(
+                match, self.__offset + end - len(match),
+                self.__offset + end))
+
+        # Find patterns only if the combined pattern is found.
+        searchedLog = self.__carryOver + log
+        searchedOffset = self.__offset - len(self.__carryOver)
+        for filterPattern, indexes, spansLines in self.__filters:
+            if spansLines:
+                begin = self.__spanSearchBegin
+            else:
+                begin = self.__lineSearchBegin
+            if not filterPattern.search(searchedLog, begin):
+                continue
+
+            for index in indexes:
+                if self.__hits[matchCount + index] is not None:
+                    continue
+
+                pattern = self.__patterns[index]
+                result = self.__searchedPatterns[index].search(
+                    searchedLog, begin)
+                if result:
+                    self.__addHit(matchCount + index, PatternHit(
+                        pattern, searchedOffset + result.start(),
+                        searchedOffset + result.end(), result))
+
+        self.__offset += len(log)
+        if self.__filters:
+            context, lineBegin = findCarryOver(
+                searchedLog, False, self.__carryOverLength)
+            spanBegin = lineBegin
+            if self.__spansLines:
+                spanContext, spanBegin = findCarryOver(
+                    searchedLog, True, self.__carryOverLength)
+                context = min(context, spanContext)
+            self.__carryOver = searchedLog[context:]
+            self.__lineSearchBegin = lineBegin - context
+            self.__spanSearchBegin = spanBegin - context
+
+        if self.__requiresAll:
+            if self.__hitCount == len(self.__hits):
+                return list(self.__hits)
+        elif previousHitCount < self.__hitCount:
+            hits = [hit for hit in self.__hits if hit is not None]
+            hits.sort(key = lambda hit: hit.start)
+            return hits
+
+        return None
+
+class SequenceMatcher:
+    u'''
+    Incremental matcher that finds strings and patterns in order.
+
+    Only the next expected step is searched in newly received log.
+    Each step can have its own timeout that is measured from the time when
+    the previous step is found.
+    '''
+
+    def __init__(self, steps, carryOverLength = None):
+        u'''
+        Constructor.
+
+        Arguments :
+            steps : List of steps. A step is a unicode string,
+                a compiled regular expression pattern or a tuple of one of them
+                and seconds until timeout of the step.
+            carryOverLength : Length of the tail of log that is searched again
+                by patterns with newly received log. If it is None,
+                defaultCarryOverLength is used.
+        '''
+        if carryOverLength is None:
+            carryOverLength = defaultCarryOverLength
+
+        self.__steps = []
+        for step in steps:
+            if isinstance(step, tuple):
+                self.__steps.append(step)
+            else:
+                self.__steps.append((step, None))
+
+        self.__patternCarryOverLength = carryOverLength
+        self.__carryOver = u''
+        self.__offset = 0
+
+        # Offset in the carried over log where the next search begins, and
+        # whether patterns of steps can span lines and the patterns that are
+        # searched.
+        self.__carryOverBegin = 0
+        self.__spansLines = {}
+        self.__searchedPatterns = {}
+        for match, stepTimeout in self.__steps:
+            if not isinstance(match, basestring):
+                self.__spansLines[id(match)] = canSpanLines(match)
+                self.__searchedPatterns[id(match)] = \
+                    createIncrementalPattern(match)
+
+        # Offset after the found string of the previous step.
+        self.__searchOffset = 0
+
+        self.__hits = []
+        self.__isStarted = False
+        self.__deadline = None
+        self.__isExpired = False
+
+    def __startStep(self, now):
+        u'''
+        Start waiting the next step.
+        '''
+        if len(self.__hits) < len(self.__steps):
+            stepTimeout = self.__steps[len(self.__hits)][1]
+            if stepTimeout is None:
+                self.__deadline = None
+            else:
+                self.__deadline = now + stepTimeout
+
+    def getDeadline(self):
+        u'''
+        Get time when the current step is timed out.
+
+        Return :
+            Time as seconds since the epoch, or None if the step has no timeout.
+        '''
+        return self.__deadline
+
+    def feed(self, log):
+        u'''
+        Match newly received log.
+
+        Arguments :
+            log : unicode that is received after the last feeding.
+        Return :
+            List of PatternHit objects of all steps if all steps are found
+            in order, None otherwise.
+        '''
+        now = time.time()
+        if not self.__isStarted:
+            self.__isStarted = True
+            self.__startStep(now)
+
+        # Ignore log after the step is timed out.
+        if self.__isExpired or \
+                self.__deadline is not None and self.__deadline < now:
+            self.__isExpired = True
+            return None
+
+        searchedLog = self.__carryOver + log
+        searchedOffset = self.__offset - len(self.__carryOver)
+
+        # Search the next step after the previous step.
+        while len(self.__hits) < len(self.__steps):
+            match = self.__steps[len(self.__hits)][0]
+            begin = max(self.__searchOffset - searchedOffset,
+                self.__carryOverBegin)
+            if isinstance(match, basestring):
+                start = searchedLog.find(match, begin)
+                if start < 0:
+                    break
+                hit = PatternHit(match, searchedOffset + start,
+                    searchedOffset + start + len(match))
+            else:
+                result = self.__searchedPatterns[id(match)].search(
+                    searchedLog, begin)
+                if not result:
+                    break
+                hit = PatternHit(match, searchedOffset + result.start(),
+                    searchedOffset + result.end(), result)
+
+            self.__hits.append(hit)
+            self.__searchOffset = hit.end
+            self.__startStep(now)
+
+        self.__offset += len(log)
+
+        if len(self.__hits) == len(self.__steps):
+            return list(self.__hits)
+
+        # Keep the tail that may contain the head of the next step.
+        match = self.__steps[len(self.__hits)][0]
+        if isinstance(match, basestring):
+            carryOverLength = max(len(match) - 1, 0)
+            begin = max(len(searchedLog) - carryOverLength, 0)
+            context = max(begin - 1, 0)
+        else:
+            context, begin = findCarryOver(searchedLog,
+                self.__spansLines[id(match)], self.__patternCarryOverLength)
+        self.__carryOver = searchedLog[context:]
+        self.__carryOverBegin = begin - context
+
+        return None
+
+# Priorities of log. "A" is assert, "F" is fatal and they are the same.
+logPriorities = {
+    u'V' : 2, u'D' : 3, u'I' : 4, u'W' : 5, u'E' : 6, u'F' : 7, u'A' : 7,
+    u'S' : 8}
+
+class LogRecord(object):
+    u'''
+    A line of logcat that is parsed into fields.
+
+    Attributes :
+        timestamp : unicode that represents "MM-DD hh:mm:ss.mmm",
+            or None if the format does not have time.
+        pid : Process ID.
+        tid : Thread ID, or None if the format does not have it.
+        level : unicode that represents priority such as u'I'.
+        tag : Tag of the log.
+        message : Message of the log without the line separator.
+    '''
+
+    __slots__ = ('timestamp', 'pid', 'tid', 'level', 'tag', 'message')
+
+    def __init__(self, timestamp, pid, tid, level, tag, message):
+        self.timestamp = timestamp
+        self.pid = pid
+        self.tid = tid
+        self.level = level
+        self.tag = tag
+        self.message = message
+
+    def __repr__(self):
+        return 'LogRecord(%r, %r, %r, %r, %r, %r)' % (
+            self.timestamp, self.pid, self.tid, self.level, self.tag,
+            self.message)
+
+class LogRecordParser:
+    u'''
+    Parser of lines of logcat.
+
+    "threadtime", "time" and "brief" formats are supported.
+    The format that is parsed last is tried first because the format of
+    a stream is not changed.
+    '''
+
+    # Patterns of formats. Their groups are timestamp, pid, tid, level,
+    # tag and message.
+    threadtimePattern = re.compile(
+        ur'(\d\d-\d\d \d\d:\d\d:\d\d\.\d+)\s+(\d+)\s+(\d+) ([VDIWEFAS]) ' +
+        ur'(.*?)\s*: (.*?)\r?\n?$')
+    timePattern = re.compile(
+        ur'(\d\d-\d\d \d\d:\d\d:\d\d\.\d+) ([VDIWEFAS])/(.*?)\s*' +
+        ur'\(\s*(\d+)\): (.*?)\r?\n?$')
+    briefPattern = re.compile(
+        ur'([VDIWEFAS])/(.*?)\s*\(\s*(\d+)\): (.*?)\r?\n?$')
+
+    def __init__(self):
+        u'''
+        Constructor.
+        '''
+        self.__parsers = [
+            self.__parseThreadtime, self.__parseTime, self.__parseBrief]
+
+    def __parseThreadtime(self, line):
+        u'''
+        Parse a line of "threadtime" format.
+        '''
+        result = self.threadtimePattern.match(line)
+        if result:
+            timestamp, pid, tid, level, tag, message = result.groups()
+            return LogRecord(
+                timestamp, int(pid), int(tid), level, tag, message)
+        return None
+
+    def __parseTime(self, line):
+        u'''
+        Parse a line of "time" format.
+        '''
+        result = self.timePattern.match(line)
+        if result:
+            timestamp, level, tag, pid, message = result.groups()
+            return LogRecord(timestamp, int(pid), None, level, tag, message)
+        return None
+
+    def __parseBrief(self, line):
+        u'''
+        Parse a line of "brief" format.
+        '''
+        result = self.briefPattern.match(line)
+        if result:
+            level, tag, pid, message = result.groups()
+            return LogRecord(None, int(pid), None, level, tag, message)
+        return None
+
+    def parse(self, line):
+        u'''
+        Parse a line.
+
+        Arguments :
+            line : unicode line of logcat.
+        Return :
+            LogRecord, or None if the line is not a supported format.
+        '''
+        for index, parser in enumerate(self.__parsers):
+            record = parser(line)
+            if record:
+                # Try the parsed format first at the next time.
+                if index:
+                    del self.__parsers[index]
+                    self.__parsers.insert(0, parser)
+                return record
+        return None
+
+class RecordPredicate:
+    u'''
+    Condition of fields of LogRecord.
+    '''
+
+    def __init__(self, tag = None, level = None, message = None, pid = None):
+        u'''
+        Constructor.
+
+        Arguments :
+            tag : Tag that is equal to the tag of a record, or None.
+            level : The lowest priority such as u'I', or None.
+            message : unicode string that is found in the message of a record,
+                compiled regular expression pattern that is searched in
+                the message, or None.
+            pid : Process ID of a record, or None.
+        Exception :
+            ValueError : If level is unknown.
+        '''
+        if level is not None and level not in logPriorities:
+            raise ValueError(u'Unknown level : ' + unicode(level))
+
+        self.tag = tag
+        self.level = level
+        self.message = message
+        self.pid = pid
+
+        if level is None:
+            self.__priority = None
+        else:
+            self.__priority = logPriorities[level]
+
+    def test(self, record):
+        u'''
+        Test a record.
+
+        The tag was tested by the index of RecordMatcher, so the message is
+        tested last.
+
+        Arguments :
+            record : LogRecord.
+        Return :
+            True if the record satisfies this condition.
+        '''
+        if self.tag is not None and self.tag != record.tag:
+            return False
+        if self.__priority is not None and \
+                logPriorities[record.level] < self.__priority:
+            return False
+        if self.pid is not None and self.pid != record.pid:
+            return False
+
+        if self.message is None:
+            return True
+        elif isinstance(self.message, basestring):
+            return 0 <= record.message.find(self.message)
+        else:
+            return bool(self.message.search(record.message))
+
+# Tags that can be written in filterspecs of logcat.
+filterspecTagPattern = re.compile(ur'^[^\s:*]+$')
+
+def createFilterspec(predicates, filtersPid = False):
+    u'''
+    Create arguments of logcat that filter log by predicates on the device.
+
+    Filterspecs such as "TAG:LEVEL *:S" are created from tags and levels of
+    the predicates. Messages are not used for filtering, and process IDs
+    are not used unless filtersPid is True. RecordMatcher tests them on
+    received lines.
+
+    Arguments :
+        predicates : List of RecordPredicate.
+        filtersPid : True if "--pid" is also created when all predicates
+            have the same process ID. It requires Android 7.0 or above.
+    Return :
+        unicode arguments of logcat.
+    '''
+    # The lowest priority of predicates that can match any tag.
+    untaggedPriority = None
+    tagPriorities = {}
+    for predicate in predicates:
+        priority = logPriorities[predicate.level or u'V']
+        if predicate.tag is not None and \
+                filterspecTagPattern.match(predicate.tag):
+            tagPriorities[predicate.tag] = min(
+                tagPriorities.get(predicate.tag, priority), priority)
+        elif untaggedPriority is None or priority < untaggedPriority:
+            untaggedPriority = priority
+
+    # Lines of the tags are also required by predicates without tag.
+    levels = {}
+    for level, priority in logPriorities.items():
+        if level != u'A':
+            levels[priority] = level
+
+    filterspecs = []
+    for tag in sorted(tagPriorities.keys()):
+        priority = tagPriorities[tag]
+        if untaggedPriority is not None:
+            priority = min(priority, untaggedPriority)
+        filterspecs.append(tag + u':' + levels[priority])
+
+    if untaggedPriority is None:
+        filterspecs.append(u'*:S')
+    else:
+        filterspecs.append(u'*:' + levels[untaggedPriority])
+
+    pids = set([predicate.pid for predicate in predicates])
+    if filtersPid and predicates and len(pids) == 1 and None not in pids:
+        filterspecs.insert(0, u'--pid=%d' % pids.pop())
+
+    return u' '.join(filterspecs)
+
+class RecordMatcher:
+    u'''
+    Incremental matcher that parses lines and tests their fields.
+
+    Predicates are indexed by tag, so most of lines are tested by
+    a dictionary lookup before their messages are searched.
+    '''
+
+    def __init__(self, predicates, parser = None):
+        u'''
+        Constructor.
+
+        Arguments :
+            predicates : List of RecordPredicate.
+            parser : LogRecordParser. If it is None, a new parser is created.
+        '''
+        if parser is None:
+            parser = LogRecordParser()
+        self.__parser = parser
+
+        # Predicates indexed by tag, and predicates without tag.
+        self.__predicatesByTag = {}
+        self.__untaggedPredicates = []
+        for predicate in predicates:
+            if predicate.tag is None:
+                self.__untaggedPredicates.append(predicate)
+            else:
+                self.__predicatesByTag.setdefault(
+                    predicate.tag, []).append(predicate)
+
+        # Head of the line that is not terminated yet.
+        self.__incompleteLine = u''
+
+    def feed(self, log):
+        u'''
+        Match newly received log.
+
+        Arguments :
+            log : unicode that is received after the last feeding.
+        Return :
+            The first LogRecord that satisfies any of the predicates,
+            None otherwise.
+        '''
+        lines = (self.__incompleteLine + log).split(u'\n')
+        self.__incompleteLine = lines.pop()
+
+        for line in lines:
+            record = self.__parser.parse(line)
+            if not record:
+                continue
+
+            predicates = self.__predicatesByTag.get(record.tag)
+            if predicates:
+                for predicate in predicates:
+                    if predicate.test(record):
+                        return record
+            for predicate in self.__untaggedPredicates:
+                if predicate.test(record):
+                    return record
+
+        return None
+
+class LogSnapshot:
+    u'''
+    Lines of LogBuffer at the moment when the snapshot is taken.
+
+    LogBuffer never modifies stored lines, so the snapshot is not changed by
+    lines that are appended or evicted later. Reading the snapshot does not
+    block appending lines.
+    '''
+
+    def __init__(self, lineSegments, offsetSegments, removedLineCount,
+            lineCount, evictedLineCount, length, spilledLength, joinedLog):
+        u'''
+        Constructor.
+
+        Arguments :
+            lineSegments : List of segments of lines.
+            offsetSegments : List of segments of offsets of the head of
+                each line in the whole log.
+            removedLineCount : Number of lines in removed segments.
+            lineCount : Number of lines of the whole log.
+            evictedLineCount : Number of evicted lines.
+            length : Number of characters of the whole log.
+            spilledLength : Bytes of the temporary file for spilled lines.
+            joinedLog : List that holds the joined log shared with LogBuffer.
+        '''
+        self.__lineSegments = lineSegments
+        self.__offsetSegments = offsetSegments
+        self.__removedLineCount = removedLineCount
+        self.__lineCount = lineCount
+        self.__evictedLineCount = evictedLineCount
+        self.__length = length
+        self.__spilledLength = spilledLength
+        self.__joinedLog = joinedLog
+
+    def getLength(self):
+        u'''
+        Get the number of characters of the whole log.
+        '''
+        return self.__length
+
+    def getLineCount(self):
+        u'''
+        Get the number of lines of the whole log.
+        '''
+        return self.__lineCount
+
+    def getFirstLineIndex(self):
+        u'''
+        Get index of the first line that is kept in memory.
+        '''
+        return self.__evictedLineCount
+
+    def getSpilledLength(self):
+        u'''
+        Get bytes of the temporary file for spilled lines.
+        '''
+        return self.__spilledLength
+
+    def getOffset(self, index):
+        u'''
+        Get offset of the head of the line in the whole log.
+
+        Arguments :
+            index : Index of a line in memory or the number of lines.
+        '''
+        if index == self.__lineCount:
+            return self.__length
+
+        position = index - self.__removedLineCount
+        return self.__offsetSegments[
+            position // segmentLength][position % segmentLength]
+
+    def getLines(self, begin = 0, end = None):
+        u'''
+        Get a list of lines in memory.
+
+        Arguments :
+            begin : Index of the first line. Indexes of evicted lines are
+                treated as the first line in memory.
+            end : Index after the last line. If it is None,
+                lines until the tail are returned.
+        '''
+        if end is None:
+            end = self.__lineCount
+        begin = max(begin, self.__evictedLineCount)
+        end = min(end, self.__lineCount)
+
+        lines = []
+        while begin < end:
+            position = begin - self.__removedLineCount
+            segment = self.__lineSegments[position // segmentLength]
+            head = position % segmentLength
+            tail = min(segmentLength, head + end - begin)
+            lines.extend(segment[head:tail])
+            begin += tail - head
+        return lines
+
+    def getText(self, begin = 0, end = None):
+        u'''
+        Get joined lines in memory.
+
+        Arguments :
+            begin : Index of the first line.
+            end : Index after the last line. If it is None,
+                lines until the tail are joined.
+        '''
+        if end is None:
+            end = self.__lineCount
+        end = min(max(end, self.__evictedLineCount), self.__lineCount)
+
+        if self.__evictedLineCount < begin:
+            return ''.join(self.getLines(begin, end))
+
+        # Join only lines that are not joined yet for the whole log
+        # in memory. The joined log is valid if it begins at the first line
+        # in memory, and it may be longer than this snapshot.
+        joinedBeginIndex, joinedEndIndex, joinedLog = self.__joinedLog[0]
+        if joinedBeginIndex != self.__evictedLineCount:
+            joinedBeginIndex = self.__evictedLineCount
+            joinedEndIndex = self.__evictedLineCount
+            joinedLog = ''
+        if joinedEndIndex < end:
+            joinedLog += ''.join(self.getLines(joinedEndIndex, end))
+            joinedEndIndex = end
+            self.__joinedLog[0] = (joinedBeginIndex, joinedEndIndex, joinedLog)
+
+        if end == joinedEndIndex:
+            return joinedLog
+        return joinedLog[:
+            self.getOffset(end) - self.getOffset(joinedBeginIndex)]
+
+    def getLineIndex(self, offset):
+        u'''
+        Get index of the line in memory that contains the character.
+
+        Arguments :
+            offset : Offset of the character in the whole log.
+        Return :
+            Index of the line, or None if the line is evicted.
+        '''
+        # Find the last segment that begins at or before the offset.
+        lineCount = self.__lineCount - self.__removedLineCount
+        low = 0
+        high = (lineCount + segmentLength - 1) // segmentLength
+        while low < high:
+            middle = (low + high) // 2
+            if offset < self.__offsetSegments[middle][0]:
+                high = middle
+            else:
+                low = middle + 1
+        if low == 0:
+            return None
+
+        segmentIndex = low - 1
+        position = bisect.bisect_right(
+            self.__offsetSegments[segmentIndex], offset, 0,
+            min(segmentLength, lineCount - segmentIndex * segmentLength)) - 1
+        index = self.__removedLineCount + \
+            segmentIndex * segmentLength + position
+        if index < self.__evictedLineCount:
+            return None
+        return index
+
+class LogBuffer:
+    u'''
+    Buffer of received log.
+
+    Lines are stored in append-only segments, so appending a line does not
+    copy the stored log. The whole log is joined only when it is required.
+
+    One thread appends lines, and other threads read them without a lock.
+    Appending publishes a LogSnapshot that has the number of lines, and
+    readers read lines only until the published number. Stored lines are
+    never modified.
+
+    If the maximum size is specified, the buffer works as a ring buffer.
+    The oldest lines are evicted when the size of the stored lines exceeds
+    the maximum size. Evicted lines are discarded or spilled to a temporary
+    file that can be searched later. The memory of evicted lines is released
+    when all lines in their segment are evicted. Line indexes and offsets
+    always count from the head of the whole log including evicted lines.
+    '''
+
+    def __init__(self, maximumSize = None, spillLog = False):
+        u'''
+        Constructor.
+
+        Arguments :
+            maximumSize : Maximum bytes of lines that are kept in memory.
+                If it is None, all lines are kept in memory.
+            spillLog : True if evicted lines are spilled to a temporary file.
+        '''
+        self.__maximumSize = maximumSize
+
+        # Segments of lines and segments of offsets of the head of each line
+        # in the whole log. Lines are appended only to the last segment.
+        # Segments whose lines are all evicted are removed from the head.
+        self.__lineSegments = [[]]
+        self.__offsetSegments = [[]]
+        self.__lineCount = 0
+        self.__length = 0
+
+        # Number of lines in removed segments.
+        self.__removedLineCount = 0
+
+        # Bytes of each line that is not evicted.
+        self.__sizes = deque()
+
+        # Number of evicted lines and their bytes.
+        self.__evictedLineCount = 0
+        self.__evictedSize = 0
+        self.__size = 0
+
+        # Temporary file for spilled lines. The lock is held only while
+        # a block is written or read.
+        if spillLog:
+            self.__spillFile = tempfile.TemporaryFile()
+        else:
+            self.__spillFile = None
+        self.__spillLock = RLock()
+        self.__spilledSize = 0
+        self.__spilledLength = 0
+
+        # Holder of the joined log of the head lines in memory and the range
+        # of indexes of the joined lines, which is shared with snapshots.
+        # The empty log is str to join str or unicode lines.
+        self.__joinedLog = [(0, 0, '')]
+
+        self.__publish()
+
+    def append(self, line, size = None):
+        u'''
+        Append a line.
+
+        Arguments :
+            line : Decoded unicode line or str line encoded in UTF-8.
+            size : Bytes of the line before decoding.
+                If it is None, the length of the line is used.
+        '''
+        if size is None:
+            size = len(line)
+        self.appendLines([line], [size])
+
+    def appendLines(self, lines, sizes, reservedSize = 0):
+        u'''
+        Append lines and publish them at once.
+
+        Arguments :
+            lines : List of decoded unicode lines or str lines encoded in
+                UTF-8.
+            sizes : List of bytes of each line before decoding.
+            reservedSize : Bytes of memory for the log such as the index,
+                which is counted in the maximum size.
+        '''
+        for line, size in zip(lines, sizes):
+            segment = self.__lineSegments[-1]
+            if len(segment) == segmentLength:
+                segment = []
+                self.__lineSegments.append(segment)
+                self.__offsetSegments.append([])
+
+            segment.append(line)
+            self.__offsetSegments[-1].append(self.__length)
+            self.__sizes.append(size)
+            self.__lineCount += 1
+            self.__length += len(line)
+            self.__size += size
+
+        if self.__maximumSize is not None:
+            self.__evict(reservedSize)
+
+        self.__publish()
+
+    def __publish(self):
+        u'''
+        Publish a snapshot of the stored lines to readers.
+        '''
+        self.__snapshot = LogSnapshot(
+            self.__lineSegments, self.__offsetSegments,
+            self.__removedLineCount, self.__lineCount,
+            self.__evictedLineCount, self.__length, self.__spilledLength,
+            self.__joinedLog)
+
+    def __evict(self, reservedSize = 0):
+        u'''
+        Evict the oldest lines until the size is not over the maximum size.
+
+        Arguments :
+            reservedSize : Bytes that are counted in the maximum size besides
+                the lines.
+        '''
+        while self.__maximumSize < self.__size + reservedSize and \
+                self.__evictedLineCount < self.__lineCount:
+            size = self.__sizes.popleft()
+            if self.__spillFile:
+                position = self.__evictedLineCount - self.__removedLineCount
+                line = self.__lineSegments[
+                    position // segmentLength][position % segmentLength]
+                if isinstance(line, unicode):
+                    line = line.encode('utf8')
+                with self.__spillLock:
+                    self.__spillFile.write(line)
+                self.__spilledSize += size
+                self.__spilledLength += len(line)
+
+            self.__size -= size
+            self.__evictedSize += size
+            self.__evictedLineCount += 1
+
+            # Remove the head segment if all its lines are evicted.
+            # The lists of segments are copied because snapshots refer them.
+            if segmentLength <= \
+                    self.__evictedLineCount - self.__removedLineCount and \
+                    1 < len(self.__lineSegments):
+                self.__lineSegments = self.__lineSegments[1:]
+                self.__offsetSegments = self.__offsetSegments[1:]
+                self.__removedLineCount += segmentLength
+
+        # Discard the joined log if it contains evicted lines.
+        if self.__joinedLog[0][0] < self.__evictedLineCount:
+            self.__joinedLog[0] = (
+                self.__evictedLineCount, self.__evictedLineCount, '')
+
+    def getSnapshot(self):
+        u'''
+        Get the snapshot of the lines that are published last.
+
+        This method may be called by other thread.
+        '''
+        return self.__snapshot
+
+    def getLength(self):
+        u'''
+        Get the number of characters of the whole log.
+        '''
+        return self.__snapshot.getLength()
+
+    def getSize(self):
+        u'''
+        Get bytes of lines that are kept in memory.
+        '''
+        return self.__size
+
+    def getEvictedSize(self):
+        u'''
+        Get bytes of evicted lines.
+        '''
+        return self.__evictedSize
+
+    def getSpilledSize(self):
+        u'''
+        Get bytes of lines that are spilled to the temporary file.
+        '''
+        return self.__spilledSize
+
+    def getLineCount(self):
+        u'''
+        Get the number of lines of the whole log.
+        '''
+        return self.__snapshot.getLineCount()
+
+    def getFirstLineIndex(self):
+        u'''
+        Get index of the first line that is kept in memory.
+        '''
+        return self.__snapshot.getFirstLineIndex()
+
+    def getLines(self, begin = 0, end = None):
+        u'''
+        Get a list of lines in memory.
+
+        Arguments :
+            begin : Index of the first line.
+            end : Index after the last line. If it is None,
+                lines until the tail are returned.
+        '''
+        return self.__snapshot.getLines(begin, end)
+
+    def getText(self, begin = 0, end = None):
+        u'''
+        Get joined lines in memory.
+
+        Arguments :
+            begin : Index of the first line.
+            end : Index after the last line. If it is None,
+                lines until the tail are joined.
+        '''
+        return self.__snapshot.getText(begin, end)
+
+    def getLineIndex(self, offset):
+        u'''
+        Get index of the line in memory that contains the character.
+
+        Arguments :
+            offset : Offset of the character in the whole log.
+        Return :
+            Index of the line, or None if the line is evicted.
+        '''
+        return self.__snapshot.getLineIndex(offset)
+
+    def getSpilledLines(self, spilledLength = None):
+        u'''
+        Generate lines that are spilled to the temporary file.
+
+        The file is read block by block, so lines can be spilled while
+        reading.
+
+        Arguments :
+            spilledLength : Bytes of the file that are read. If it is None,
+                the whole file is read.
+        '''
+        if not self.__spillFile:
+            return
+        if spilledLength is None:
+            spilledLength = self.__snapshot.getSpilledLength()
+
+        position = 0
+        incompleteLine = ''
+        while position < spilledLength:
+            with self.__spillLock:
+                self.__spillFile.seek(position)
+                block = self.__spillFile.read(
+                    min(defaultReadingSize, spilledLength - position))
+                self.__spillFile.seek(0, os.SEEK_END)
+            if not block:
+                break
+            position += len(block)
+
+            lines = (incompleteLine + block).split('\n')
+            incompleteLine = lines.pop()
+            for line in lines:
+                yield unicode(line + '\n', 'utf8', 'replace')
+
+        if incompleteLine:
+            yield unicode(incompleteLine, 'utf8', 'replace')
+
+    def search(self, pattern):
+        u'''
+        Search a pattern in each line of spilled lines and lines in memory.
+
+        Lines that are appended while searching are not searched.
+
+        Arguments :
+            pattern : Compiled regular expression pattern.
+        Return :
+            Match object of the first matched line, or None.
+        '''
+        snapshot = self.__snapshot
+        for line in self.getSpilledLines(snapshot.getSpilledLength()):
+            result = pattern.search(line)
+            if result:
+                return result
+
+        for line in snapshot.getLines():
+            if isinstance(line, str):
+                line = unicode(line, 'utf8', 'replace')
+            result = pattern.search(line)
+            if result:
+                return result
+
+        return None
+
+    def close(self):
+        u'''
+        Close the buffer and remove the temporary file.
+        '''
+        with self.__spillLock:
+            if self.__spillFile:
+                self.__spillFile.close()
+                self.__spillFile = None
+
+class LogIndex:
+    u'''
+    Index of received lines that is built incrementally.
+
+    Lines are indexed by their trigrams, tags and process IDs. Each index
+    maps a key to an ascending array, so new lines are appended to the arrays
+    in order of arrival. Trigrams are indexed by segments of segmentLength
+    lines like LogBuffer, so an array of a trigram has an entry for each
+    segment that contains it instead of each line. Tags and process IDs are
+    indexed by lines.
+
+    A literal that is required by a pattern is contained only in segments
+    that have all its trigrams, so candidate lines for a pattern are narrowed
+    by intersecting the arrays before the pattern is matched.
+
+    If the maximum size is specified, the oldest segments are dropped from
+    the index while the estimated size of the arrays exceeds it. Lines that
+    are not indexed are candidates for any condition.
+
+    One thread appends lines, and other threads find lines with the lock.
+    '''
+
+    def __init__(self, parser = None, maximumSize = None):
+        u'''
+        Constructor.
+
+        Arguments :
+            parser : LogRecordParser that parses tags and process IDs,
+                or None to create it.
+            maximumSize : Maximum bytes of the index, or None.
+        '''
+        if parser is None:
+            parser = LogRecordParser()
+        self.__parser = parser
+        self.__maximumSize = maximumSize
+
+        self.__trigrams = {}
+        self.__tags = {}
+        self.__pids = {}
+
+        # Trigrams that are indexed for the last segment.
+        self.__segmentTrigrams = set()
+
+        # Lines before the first index are removed, and arrays are trimmed
+        # until the pruned index. Lines before the indexed index are not
+        # indexed because their segments are dropped.
+        self.__firstLineIndex = 0
+        self.__prunedLineIndex = 0
+        self.__indexedLineIndex = 0
+        self.__lineCount = 0
+
+        # Numbers of entries in the arrays and keys to estimate the size.
+        self.__entrySize = array.array('l').itemsize
+        self.__entryCount = 0
+        self.__keyCount = 0
+
+        self.__lock = RLock()
+
+    def appendLines(self, lines):
+        u'''
+        Index lines that follow the indexed lines.
+
+        Arguments :
+            lines : List of decoded unicode lines or str lines encoded in
+                UTF-8.
+        '''
+        # This loop runs for each trigram, so names are bound locally.
+        trigrams = self.__trigrams
+        newArray = array.array
+        with self.__lock:
+            position = 0
+            while position < len(lines):
+                lineIndex = self.__lineCount
+                segment = lineIndex // segmentLength
+                if lineIndex % segmentLength == 0:
+                    self.__segmentTrigrams = set()
+                count = min(segmentLength - lineIndex % segmentLength,
+                    len(lines) - position)
+
+                segmentLines = []
+                for line in lines[position:position + count]:
+                    if isinstance(line, str):
+                        line = unicode(line, 'utf8', 'replace')
+                    segmentLines.append(line)
+
+                    record = self.__parser.parse(line)
+                    if record:
+                        self.__append(self.__tags, record.tag, lineIndex)
+                        self.__append(self.__pids, record.pid, lineIndex)
+                    lineIndex += 1
+                position += count
+                self.__lineCount = lineIndex
+
+                # Trigrams of the joined lines are indexed at once. Line
+                # separators are indexed because patterns are matched with
+                # lines that have them, and trigrams across lines only add
+                # candidates.
+                text = u''.join(segmentLines)
+                newTrigrams = set(
+                    [text[i:i + 3] for i in xrange(len(text) - 2)])
+                newTrigrams.difference_update(self.__segmentTrigrams)
+                self.__segmentTrigrams.update(newTrigrams)
+                for trigram in newTrigrams:
+                    segments = trigrams.get(trigram)
+                    if segments is None:
+                        segments = newArray('l')
+                        trigrams[trigram] = segments
+                        self.__keyCount += 1
+                    segments.append(segment)
+                self.__entryCount += len(newTrigrams)
+
+            if self.__maximumSize is not None:
+                while self.__maximumSize < self.getSize() and \
+                        self.__indexedLineIndex < self.__lineCount:
+                    self.__drop()
+
+    def __append(self, postings, key, lineIndex):
+        u'''
+        Append a line index to the array of a key.
+        '''
+        lineIndexes = postings.get(key)
+        if lineIndexes is None:
+            lineIndexes = array.array('l')
+            postings[key] = lineIndexes
+            self.__keyCount += 1
+        lineIndexes.append(lineIndex)
+        self.__entryCount += 1
+
+    def __drop(self):
+        u'''
+        Drop the older half of the indexed segments.
+        '''
+        firstSegment = self.__indexedLineIndex // segmentLength
+        lastSegment = (self.__lineCount - 1) // segmentLength
+        segmentEnd = firstSegment + \
+            max((lastSegment - firstSegment + 1) // 2, 1)
+        end = min(segmentEnd * segmentLength, self.__lineCount)
+
+        # Trigrams of the rest of the last segment are indexed again.
+        if end == self.__lineCount:
+            self.__segmentTrigrams = set()
+        self.__indexedLineIndex = end
+        self.__trim(end, segmentEnd)
+
+    def __trim(self, end, segmentEnd):
+        u'''
+        Remove entries before a line and a segment from the arrays.
+
+        Arguments :
+            end : Index of the first line whose entry is kept.
+            segmentEnd : Index of the first segment whose entry is kept.
+        '''
+        for postings, first in ((self.__trigrams, segmentEnd),
+                (self.__tags, end), (self.__pids, end)):
+            for key, entries in postings.items():
+                count = bisect.bisect_left(entries, first)
+                if count == len(entries):
+                    del postings[key]
+                    self.__keyCount -= 1
+                elif count:
+                    del entries[:count]
+                self.__entryCount -= count
+
+    def removeLines(self, end):
+        u'''
+        Remove lines from the index.
+
+        Arrays are trimmed only when enough lines are removed, because
+        trimming visits all keys. Segments of trigrams are trimmed when all
+        their lines are removed.
+
+        Arguments :
+            end : Index after the removed lines.
+        '''
+        with self.__lock:
+            self.__firstLineIndex = max(self.__firstLineIndex, end)
+            if end - self.__prunedLineIndex < indexPruningLineCount:
+                return
+            self.__prunedLineIndex = end
+            self.__trim(end, end // segmentLength)
+
+    def getLineCount(self):
+        u'''
+        Get the number of indexed lines including removed lines.
+        '''
+        return self.__lineCount
+
+    def getSize(self):
+        u'''
+        Get estimated bytes of the index.
+        '''
+        return self.__entryCount * self.__entrySize + \
+            self.__keyCount * indexKeySize
+
+    def findLines(self, literals = (), tag = None, pid = None):
+        u'''
+        Find candidate lines that may contain literals and have a tag and
+        a process ID.
+
+        Literals shorter than a trigram do not narrow lines. Lines that are
+        not indexed are always candidates.
+
+        Arguments :
+            literals : List of unicode literals.
+            tag : Tag of lines, or None.
+            pid : Process ID of lines, or None.
+        Return :
+            Ascending list of indexes of candidate lines, or None if no
+            condition narrows lines.
+        '''
+        segmentKeys = []
+        for literal in literals:
+            for i in xrange(len(literal) - 2):
+                segmentKeys.append((self.__trigrams, literal[i:i + 3]))
+        lineKeys = []
+        if tag is not None:
+            lineKeys.append((self.__tags, tag))
+        if pid is not None:
+            lineKeys.append((self.__pids, pid))
+        if not segmentKeys and not lineKeys:
+            return None
+
+        with self.__lock:
+            indexedLineIndex = max(
+                self.__firstLineIndex, self.__indexedLineIndex)
+            candidates = range(self.__firstLineIndex, indexedLineIndex)
+
+            segments = self.__intersect(segmentKeys)
+            lineIndexes = self.__intersect(lineKeys)
+            if lineIndexes is None:
+                for segment in segments:
+                    candidates.extend(xrange(
+                        max(segment * segmentLength, indexedLineIndex),
+                        min((segment + 1) * segmentLength, self.__lineCount)))
+                return candidates
+
+            if segments is not None:
+                segments = set(segments)
+                lineIndexes = [lineIndex for lineIndex in lineIndexes
+                    if lineIndex // segmentLength in segments]
+            candidates.extend([lineIndex for lineIndex in lineIndexes
+                if indexedLineIndex <= lineIndex])
+            return candidates
+
+    def __intersect(self, keys):
+        u'''
+        Intersect arrays of keys.
+
+        Arguments :
+            keys : List of tuples of the index and the key.
+        Return :
+            Ascending list of entries in all arrays, or None if keys is
+            empty.
+        '''
+        if not keys:
+            return None
+
+        arrays = []
+        for postings, key in keys:
+            entries = postings.get(key)
+            if entries is None:
+                return []
+            arrays.append(entries)
+
+        # Intersect from the shortest array by binary searches.
+        arrays.sort(key = len)
+        candidates = arrays[0].tolist()
+        for entries in arrays[1:]:
+            if not candidates:
+                break
+            length = len(entries)
+            foundEntries = []
+            for entry in candidates:
+                position = bisect.bisect_left(entries, entry)
+                if position < length and entries[position] == entry:
+                    foundEntries.append(entry)
+            candidates = foundEntries
+        return candidates
+
+class LogFileHit:
+    u'''
+    A line of a log file that matches a string or a pattern.
+
+    Attributes :
+        path : Path of the log file.
+        lineNumber : Line number that starts from 1.
+        offset : Offset of the head of the line in the file.
+        line : unicode line.
+        timestamp : unicode timestamp of the line, or None if the line does
+            not have a timestamp.
+        match : The string or the compiled pattern that is found.
+        matchObject : Match object if a pattern is matched, None otherwise.
+    '''
+
+    def __init__(self, path, lineNumber, offset, line, timestamp, match,
+            matchObject = None):
+        self.path = path
+        self.lineNumber = lineNumber
+        self.offset = offset
+        self.line = line
+        self.timestamp = timestamp
+        self.match = match
+        self.matchObject = matchObject
+
+    def __repr__(self):
+        return 'LogFileHit(%r, %d, %d, %r)' % (
+            self.path, self.lineNumber, self.offset, self.line)
+
+class LogFile:
+    u'''
+    Saved log such as the output of "adb logcat -d" or a bugreport.
+
+    The file is memory-mapped and strings are searched as UTF-8 bytes, so
+    lines that do not contain a string are not decoded. Patterns that have
+    required literals are searched in the same way. On Jython, which does not
+    have mmap module, the file is read into memory instead.
+
+    Strings and patterns are matched with each line, and each line is
+    reported once for each string and pattern.
+    '''
+
+    def __init__(self, path):
+        u'''
+        Constructor.
+
+        Arguments :
+            path : Path of the log file encoded in UTF-8.
+        '''
+        self.__path = path
+        self.__file = open(path, 'rb')
+        try:
+            if mmap and os.path.getsize(path):
+                self.__data = mmap.mmap(
+                    self.__file.fileno(), 0, access = mmap.ACCESS_READ)
+            else:
+                self.__data = self.__file.read()
+        except:
+            self.__file.close()
+            raise
+
+        self.__parser = LogRecordParser()
+
+    def close(self):
+        u'''
+        Close the file.
+        '''
+        if mmap and isinstance(self.__data, mmap.mmap):
+            self.__data.close()
+        self.__file.close()
+
+    def getSize(self):
+        u'''
+        Get bytes of the file.
+        '''
+        return len(self.__data)
+
+    def findAll(self, match):
+        u'''
+        Find lines that contain a string.
+
+        Arguments :
+            match : Searching string.
+        Return :
+            List of LogFileHit in order of lines.
+        Exception :
+            ValueError : If type of match is not str or unicode.
+        '''
+        return self.scan([match])
+
+    def findAllPattern(self, pattern):
+        u'''
+        Find lines in which a pattern is matched.
+
+        Arguments :
+            pattern : Searching pattern. str or unicode,
+                compiled regular expression pattern.
+        Return :
+            List of LogFileHit in order of lines.
+        '''
+        return self.scan(patterns = [pattern])
+
+    def scan(self, matches = (), patterns = (), begin = 0, end = None,
+            firstLineNumber = 1):
+        u'''
+        Find lines that contain strings or in which patterns are matched.
+
+        Arguments :
+            matches : List of searching strings.
+            patterns : List of searching patterns. str or unicode,
+                compiled regular expression patterns.
+            begin : Offset of the head of the line where scanning begins.
+            end : Offset after the line where scanning ends, or None for
+                the end of the file.
+            firstLineNumber : Line number of the line at begin.
+        Return :
+            List of LogFileHit in order of lines, and then in order of
+            the strings and the patterns.
+        Exception :
+            ValueError : If type of a string is not str or unicode.
+        '''
+        if end is None:
+            end = len(self.__data)
+
+        # Hits are collected as tuples of the offset, the index of
+        # the string or the pattern, the line and the Match object, and
+        # their line numbers are counted at once.
+        foundLines = []
+        for index, match in enumerate(matches):
+            if not isinstance(match, basestring):
+                raise ValueError(u'match type is ' + unicode(type(match)))
+            self.__findLiteral(foundLines, index,
+                unicode(match).encode('utf-8'), None, begin, end)
+
+        compiledPatterns = []
+        for pattern in patterns:
+            if isinstance(pattern, basestring):
+                pattern = re.compile(unicode(pattern))
+            compiledPatterns.append(pattern)
+
+        for index, pattern in enumerate(compiledPatterns):
+            self.__findPattern(
+                foundLines, len(matches) + index, pattern, begin, end)
+        foundLines.sort()
+
+        allMatches = list(matches) + compiledPatterns
+        hits = []
+        lineNumber = firstLineNumber
+        countedOffset = begin
+        for offset, index, line, matchObject in foundLines:
+            lineNumber += self.countLines(countedOffset, offset)
+            countedOffset = offset
+
+            timestamp = None
+            record = self.__parser.parse(line)
+            if record:
+                timestamp = record.timestamp
+            hits.append(LogFileHit(self.__path, lineNumber, offset, line,
+                timestamp, allMatches[index], matchObject))
+        return hits
+
+    def splitLines(self, length):
+        u'''
+        Split the file into ranges of lines.
+
+        Arguments :
+            length : Bytes of a range. Each range is extended to the end of
+                its last line.
+        Return :
+            List of tuples of the offset of the head of the range and
+            the offset after it.
+        '''
+        ranges = []
+        begin = 0
+        size = len(self.__data)
+        while begin < size:
+            end = self.__findLineEnd(min(begin + length, size), size)
+            ranges.append((begin, end))
+            begin = end
+        return ranges
+
+    def countLines(self, begin = 0, end = None):
+        u'''
+        Count line breaks in a range.
+
+        Lines are counted by blocks, so that no object is created for each
+        line.
+
+        Arguments :
+            begin : Offset of the head of the range.
+            end : Offset after the range, or None for the end of the file.
+        '''
+        if end is None:
+            end = len(self.__data)
+
+        count = 0
+        blockLength = defaultReadingSize * 16
+        while begin < end:
+            blockEnd = min(begin + blockLength, end)
+            count += self.__data[begin:blockEnd].count('\n')
+            begin = blockEnd
+        return count
+
+    def __findLiteral(self, foundLines, index, literal, pattern, begin, end):
+        u'''
+        Find lines that contain a literal, and match a pattern with them.
+
+        Lines are matched one by one like received log, so a literal that
+        spans lines is not found.
+
+        Arguments :
+            foundLines : List that found lines are appended to.
+            index : Index of the string or the pattern.
+            literal : str literal encoded in UTF-8.
+            pattern : Compiled regular expression pattern, or None.
+            begin : Offset where scanning begins.
+            end : Offset where scanning ends.
+        '''
+        if not literal:
+            return
+
+        position = self.__data.find(literal, begin, end)
+        while position >= 0:
+            # Only the line that contains the head of the literal is matched.
+            # A line separator in a literal is only at the end of the line, so
+            # no other position in the line has the literal.
+            lineBegin = max(self.__data.rfind('\n', begin, position) + 1,
+                begin)
+            lineEnd = self.__findLineEnd(position + 1, end)
+            if position + len(literal) <= lineEnd:
+                self.__verify(foundLines, index, lineBegin,
+                    self.__data[lineBegin:lineEnd], pattern)
+            position = self.__data.find(literal, lineEnd, end)
+
+    def __findPattern(self, foundLines, index, pattern, begin, end):
+        u'''
+        Find lines in which a pattern is matched.
+
+        Arguments :
+            foundLines : List that found lines are appended to.
+            index : Index of the pattern.
+            pattern : Compiled regular expression pattern.
+            begin : Offset where scanning begins.
+            end : Offset where scanning ends.
+        '''
+        # Lines that contain the longest required literal are matched.
+        literals = findRequiredLiterals(pattern)
+        if literals:
+            literal = max([(len(literal), literal)
+                for literal in literals])[1].encode('utf-8')
+            self.__findLiteral(foundLines, index, literal, pattern, begin, end)
+            return
+
+        # All lines are matched if the pattern has no required literal.
+        # Lines are split only by "\n" like the other scanning.
+        while begin < end:
+            blockEnd = self.__findLineEnd(
+                min(begin + defaultReadingSize * 16, end), end)
+            offset = begin
+            lines = self.__data[begin:blockEnd].split('\n')
+            lastLine = lines.pop()
+            for line in lines:
+                self.__verify(foundLines, index, offset, line + '\n', pattern)
+                offset += len(line) + 1
+            if lastLine:
+                self.__verify(foundLines, index, offset, lastLine, pattern)
+            begin = blockEnd
+
+    def __findLineEnd(self, offset, end):
+        u'''
+        Find the offset after the line that contains the byte before
+        the offset.
+
+        Arguments :
+            offset : Offset in the line.
+            end : Offset where scanning ends.
+        '''
+        lineEnd = self.__data.find('\n', max(offset - 1, 0), end)
+        if lineEnd < 0:
+            return end
+        return lineEnd + 1
+
+    def __verify(self, foundLines, index, offset, line, pattern):
+        u'''
+        Append a found line if a pattern is matched with it.
+
+        Arguments :
+            foundLines : List that found lines are appended to.
+            index : Index of the string or the pattern.
+            offset : Offset of the head of the line.
+            line : str line.
+            pattern : Compiled regular expression pattern, or None if
+                the line contains the searching string.
+        '''
+        line = unicode(line, 'utf8', 'replace')
+        matchObject = None
+        if pattern:
+            matchObject = pattern.search(line)
+            if not matchObject:
+                return
+        foundLines.append((offset, index, line, matchObject))
+
+def scanLogFileRange(arguments):
+    u'''
+    Scan a range of lines of a log file in a worker process.
+
+    Arguments :
+        arguments : Tuple of the path, the offset of the head of the range,
+            the offset after it, the list of strings and the list of
+            compiled patterns.
+    Return :
+        Tuple of the list of found lines and the number of line breaks in
+        the range. A found line is a tuple of the line number that is
+        counted from 1 at the head of the range, the offset, the line,
+        the timestamp and the index of the string or the pattern.
+    '''
+    path, begin, end, matches, patterns = arguments
+
+    # Duplicated strings and patterns are scanned once, and their hits are
+    # reported for each of their indexes.
+    scannedMatches = []
+    scannedPatterns = []
+    scannedIndexes = {}
+    indexes = []
+    for index, match in enumerate(list(matches) + list(patterns)):
+        isString = index < len(matches)
+        if (isString, match) not in scannedIndexes:
+            scannedIndexes[(isString, match)] = len(indexes)
+            indexes.append([])
+            if isString:
+                scannedMatches.append(match)
+            else:
+                scannedPatterns.append(match)
+        indexes[scannedIndexes[(isString, match)]].append(index)
+
+    logFile = LogFile(path)
+    try:
+        hits = logFile.scan(scannedMatches, scannedPatterns, begin, end)
+        rangeLineCount = logFile.countLines(begin, end)
+    finally:
+        logFile.close()
+
+    # Match objects cannot be sent to other process, so they are
+    # created again by the process that merges found lines.
+    foundLines = []
+    for hit in hits:
+        isString = isinstance(hit.match, basestring)
+        for index in indexes[scannedIndexes[(isString, hit.match)]]:
+            foundLines.append((hit.lineNumber, hit.offset, hit.line,
+                hit.timestamp, index))
+    foundLines.sort()
+    return foundLines, rangeLineCount
+
+def scanLogFiles(paths, matches = (), patterns = (), processes = None,
+        rangeLength = defaultScanRangeLength):
+    u'''
+    Scan log files in parallel by a process pool.
+
+    Files are split into ranges of lines, and the ranges are scanned by
+    worker processes of multiprocessing. Found lines are merged in order of
+    files and lines. If multiprocessing is not available, the ranges are
+    scanned by this process.
+
+    On Windows, call this function under "if __name__ == '__main__':" of
+    the main script because worker processes import it.
+
+    Arguments :
+        paths : List of paths of log files.
+        matches : List of searching strings.
+        patterns : List of searching patterns. str or unicode,
+            compiled regular expression patterns.
+        processes : Number of worker processes, or None for the number of
+            CPUs. If it is 1, the files are scanned by this process.
+        rangeLength : Bytes of a range of lines that is scanned at once.
+    Return :
+        List of LogFileHit in order of files, lines, and then the strings
+        and the patterns.
+    Exception :
+        ValueError : If type of a string is not str or unicode.
+    '''
+    for match in matches:
+        if not isinstance(match, basestring):
+            raise ValueError(u'match type is ' + unicode(type(match)))
+    matches = [unicode(match) for match in matches]
+    compiledPatterns = []
+    for pattern in patterns:
+        if isinstance(pattern, basestring):
+            pattern = re.compile(unicode(pattern))
+        compiledPatterns.append(pattern)
+
+    tasks = []
+    for path in paths:
+        logFile = LogFile(path)
+        try:
+            for begin, end in logFile.splitLines(rangeLength):
+                tasks.append((path, begin, end, matches, compiledPatterns))
+        finally:
+            logFile.close()
+
+    if multiprocessing and processes != 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(scanLogFileRange, tasks, 1)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [scanLogFileRange(task) for task in tasks]
+
+    # Line numbers are counted from the head of each file.
+    allMatches = matches + compiledPatterns
+    hits = []
+    currentPath = None
+    lineCount = 0
+    for task, (foundLines, rangeLineCount) in zip(tasks, results):
+        path = task[0]
+        if path != currentPath:
+            currentPath = path
+            lineCount = 0
+
+        for lineNumber, offset, line, timestamp, index in foundLines:
+            match = allMatches[index]
+            matchObject = None
+            if index >= len(matches):
+                matchObject = match.search(line)
+            hits.append(LogFileHit(path, lineCount + lineNumber, offset,
+                line, timestamp, match, matchObject))
+        lineCount += rangeLineCount
+
+    return hits
+
+def readBlock(logcat, readingSize):
+    u'''
+    Read a block that is available from the output of logcat.
+
+    Sockets are read by recv because a socket is not a file descriptor that
+    os.read accepts on Windows.
+
+    Arguments :
+        logcat : File object of the standard output of logcat, or socket.
+        readingSize : Maximum bytes that are read at once.
+    Return :
+        str block, or empty str at the end of the output.
+    '''
+    if isinstance(logcat, socket.socket):
+        return logcat.recv(readingSize)
+    return os.read(logcat.fileno(), readingSize)
+
+def readLineBatches(logcat, readingSize = defaultReadingSize):
+    u'''
+    Generate lists of lines that are read from logcat at once.
+
+    Large blocks are read from the pipe or the socket and split into lines
+    in bulk. On Jython, lines are read from the pipe one by one because
+    os.read is not available for the pipe.
+
+    Arguments :
+        logcat : File object of the standard output of logcat, or socket.
+        readingSize : Maximum bytes that are read at once.
+    '''
+    if isJython and not isinstance(logcat, socket.socket):
+        for line in iter(logcat.readline, ''):
+            yield [line]
+        return
+
+    incompleteLine = ''
+    while True:
+        block = readBlock(logcat, readingSize)
+        if not block:
+            break
+
+        lines = (incompleteLine + block).split('\n')
+        incompleteLine = lines.pop()
+        if lines:
+            yield [line + '\n' for line in lines]
+
+    if incompleteLine:
+        yield [incompleteLine]
+
+def createAdbCommand(serial, command):
+    u'''
+    Create a command line of adb for a device.
+
+    Arguments :
+        serial : Serial number of the device. If it is None, the only
+            connected device is used.
+        command : unicode arguments of adb.
+    '''
+    if serial:
+        return u'adb -s ' + serial + u' ' + command
+    return u'adb ' + command
+
+def createStartTime(date):
+    u'''
+    Create the time for "logcat -T" from the output of date of the device.
+
+    Arguments :
+        date : str output of date with deviceDateFormat.
+    Return :
+        unicode that represents "MM-DD hh:mm:ss.mmm". Milliseconds are 000
+        if date does not support "%N".
+    Exception :
+        IOError : If the output is not the time.
+    '''
+    result = re.match(r'\s*(\d\d-\d\d \d\d:\d\d:\d\d)(?:\.(\d{3}))?', date)
+    if not result:
+        raise IOError(u'Unknown time of the device : ' +
+            unicode(date, 'utf8', 'replace'))
+    return unicode(result.group(1) + '.' + (result.group(2) or '000'))
+
+def readsMarkerBuffer(logcatArgument):
+    u'''
+    Check whether logcat reads the buffer where the marker is written.
+
+    Arguments :
+        logcatArgument : String of arguments for logcat.
+    Return :
+        True if no buffer is selected or the selected buffers include
+        the main buffer.
+    '''
+    buffers = []
+    arguments = logcatArgument.split()
+    for index, argument in enumerate(arguments):
+        if argument in (u'-b', u'--buffer'):
+            if index + 1 < len(arguments):
+                buffers.extend(arguments[index + 1].split(','))
+        elif argument.startswith(u'--buffer='):
+            buffers.extend(argument[len(u'--buffer='):].split(','))
+        elif argument.startswith(u'-b'):
+            buffers.extend(argument[len(u'-b'):].split(','))
+
+    if not buffers:
+        return True
+    for buffer in buffers:
+        if buffer in markerBuffers:
+            return True
+    return False
+
+def checkStartMode(logcatArgument, startMode):
+    u'''
+    Check whether logcat can be started by the mode.
+
+    Arguments :
+        logcatArgument : String of arguments for logcat.
+        startMode : Mode to start logcat.
+    Exception :
+        ValueError : If startMode is unknown, or it is markerStartMode and
+            logcat does not read the main buffer where the marker is
+            written, or logcat filters a process ID that does not write
+            the marker.
+    '''
+    if startMode not in (clearStartMode, timeStartMode, markerStartMode):
+        raise ValueError(u'Unknown start mode : ' + unicode(startMode))
+    if startMode != markerStartMode:
+        return
+    if not readsMarkerBuffer(unicode(logcatArgument)):
+        raise ValueError(
+            u'The marker is not read from the buffers : ' +
+            unicode(logcatArgument))
+    for argument in unicode(logcatArgument).split():
+        if argument == u'--pid' or argument.startswith(u'--pid='):
+            raise ValueError(
+                u'The marker is not read with "--pid" : ' +
+                unicode(logcatArgument))
+
+def noticeLines(logListener, lines):
+    u'''
+    Notice lines to a listener for log.
+
+    Arguments :
+        logListener : Listener that has onLogReceived(line).
+            If it also has onLogsReceived(lines), lines are noticed at once.
+        lines : List of lines.
+    '''
+    if hasattr(logListener, 'onLogsReceived'):
+        logListener.onLogsReceived(lines)
+    else:
+        for line in lines:
+            logListener.onLogReceived(line)
+
+class LogcatProcess:
+    u'''
+    Process of logcat of a device.
+    '''
+
+    def __init__(self, logcatArgument, startMode = clearStartMode,
+            serial = None):
+        u'''
+        Constructor.
+
+        Run logcat.
+
+        Argument :
+            logcatArgument : String of arguments for logcat.
+            startMode : Mode to start logcat. clearStartMode, timeStartMode
+                or markerStartMode.
+            serial : Serial number of the device, or None.
+        Exception :
+            ValueError : If startMode is unknown, or it is markerStartMode
+                and logcatArgument selects buffers without the main buffer or
+                "--pid".
+            IOError : If the time of the device is unknown in timeStartMode.
+        '''
+        checkStartMode(logcatArgument, startMode)
+
+        # Use shell on no Windows only. Because this script will kill the
+        # created process, but on windows, shell only is killed and adb process
+        # remains.
+        useShell = not isWindows
+        self.__marker = None
+        self.__markerProcess = None
+        if startMode == clearStartMode:
+            # Clear log before starting logcat.
+            subprocess.Popen(
+                createAdbCommand(serial, u'logcat -c ' + logcatArgument),
+                stdout = subprocess.PIPE, shell = useShell).wait()
+            self.__adb = subprocess.Popen(
+                createAdbCommand(serial, u'logcat ' + logcatArgument),
+                stdout = subprocess.PIPE, shell = useShell)
+        elif startMode == timeStartMode:
+            # Start logcat from the current time of the device.
+            date = subprocess.Popen(
+                createAdbCommand(
+                    serial, u'shell "date \'' + deviceDateFormat + u'\'"'),
+                stdout = subprocess.PIPE, shell = useShell).communicate()[0]
+            self.__adb = subprocess.Popen(
+                createAdbCommand(serial, u'logcat -T "' +
+                    createStartTime(date) + u'" ' + logcatArgument),
+                stdout = subprocess.PIPE, shell = useShell)
+        elif startMode == markerStartMode:
+            # Start logcat without clearing log, and write the marker.
+            # Log until the marker is ignored by filterLines.
+            # The marker is str because it is searched in lines that are not
+            # decoded.
+            self.__marker = str('%s-%d-%d' % (
+                markerTag, id(self), int(time.time() * 1000)))
+            self.__adb = subprocess.Popen(
+                createAdbCommand(serial,
+                    u'logcat ' + logcatArgument + u' ' + markerTag + u':V'),
+                stdout = subprocess.PIPE, shell = useShell)
+            self.__markerProcess = subprocess.Popen(
+                createAdbCommand(serial,
+                    u'shell log -p i -t ' + markerTag + u' ' + self.__marker),
+                stdout = subprocess.PIPE, shell = useShell)
+
+        self.__lock = RLock()
+        self.__isKilled = False
+
+    def getOutput(self):
+        u'''
+        Get the file object of the standard output of logcat.
+        '''
+        return self.__adb.stdout
+
+    def filterLines(self, lines):
+        u'''
+        Skip lines until the marker is found.
+
+        Arguments :
+            lines : List of lines.
+        Return :
+            List of lines after the marker, or lines if the marker has
+            already been found.
+        '''
+        if not self.__marker:
+            return lines
+
+        for index, line in enumerate(lines):
+            if self.__marker in line:
+                self.__marker = None
+                return lines[index + 1:]
+        return []
+
+    def kill(self):
+        u'''
+        Kill logcat if it is not killed.
+        '''
+        with self.__lock:
+            if self.__isKilled:
+                return
+            self.__isKilled = True
+
+        kill(self.__adb)
+
+        # The process that writes the marker is reaped here instead of
+        # the thread that reads logcat, which may be shared by devices.
+        if self.__markerProcess:
+            if self.__markerProcess.poll() is None:
+                kill(self.__markerProcess)
+            self.__markerProcess.wait()
+
+class AdbClient:
+    u'''
+    Client of the adb server that talks its protocol over TCP.
+
+    Services of devices are requested without running adb. Connections are
+    opened ahead and kept in a pool, so that sessions do not wait for
+    connecting. The adb server closes a connection after its service, so
+    a connection is used for one service only.
+    '''
+
+    def __init__(self, host = defaultAdbHost, port = defaultAdbPort,
+            poolSize = defaultAdbPoolSize):
+        u'''
+        Constructor.
+
+        Arguments :
+            host : Host name of the adb server.
+            port : Port number of the adb server.
+            poolSize : Maximum number of connections that are kept in
+                the pool.
+        '''
+        self.__address = (host, port)
+        self.__poolSize = poolSize
+        self.__lock = RLock()
+        self.__connections = []
+
+    def prepare(self, count = None):
+        u'''
+        Open connections ahead and keep them in the pool.
+
+        Arguments :
+            count : Number of connections that are kept in the pool.
+                If it is None, the pool is filled.
+        '''
+        if count is None:
+            count = self.__poolSize
+
+        while True:
+            with self.__lock:
+                if len(self.__connections) >= \
+                        min(count, self.__poolSize):
+                    return
+            connection = self.__openConnection()
+            with self.__lock:
+                self.__connections.append(connection)
+
+    def close(self):
+        u'''
+        Close connections in the pool.
+        '''
+        with self.__lock:
+            connections = self.__connections
+            self.__connections = []
+        for connection in connections:
+            connection.close()
+
+    def openService(self, serial, service):
+        u'''
+        Open a service of a device.
+
+        Arguments :
+            serial : Serial number of the device. If it is None, the only
+                connected device is used.
+            service : unicode request of the service such as
+                u'shell:logcat'.
+        Return :
+            Connected socket that outputs the service.
+        Exception :
+            IOError : If the adb server refuses the request.
+        '''
+        if serial:
+            transport = u'host:transport:' + serial
+        else:
+            transport = u'host:transport-any'
+
+        # A pooled connection may have been closed by the adb server.
+        # Retry with a new connection in that case.
+        connection = self.__takeConnection()
+        try:
+            try:
+                self.__request(connection, transport)
+            except socket.error:
+                connection.close()
+                connection = self.__openConnection()
+                self.__request(connection, transport)
+
+            self.__request(connection, service)
+        except:
+            connection.close()
+            raise
+
+        return connection
+
+    def runService(self, serial, service):
+        u'''
+        Run a service of a device until it finishes.
+
+        Arguments :
+            serial : Serial number of the device, or None.
+            service : unicode request of the service.
+        Return :
+            str output of the service.
+        Exception :
+            IOError : If the adb server refuses the request.
+        '''
+        connection = self.openService(serial, service)
+        try:
+            return readAll(connection)
+        finally:
+            connection.close()
+
+    def __takeConnection(self):
+        u'''
+        Take a connection from the pool, or open a new connection.
+        '''
+        with self.__lock:
+            if self.__connections:
+                return self.__connections.pop()
+        return self.__openConnection()
+
+    def __openConnection(self):
+        u'''
+        Open a new connection to the adb server.
+        '''
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.__address)
+        except:
+            connection.close()
+            raise
+        return connection
+
+    def __request(self, connection, request):
+        u'''
+        Send a request and receive its status.
+
+        Arguments :
+            connection : Connected socket.
+            request : unicode request.
+        Exception :
+            IOError : If the adb server replies FAIL.
+        '''
+        request = request.encode('utf-8')
+        connection.sendall('%04x' % len(request) + request)
+
+        status = readExactly(connection, 4)
+        if status == 'OKAY':
+            return
+        if status == 'FAIL':
+            length = int(readExactly(connection, 4), 16)
+            message = readExactly(connection, length)
+            raise IOError(u'adb server : ' + message.decode('utf-8', 'replace'))
+        raise IOError(u'adb server : unknown status ' + repr(status))
+
+def readExactly(connection, length):
+    u'''
+    Read bytes of the length from a socket.
+
+    Arguments :
+        connection : Connected socket.
+        length : Number of bytes.
+    Exception :
+        socket.error : If the socket is closed before the length.
+    '''
+    blocks = []
+    while length > 0:
+        block = connection.recv(length)
+        if not block:
+            raise socket.error(u'Connection closed by adb server')
+        blocks.append(block)
+        length -= len(block)
+    return ''.join(blocks)
+
+def readAll(connection):
+    u'''
+    Read bytes from a socket until it is closed.
+
+    Arguments :
+        connection : Connected socket.
+    '''
+    blocks = []
+    while True:
+        block = connection.recv(defaultReadingSize)
+        if not block:
+            return ''.join(blocks)
+        blocks.append(block)
+
+class AdbLogcatProcess:
+    u'''
+    logcat of a device that is read from the adb server by AdbClient.
+
+    It can be used instead of LogcatProcess.
+    '''
+
+    def __init__(self, adbClient, logcatArgument, startMode = clearStartMode,
+            serial = None):
+        u'''
+        Constructor.
+
+        Run logcat.
+
+        Argument :
+            adbClient : AdbClient.
+            logcatArgument : String of arguments for logcat.
+            startMode : Mode to start logcat. clearStartMode, timeStartMode
+                or markerStartMode.
+            serial : Serial number of the device, or None.
+        Exception :
+            ValueError : If startMode is unknown, or it is markerStartMode
+                and logcatArgument selects buffers without the main buffer or
+                "--pid".
+            IOError : If the adb server refuses requests, or the time of
+                the device is unknown in timeStartMode.
+        '''
+        checkStartMode(logcatArgument, startMode)
+
+        self.__marker = None
+        if startMode == clearStartMode:
+            # Clear log before starting logcat.
+            adbClient.runService(serial, u'shell:logcat -c ' + logcatArgument)
+            self.__connection = adbClient.openService(
+                serial, u'shell:logcat ' + logcatArgument)
+        elif startMode == timeStartMode:
+            # Start logcat from the current time of the device.
+            date = adbClient.runService(
+                serial, u'shell:date \'' + deviceDateFormat + u'\'')
+            self.__connection = adbClient.openService(serial,
+                u'shell:logcat -T "' + createStartTime(date) + u'" ' +
+                logcatArgument)
+        elif startMode == markerStartMode:
+            # Start logcat without clearing log, and write the marker.
+            # Log until the marker is ignored by filterLines.
+            marker = str('%s-%d-%d' % (
+                markerTag, id(self), int(time.time() * 1000)))
+            self.__connection = adbClient.openService(serial,
+                u'shell:logcat ' + logcatArgument + u' ' + markerTag + u':V')
+            adbClient.runService(serial,
+                u'shell:log -p i -t ' + markerTag + u' ' + marker)
+            self.__marker = marker
+
+        self.__lock = RLock()
+        self.__isKilled = False
+
+    def getOutput(self):
+        u'''
+        Get the socket of the output of logcat, which is read by readBlock.
+        '''
+        return self.__connection
+
+    def filterLines(self, lines):
+        u'''
+        Skip lines until the marker is found.
+
+        Arguments :
+            lines : List of lines.
+        Return :
+            List of lines after the marker, or lines if the marker has
+            already been found.
+        '''
+        if not self.__marker:
+            return lines
+
+        for index, line in enumerate(lines):
+            if self.__marker in line:
+                self.__marker = None
+                return lines[index + 1:]
+        return []
+
+    def kill(self):
+        u'''
+        Close the connection of logcat if it is not closed.
+        '''
+        with self.__lock:
+            if self.__isKilled:
+                return
+            self.__isKilled = True
+
+        # Shut the connection down to finish reading by other thread.
+        try:
+            self.__connection.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.__connection.close()
+
+def createLogcatProcess(logcatArgument, startMode = clearStartMode,
+        serial = None, adbClient = None):
+    u'''
+    Run logcat of a device.
+
+    Arguments :
+        logcatArgument : String of arguments for logcat.
+        startMode : Mode to start logcat.
+        serial : Serial number of the device, or None.
+        adbClient : AdbClient that requests logcat to the adb server, or None
+            to run adb.
+    Return :
+        AdbLogcatProcess if adbClient is specified, LogcatProcess otherwise.
+    '''
+    if adbClient:
+        return AdbLogcatProcess(adbClient, logcatArgument, startMode, serial)
+    return LogcatProcess(logcatArgument, startMode, serial)
+
+class StageTracer:
+    u'''
+    Profiler that samples timings of stages of reading and matching log.
+
+    A profiler is given to LogMatcher.start. It has the following hooks, and
+    any object that has them can be used instead of this class.
+
+        begin(stage) : Called when a stage begins. It returns a token that
+            is given to end.
+        end(stage, token) : Called when the stage ends.
+        finish() : Called when the session of LogMatcher finishes.
+
+    Stages are readingStage, decodingStage and matchingStage. Matching runs
+    on one thread at a time, so cProfile can profile matching only.
+    '''
+
+    def __init__(self, path = None, sampleInterval = 1,
+            profilesMatching = False):
+        u'''
+        Constructor.
+
+        Arguments :
+            path : Path of the profile file that timings are written to as
+                JSON when the session finishes, or None. The result of
+                cProfile is written to the path with ".prof" suffix.
+            sampleInterval : Stages are timed once in this number of times.
+            profilesMatching : True if matchingStage is profiled by cProfile.
+        Exception :
+            ValueError : If profilesMatching is True and cProfile is not
+                available.
+        '''
+        if profilesMatching and cProfile is None:
+            raise ValueError(u'cProfile is not available')
+
+        self.__path = path
+        self.__sampleInterval = max(1, sampleInterval)
+        self.__lock = RLock()
+
+        # Lists of the count, the sampled count, the total seconds and
+        # the maximum seconds by stages.
+        self.__timings = {}
+
+        self.__profile = None
+        if profilesMatching:
+            self.__profile = cProfile.Profile()
+
+    def begin(self, stage):
+        u'''
+        Called when a stage begins.
+
+        Arguments :
+            stage : Name of the stage.
+        Return :
+            Time when the stage begins if it is sampled, None otherwise.
+        '''
+        with self.__lock:
+            timing = self.__timings.get(stage)
+            if timing is None:
+                timing = [0, 0, 0.0, 0.0]
+                self.__timings[stage] = timing
+            timing[0] += 1
+            if (timing[0] - 1) % self.__sampleInterval:
+                return None
+
+        if self.__profile and stage == matchingStage:
+            self.__profile.enable()
+        return time.time()
+
+    def end(self, stage, token):
+        u'''
+        Called when a stage ends.
+
+        Arguments :
+            stage : Name of the stage.
+            token : Value that is returned by begin.
+        '''
+        if token is None:
+            return
+
+        seconds = time.time() - token
+        if self.__profile and stage == matchingStage:
+            self.__profile.disable()
+
+        with self.__lock:
+            timing = self.__timings[stage]
+            timing[1] += 1
+            timing[2] += seconds
+            timing[3] = max(timing[3], seconds)
+
+    def getTimings(self):
+        u'''
+        Get timings of stages.
+
+        Return :
+            dict of dict that has "count", "sampledCount", "totalTime",
+            "averageTime" and "maximumTime" by stages.
+        '''
+        with self.__lock:
+            timings = {}
+            for stage, timing in self.__timings.items():
+                count, sampledCount, totalTime, maximumTime = timing
+                averageTime = 0.0
+                if sampledCount:
+                    averageTime = totalTime / sampledCount
+                timings[stage] = {
+                    'count' : count,
+                    'sampledCount' : sampledCount,
+                    'totalTime' : totalTime,
+                    'averageTime' : averageTime,
+                    'maximumTime' : maximumTime}
+            return timings
+
+    def finish(self):
+        u'''
+        Write the profile file.
+        '''
+        if not self.__path:
+            return
+
+        profileFile = open(self.__path, 'w')
+        try:
+            profileFile.write(dumpJson(self.getTimings()) + '\n')
+        finally:
+            profileFile.close()
+
+        if self.__profile:
+            self.__profile.dump_stats(self.__path + '.prof')
+
+class LogcatThread(Thread):
+    u'''
+    Thread that runs logcat.
+    '''
+
+    def __init__(self, logListener, logcatArgument,
+            startMode = clearStartMode, serial = None, adbClient = None,
+            profiler = None):
+        u'''
+        Constructor.
+
+        Run logcat.
+
+        Argument :
+            logListener : Listener for log.
+                This listener has onLogReceived(line).
+                If it also has onLogsReceived(lines), lines that are read
+                at once are noticed by it instead.
+            logcatArgument : String of arguments for logcat.
+            startMode : Mode to start logcat. clearStartMode, timeStartMode
+                or markerStartMode.
+            serial : Serial number of the device, or None.
+            adbClient : AdbClient that requests logcat to the adb server,
+                or None to run adb.
+            profiler : Profiler that is noticed readingStage, or None.
+        Exception :
+            ValueError : If startMode is unknown.
+        '''
+        Thread.__init__(self, name = u'LogcatThread')
+
+        # Start logcat.
+        #
+        # Do not start logcat in run(). Because run() runs on a created thread
+        # and log is forgotten between start() and run().
+        self.__process = createLogcatProcess(
+            logcatArgument, startMode, serial, adbClient)
+
+        # Lock object for this thread.
+        self.__lock = RLock()
+
+        self.__logListener = logListener
+        self.__profiler = profiler
+        self.__isTerminated = False
+
+        # This thread is daemon thread to prevent that this thread is running
+        # forever. Because this thread is blocked by reading with
+        # the standard output.
+        self.setDaemon(True)
+
+    def run(self):
+        # If this thread has already terminated, finish this thread.
+        with self.__lock:
+            if self.__isTerminated:
+                return
+
+        # Notice received log until this thread is terminated.
+        with closing(self.__process.getOutput()) as logcat:
+            batches = readLineBatches(logcat)
+            while True:
+                # The reading stage includes waiting for log.
+                if self.__profiler:
+                    token = self.__profiler.begin(readingStage)
+                try:
+                    lines = batches.next()
+                except StopIteration:
+                    break
+                if self.__profiler:
+                    self.__profiler.end(readingStage, token)
+
+                # Ignore log until the marker is found.
+                lines = self.__process.filterLines(lines)
+                if not lines:
+                    continue
+
+                noticeLines(self.__logListener, lines)
+
+                with self.__lock:
+                    if self.__isTerminated:
+                        break
+
+    def terminate(self):
+        u'''
+        Request terminating this thread.
+        '''
+
+        # Raise the termination flag.
+        with self.__lock:
+            isNeededProcessTerminating = not self.__isTerminated
+            self.__isTerminated = True
+
+        # Terminate adb process.
+        if isNeededProcessTerminating:
+            self.__process.kill()
+
+class LogcatMultiplexer:
+    u'''
+    Reader that reads logcat of many devices in a single thread.
+
+    Standard outputs of logcat processes are multiplexed by select, and
+    lines are noticed to the listener of each process. The thread runs only
+    while any process is read, so the number of threads does not grow with
+    devices.
+
+    select cannot wait for pipes on Windows and Jython. Check
+    isMultiplexingSupported before using this class.
+    '''
+
+    def __init__(self, readingSize = defaultReadingSize):
+        u'''
+        Constructor.
+
+        Arguments :
+            readingSize : Maximum bytes that are read from a process at once.
+        '''
+        self.__readingSize = readingSize
+        self.__lock = RLock()
+
+        # Streams that are read, which are lists of the process,
+        # the listener and the incomplete line, by descriptors.
+        self.__streams = {}
+
+        # Output files of removed processes that are closed by the thread.
+        self.__removedOutputs = []
+
+        # The thread and the pipe that wakes the thread up when streams are
+        # changed. They exist only while any process is read.
+        self.__thread = None
+        self.__wakeUpPipe = None
+
+    def add(self, process, logListener):
+        u'''
+        Start reading a process.
+
+        This method may be called by other thread.
+
+        Arguments :
+            process : LogcatProcess.
+            logListener : Listener for log that has onLogReceived(line).
+                If it also has onLogsReceived(lines), lines that are read
+                at once are noticed by it instead.
+        '''
+        with self.__lock:
+            output = process.getOutput()
+            self.__streams[output.fileno()] = [process, logListener, '']
+
+            if self.__thread is None:
+                self.__wakeUpPipe = os.pipe()
+                self.__thread = Thread(
+                    target = self.__run, name = u'LogcatMultiplexer')
+                self.__thread.setDaemon(True)
+                self.__thread.start()
+            else:
+                self.__wakeUp()
+
+    def remove(self, process):
+        u'''
+        Stop reading a process and kill it.
+
+        This method may be called by other thread.
+
+        Arguments :
+            process : LogcatProcess.
+        '''
+        with self.__lock:
+            output = process.getOutput()
+            if self.__streams.pop(output.fileno(), None):
+                self.__removedOutputs.append(output)
+                self.__wakeUp()
+
+        process.kill()
+
+    def getStreamCount(self):
+        u'''
+        Get the number of processes that are read.
+        '''
+        with self.__lock:
+            return len(self.__streams)
+
+    def __wakeUp(self):
+        u'''
+        Wake the thread up to update streams.
+
+        This method must be called with the lock.
+        '''
+        os.write(self.__wakeUpPipe[1], 'w')
+
+    def __run(self):
+        u'''
+        Read processes until no process is read.
+        '''
+        while True:
+            with self.__lock:
+                for output in self.__removedOutputs:
+                    output.close()
+                self.__removedOutputs = []
+
+                # Finish the thread if no process is read.
+                if not self.__streams:
+                    os.close(self.__wakeUpPipe[0])
+                    os.close(self.__wakeUpPipe[1])
+                    self.__wakeUpPipe = None
+                    self.__thread = None
+                    return
+
+                wakeUpDescriptor = self.__wakeUpPipe[0]
+                descriptors = self.__streams.keys()
+
+            descriptors.append(wakeUpDescriptor)
+            readableDescriptors = select.select(descriptors, [], [])[0]
+            for descriptor in readableDescriptors:
+                if descriptor == wakeUpDescriptor:
+                    os.read(wakeUpDescriptor, self.__readingSize)
+                else:
+                    self.__read(descriptor)
+
+    def __read(self, descriptor):
+        u'''
+        Read a block from a process and notice lines in it.
+
+        Arguments :
+            descriptor : Descriptor of the standard output of the process.
+        '''
+        with self.__lock:
+            stream = self.__streams.get(descriptor)
+        if stream is None:
+            return
+        process, logListener, incompleteLine = stream
+
+        block = readBlock(process.getOutput(), self.__readingSize)
+        if block:
+            lines = (incompleteLine + block).split('\n')
+            stream[2] = lines.pop()
+            lines = [line + '\n' for line in lines]
+        else:
+            # logcat finishes.
+            lines = []
+            if incompleteLine:
+                lines.append(incompleteLine)
+            with self.__lock:
+                if self.__streams.pop(descriptor, None):
+                    self.__removedOutputs.append(process.getOutput())
+
+        # Ignore log until the marker is found.
+        lines = process.filterLines(lines)
+        if lines:
+            noticeLines(logListener, lines)
+
+class MultiplexedLogcat:
+    u'''
+    logcat that is read by LogcatMultiplexer.
+
+    It can be used instead of LogcatThread.
+    '''
+
+    def __init__(self, multiplexer, logListener, logcatArgument,
+            startMode = clearStartMode, serial = None, adbClient = None):
+        u'''
+        Constructor.
+
+        Run logcat.
+
+        Argument :
+            multiplexer : LogcatMultiplexer that reads logcat.
+            logListener : Listener for log.
+            logcatArgument : String of arguments for logcat.
+            startMode : Mode to start logcat.
+            serial : Serial number of the device, or None.
+            adbClient : AdbClient, or None to run adb.
+        Exception :
+            ValueError : If startMode is unknown.
+        '''
+        self.__multiplexer = multiplexer
+        self.__logListener = logListener
+        self.__process = createLogcatProcess(
+            logcatArgument, startMode, serial, adbClient)
+
+    def start(self):
+        u'''
+        Start reading logcat.
+        '''
+        self.__multiplexer.add(self.__process, self.__logListener)
+
+    def terminate(self):
+        u'''
+        Stop reading logcat and kill it.
+        '''
+        self.__multiplexer.remove(self.__process)
+
+class LogQueue:
+    u'''
+    Bounded queue of lines between the reader stage and the matching stage.
+
+    The size is the number of lines. When the queue is full, the policy
+    decides whether the reader is blocked or lines are dropped.
+    '''
+
+    def __init__(self, size = defaultQueueSize, policy = blockPolicy):
+        u'''
+        Constructor.
+
+        Arguments :
+            size : Maximum number of queued lines.
+            policy : blockPolicy, dropOldestPolicy or dropNewestPolicy.
+        Exception :
+            ValueError : If policy is unknown.
+        '''
+        if policy not in (blockPolicy, dropOldestPolicy, dropNewestPolicy):
+            raise ValueError(u'Unknown policy : ' + unicode(policy))
+
+        self.__size = size
+        self.__policy = policy
+        self.__condition = Condition()
+        self.__batches = deque()
+        self.__lineCount = 0
+        self.__maximumLineCount = 0
+        self.__droppedLineCount = 0
+        self.__isClosed = False
+
+        # Numbers of lines that are put, and lines that are finished by
+        # the listener or dropped after they are put.
+        self.__putLineCount = 0
+        self.__finishedLineCount = 0
+
+    def onLogReceived(self, line):
+        u'''
+        Put a line.
+
+        This method is called by LogcatThread.
+
+        Arguments :
+            line : str that represents log.
+        '''
+        self.put([line])
+
+    def onLogsReceived(self, lines):
+        u'''
+        Put lines.
+
+        This method is called by LogcatThread.
+
+        Arguments :
+            lines : List of str that represents log.
+        '''
+        self.put(lines)
+
+    def put(self, lines):
+        u'''
+        Put lines.
+
+        Arguments :
+            lines : List of lines.
+        '''
+        with self.__condition:
+            if self.__policy == blockPolicy:
+                # Lines that are more than the size are accepted
+                # when the queue is empty.
+                while not self.__isClosed and self.__lineCount and \
+                        self.__size < self.__lineCount + len(lines):
+                    self.__condition.wait()
+            elif self.__policy == dropOldestPolicy:
+                while self.__batches and \
+                        self.__size < self.__lineCount + len(lines):
+                    droppedLines = self.__batches.popleft()
+                    self.__lineCount -= len(droppedLines)
+                    self.__droppedLineCount += len(droppedLines)
+                    self.__finishedLineCount += len(droppedLines)
+                if self.__size < len(lines):
+                    self.__droppedLineCount += len(lines) - self.__size
+                    lines = lines[len(lines) - self.__size:]
+            else:
+                room = max(self.__size - self.__lineCount, 0)
+                if room < len(lines):
+                    self.__droppedLineCount += len(lines) - room
+                    lines = lines[:room]
+
+            if self.__isClosed or not lines:
+                return
+
+            self.__batches.append(lines)
+            self.__lineCount += len(lines)
+            self.__putLineCount += len(lines)
+            self.__maximumLineCount = max(
+                self.__maximumLineCount, self.__lineCount)
+            self.__condition.notifyAll()
+
+    def get(self):
+        u'''
+        Take all queued lines.
+
+        This method blocks until lines are put or the queue is closed.
+
+        Return :
+            List of lines, or None if the queue is closed.
+        '''
+        with self.__condition:
+            while not self.__batches and not self.__isClosed:
+                self.__condition.wait()
+
+            if self.__isClosed:
+                return None
+
+            lines = []
+            for batch in self.__batches:
+                lines.extend(batch)
+            self.__batches.clear()
+            self.__lineCount = 0
+            self.__condition.notifyAll()
+
+            return lines
+
+    def finish(self, lineCount):
+        u'''
+        Notice that lines that are taken are finished.
+
+        Arguments :
+            lineCount : Number of the finished lines.
+        '''
+        with self.__condition:
+            self.__finishedLineCount += lineCount
+            self.__condition.notifyAll()
+
+    def getPutLineCount(self):
+        u'''
+        Get the number of lines that have been put.
+        '''
+        with self.__condition:
+            return self.__putLineCount
+
+    def isFinished(self, lineCount):
+        u'''
+        Check whether lines are finished.
+
+        Arguments :
+            lineCount : Number of lines that are put first.
+        Return :
+            True if the lines are finished or dropped, or the queue is closed.
+        '''
+        with self.__condition:
+            return self.__isClosed or lineCount <= self.__finishedLineCount
+
+    def waitFinished(self, lineCount, timeout):
+        u'''
+        Wait until lines are finished.
+
+        Arguments :
+            lineCount : Number of lines that are put first.
+            timeout : Seconds until timeout.
+        Return :
+            True if the lines are finished or dropped, or the queue is closed.
+        '''
+        deadline = time.time() + timeout
+        with self.__condition:
+            while not self.__isClosed and \
+                    self.__finishedLineCount < lineCount:
+                now = time.time()
+                if deadline <= now:
+                    return False
+                self.__condition.wait(deadline - now)
+            return True
+
+    def close(self):
+        u'''
+        Close the queue. Queued lines are discarded.
+        '''
+        with self.__condition:
+            self.__isClosed = True
+            self.__condition.notifyAll()
+
+    def getDepth(self):
+        u'''
+        Get the number of queued lines.
+        '''
+        with self.__condition:
+            return self.__lineCount
+
+    def getMaximumDepth(self):
+        u'''
+        Get the maximum number of queued lines.
+        '''
+        with self.__condition:
+            return self.__maximumLineCount
+
+    def getDroppedLineCount(self):
+        u'''
+        Get the number of lines that are dropped by the policy.
+        '''
+        with self.__condition:
+            return self.__droppedLineCount
+
+class MatchingThread(Thread):
+    u'''
+    Thread that takes lines from LogQueue and notices them to the listener.
+    '''
+
+    def __init__(self, logQueue, logListener):
+        u'''
+        Constructor.
+
+        Arguments :
+            logQueue : LogQueue.
+            logListener : Listener for log.
+                This listener has onLogsReceived(lines).
+        '''
+        Thread.__init__(self, name = u'MatchingThread')
+
+        self.__logQueue = logQueue
+        self.__logListener = logListener
+
+        # This thread is daemon thread to prevent that this thread is running
+        # forever.
+        self.setDaemon(True)
+
+    def run(self):
+        # Notice lines until the queue is closed.
+        while True:
+            lines = self.__logQueue.get()
+            if lines is None:
+                break
+            try:
+                self.__logListener.onLogsReceived(lines)
+            finally:
+                self.__logQueue.finish(len(lines))
+
+class LogcatPipeline:
+    u'''
+    Reader stage and matching stage connected by LogQueue.
+
+    The reader stage keeps reading logcat while the matching stage is
+    matching log.
+    '''
+
+    def __init__(self, logcatThread, logQueue, matchingThread):
+        u'''
+        Constructor.
+
+        Arguments :
+            logcatThread : LogcatThread that puts lines to logQueue.
+            logQueue : LogQueue.
+            matchingThread : MatchingThread that takes lines from logQueue.
+        '''
+        self.__logcatThread = logcatThread
+        self.__logQueue = logQueue
+        self.__matchingThread = matchingThread
+
+    def start(self):
+        u'''
+        Start both stages.
+        '''
+        self.__matchingThread.start()
+        self.__logcatThread.start()
+
+    def terminate(self):
+        u'''
+        Request terminating both stages.
+        '''
+        self.__logcatThread.terminate()
+        self.__logQueue.close()
+
+class LogWaiter:
+    u'''
+    Thread that waits until its matcher matches log.
+
+    LogMatcher registers waiters and dispatches each received line once
+    to all of them.
+
+    Attributes :
+        matcher : Incremental matcher.
+        matchedEvent : Event that is set when the matcher matches log.
+        result : Result of the matcher.
+        indexedString : String that is found by StringIndex instead of
+            the matcher, or None.
+        beginLineIndex : Index of the first line for the waiter.
+        beginOffset : Offset of the head of the first line in the whole log.
+        fedLineCount : Index after the line that was fed last.
+        matchedLineCount : Index after the matched line.
+        handle : WaitHandle if the waiting does not block, None otherwise.
+        timerEntry : Entry of WaitTimer that checks timeout, or None.
+        isFinished : True if the waiting that does not block is finished.
+        queuedLineCount : Number of lines that are queued before timeout,
+            or None before timeout.
+    '''
+
+    def __init__(self, matcher, matchedEvent):
+        self.matcher = matcher
+        self.matchedEvent = matchedEvent
+        self.result = None
+        self.indexedString = None
+        self.beginLineIndex = 0
+        self.beginOffset = 0
+        self.fedLineCount = 0
+        self.matchedLineCount = 0
+        self.handle = None
+        self.timerEntry = None
+        self.isFinished = False
+        self.queuedLineCount = None
+
+class WaitHandle:
+    u'''
+    Handle of waiting that does not block the thread that starts it.
+    '''
+
+    def __init__(self, cancel, callback = None):
+        u'''
+        Constructor.
+
+        Arguments :
+            cancel : Function that finishes the waiting.
+            callback : Function that is called with the result when
+                the waiting finishes, or None.
+        '''
+        self.__cancel = cancel
+        self.__callback = callback
+        self.__event = Event()
+        self.__result = None
+
+    def isDone(self):
+        u'''
+        Check whether the waiting finishes.
+        '''
+        return self.__event.isSet()
+
+    def getResult(self):
+        u'''
+        Get the result of the waiting, or None if it does not finish.
+        '''
+        return self.__result
+
+    def wait(self, timeout = None):
+        u'''
+        Block called thread until the waiting finishes.
+
+        Arguments :
+            timeout : Seconds until timeout, or None.
+        Return :
+            The result of the waiting.
+        '''
+        self.__event.wait(timeout)
+        return self.__result
+
+    def cancel(self):
+        u'''
+        Finish the waiting with the result until now.
+        '''
+        self.__cancel()
+
+    def finish(self, result):
+        u'''
+        Called by LogMatcher when the waiting finishes.
+
+        Arguments :
+            result : The result of the waiting.
+        '''
+        self.__result = result
+        self.__event.set()
+        if self.__callback:
+            self.__callback(result)
+
+class WaitTimer:
+    u'''
+    Timer that calls functions at their deadlines in a single thread.
+
+    The thread runs only while any function is scheduled, so many waits
+    that do not block share one thread.
+    '''
+
+    def __init__(self):
+        u'''
+        Constructor.
+        '''
+        self.__condition = Condition()
+
+        # Heap of entries. An entry is a list of the deadline, the sequence
+        # number and the function that is None if it is cancelled.
+        self.__entries = []
+        self.__sequence = 0
+        self.__thread = None
+
+    def schedule(self, deadline, function):
+        u'''
+        Schedule a function.
+
+        Arguments :
+            deadline : Time when the function is called.
+            function : Function without arguments.
+        Return :
+            Entry that can be cancelled.
+        '''
+        with self.__condition:
+            entry = [deadline, self.__sequence, function]
+            self.__sequence += 1
+            heapq.heappush(self.__entries, entry)
+
+            if self.__thread is None:
+                self.__thread = Thread(target = self.__run, name = u'WaitTimer')
+                self.__thread.setDaemon(True)
+                self.__thread.start()
+            else:
+                self.__condition.notify()
+
+        return entry
+
+    def cancel(self, entry):
+        u'''
+        Cancel a scheduled function.
+
+        Arguments :
+            entry : Entry that is returned by schedule.
+        '''
+        with self.__condition:
+            entry[2] = None
+
+            # Wake the thread up to finish it if no function remains.
+            self.__condition.notify()
+
+    def __run(self):
+        u'''
+        Call functions at their deadlines until no function is scheduled.
+        '''
+        while True:
+            with self.__condition:
+                while True:
+                    # Discard cancelled entries.
+                    while self.__entries and self.__entries[0][2] is None:
+                        heapq.heappop(self.__entries)
+
+                    if not self.__entries:
+                        self.__thread = None
+                        return
+
+                    now = time.time()
+                    if self.__entries[0][0] <= now:
+                        function = heapq.heappop(self.__entries)[2]
+                        break
+                    self.__condition.wait(self.__entries[0][0] - now)
+
+            # An exception of a function must not stop other functions.
+            try:
+                function()
+            except:
+                traceback.print_exc()
+
+class StringIndex:
+    u'''
+    Index that finds strings of many waiters in a single search.
+
+    The strings are combined into one pattern that filters log, and each
+    string is searched only if the pattern is found. The tail of
+    the previous log is kept, so strings that span searched log are also
+    found.
+    '''
+
+    def __init__(self, waiters, tail):
+        u'''
+        Constructor.
+
+        Arguments :
+            waiters : List of LogWaiter that have indexedString.
+            tail : Log before the first searched log.
+        '''
+        self.__waiters = waiters
+
+        strings = [waiter.indexedString for waiter in waiters]
+        self.__pattern = re.compile(
+            '|'.join([re.escape(string) for string in strings]))
+        self.__tailLength = max([len(string) for string in strings]) - 1
+        self.__tail = tail[len(tail) - self.__tailLength:]
+
+    def search(self, log, offset):
+        u'''
+        Search strings in log that follows the previous searched log.
+
+        A string is found only if it begins at or after the first line of
+        its waiter, and it ends in log.
+
+        Arguments :
+            log : Searched unicode or str.
+            offset : Offset of the head of log in the whole log.
+        Return :
+            List of tuples of LogWaiter whose string is found and
+            the position after the string in log.
+        '''
+        tail = self.__tail
+        searchedLog = tail + log
+        tailOffset = offset - len(tail)
+
+        found = []
+        if self.__pattern.search(searchedLog):
+            for waiter in self.__waiters:
+                string = waiter.indexedString
+                position = searchedLog.find(string, max(
+                    len(tail) - len(string) + 1,
+                    waiter.beginOffset - tailOffset, 0))
+                if 0 <= position:
+                    found.append(
+                        (waiter, position + len(string) - len(tail)))
+
+        if self.__tailLength:
+            self.__tail = searchedLog[-self.__tailLength:]
+
+        return found
+
+class LogMatcher:
+    u'''
+    Monitor and match log from logcat.
+    '''
+
+    def start(self, logcatArgument = u'', maximumLogSize = None,
+            spillLog = False, persistent = False, startMode = clearStartMode,
+            predicates = None, matchesBytes = False,
+            queueSize = None, queuePolicy = blockPolicy,
+            matchingLatency = None, serial = None, multiplexer = None,
+            adbClient = None, statisticsPath = None, profiler = None,
+            indexesLog = False, filtersPid = False):
+        u'''
+        Start watching logcat.
+
+        Arguments:
+            logcatArgument : String of arguments for logcat.
+            maximumLogSize : Maximum bytes of log that is kept in memory.
+                If it is None, the whole log is kept in memory.
+            spillLog : True if log over maximumLogSize is spilled to
+                a temporary file that can be searched by searchLog.
+                Otherwise, the log is discarded.
+            persistent : True if logcat keeps running after waiting.
+                In this case, many waits can be called sequentially and
+                stop must be called at the end.
+            startMode : Mode to start logcat. clearStartMode, timeStartMode
+                or markerStartMode.
+            predicates : List of RecordPredicate that represents lines to be
+                waited, or None. Filterspecs of logcat are created from them
+                and appended to logcatArgument, so that the device filters
+                log before it is sent.
+            matchesBytes : True if log is kept as bytes and strings and
+                patterns that have literals are matched without decoding log.
+                Log is decoded only when it is matched.
+            queueSize : Maximum number of lines in the queue between reading
+                logcat and matching, such as defaultQueueSize. If it is None,
+                lines are matched by the thread that reads logcat. Lines that
+                are queued before timeout are matched before waiting times
+                out.
+            queuePolicy : blockPolicy, dropOldestPolicy or dropNewestPolicy
+                that decides what happens when the queue is full.
+            matchingLatency : Maximum seconds that received lines wait for
+                matching. Lines are matched at once when the lines that are
+                expected to arrive within this latency are received, or
+                the oldest line waits for this latency. If it is None,
+                lines are matched whenever they are received.
+            serial : Serial number of the device that is watched. If it is
+                None, the only connected device is watched.
+            multiplexer : LogcatMultiplexer that reads logcat with other
+                devices in a single thread, or None to read logcat by
+                a thread for this LogMatcher.
+            adbClient : AdbClient that requests logcat to the adb server
+                directly, or None to run adb.
+            statisticsPath : Path of the file that the result of stats is
+                appended to as a line of JSON at the end of each waiting,
+                or None.
+            profiler : Profiler such as StageTracer that is noticed stages
+                of reading, decoding and matching log, or None.
+                Reading is noticed only by LogcatThread.
+            indexesLog : True if received lines are indexed by trigrams,
+                tags and process IDs for findLogLines.
+            filtersPid : True if logcat also filters the process ID of
+                predicates when all of them have the same one. It requires
+                Android 7.0 or above. It is ignored in markerStartMode
+                because the marker is written by another process.
+        '''
+        if predicates:
+            logcatArgument = logcatArgument + u' ' + createFilterspec(
+                predicates, filtersPid and startMode != markerStartMode)
+
+        self.__startMode = startMode
+        self.__serial = serial
+        self.__multiplexer = multiplexer
+        self.__adbClient = adbClient
+        self.__profiler = profiler
+        self.__queueSize = queueSize
+        self.__queuePolicy = queuePolicy
+        self.__logQueue = None
+        self.__logcatThread = self.createLogcatThread(logcatArgument)
+        self.__log = LogBuffer(maximumLogSize, spillLog)
+        if indexesLog:
+            maximumIndexSize = None
+            if maximumLogSize is not None:
+                maximumIndexSize = int(maximumLogSize * indexSizeRatio)
+            self.__logIndex = LogIndex(maximumSize = maximumIndexSize)
+        else:
+            self.__logIndex = None
+
+        # The lock protects the state of matching, and it is never held while
+        # matchers run. Only one thread dispatches lines to waiters at a time,
+        # and the condition is notified when dispatching finishes.
+        self.__lock = Condition(RLock())
+        self.__isDispatching = False
+
+        # Timer that handles timeout of waiting that does not block.
+        self.__waitTimer = WaitTimer()
+        self.__isPersistent = persistent
+        self.__matchesBytes = matchesBytes
+
+        # Registry of waiters that receive lines and its version that is
+        # changed whenever a waiter is registered or removed.
+        self.__waiters = []
+        self.__waitersVersion = 0
+
+        # Index of strings of the registered waiters and the version of
+        # the registry for the index.
+        self.__stringIndex = None
+        self.__stringIndexVersion = None
+
+        # Result of the latest waiting.
+        self.__matchResult = None
+
+        # Waiting matches lines after the checkpoint.
+        self.__checkpoint = 0
+
+        # Index and offset after the line that was dispatched last.
+        self.__dispatchedLineCount = 0
+        self.__dispatchedLength = 0
+
+        # Lines that are not matched yet, and time when the oldest of them
+        # is received.
+        self.__matchingLatency = matchingLatency
+        self.__pendingLines = []
+        self.__pendingTime = None
+
+        # Number of lines that are matched at once, which is tuned by
+        # the arrival rate of lines, and its statistics.
+        self.__batchSize = 1
+        self.__arrivalRate = 0.0
+        self.__arrivalTime = None
+        self.__evaluationCount = 0
+        self.__evaluatedLineCount = 0
+        self.__maximumEvaluatedBatchSize = 0
+
+        # Counters for stats, and times when pending lines are received with
+        # the index after them.
+        self.__receivedLineCount = 0
+        self.__receivedByteCount = 0
+        self.__decodingTime = 0.0
+        self.__lockWaitTime = 0.0
+        self.__matchingTime = 0.0
+        self.__matcherEvaluationCount = 0
+        self.__latencyHistogram = [0] * (len(latencyHistogramBounds) + 1)
+        self.__totalLatency = 0.0
+        self.__maximumLatency = 0.0
+        self.__pendingArrivals = []
+
+        self.__statisticsPath = statisticsPath
+
+        self.__logcatThread.start()
+
+    def stop(self):
+        u'''
+        Stop watching logcat.
+
+        This method is for persistent LogMatcher.
+        '''
+        self.__logcatThread.terminate()
+        if self.__profiler:
+            self.__profiler.finish()
+
+    def mark(self):
+        u'''
+        Set the checkpoint to the tail of the received log.
+
+        The next waiting matches only lines received after this call.
+        After each waiting, the checkpoint moves to the line after the matched
+        line, or the tail of the log if not matched.
+
+        This method may be called by other thread.
+
+        Return :
+            The checkpoint that represents index of line.
+        '''
+        with self.__lock:
+            self.__checkpoint = self.__log.getLineCount()
+            return self.__checkpoint
+
+    def createLogcatThread(self, logcatArgument):
+        u'''
+        Create LogcatThread.
+
+        This method is for testability.
+
+        Arguments:
+            logcatArgument : String of arguments for logcat.
+        '''
+        if self.__queueSize is None:
+            return self.__createReader(self, logcatArgument)
+
+        self.__logQueue = LogQueue(self.__queueSize, self.__queuePolicy)
+        return LogcatPipeline(
+            self.__createReader(self.__logQueue, logcatArgument),
+            self.__logQueue, MatchingThread(self.__logQueue, self))
+
+    def __createReader(self, logListener, logcatArgument):
+        u'''
+        Create LogcatThread, or MultiplexedLogcat if LogMatcher has
+        the multiplexer.
+
+        Arguments:
+            logListener : Listener for log.
+            logcatArgument : String of arguments for logcat.
+        '''
+        if self.__multiplexer:
+            return MultiplexedLogcat(self.__multiplexer, logListener,
+                logcatArgument, self.__startMode, self.__serial,
+                self.__adbClient)
+        return LogcatThread(logListener, logcatArgument, self.__startMode,
+            self.__serial, self.__adbClient, self.__profiler)
+
+    def createMatchedEvent(self):
+        u'''
+        Create Event for matching.
+
+        This method is for testability.
+        '''
+        return Event()
+
+    def getLog(self):
+        u'''
+        Get the whole received log.
+
+        This method may be called by other thread.
+        '''
+        return self.__decode(self.__log.getText())
+
+    def __getFedLog(self, waiter):
+        u'''
+        Get log from the first line to the line fed to the waiter last.
+
+        Arguments :
+            waiter : LogWaiter.
+        '''
+        return self.__decode(self.__log.getText(
+            waiter.beginLineIndex, waiter.fedLineCount))
+
+    def __decode(self, log):
+        u'''
+        Decode log if it is str.
+
+        Arguments :
+            log : str encoded in UTF-8 or unicode.
+        '''
+        if isinstance(log, str):
+            # logcat outputs logs in UTF-8.
+            return unicode(log, 'utf8', 'replace')
+        return log
+
+    def __convertForMatcher(self, matcher, line):
+        u'''
+        Convert a line to str or unicode that the matcher accepts.
+
+        Arguments :
+            matcher : Incremental matcher.
+            line : str line encoded in UTF-8 or unicode line.
+        '''
+        if getattr(matcher, 'acceptsBytes', False):
+            if isinstance(line, unicode):
+                return line.encode('utf8')
+            return line
+        return self.__decode(line)
+
+    def __feed(self, waiter, line):
+        u'''
+        Feed a line to the matcher of the waiter.
+
+        This method must be called by the thread that owns the waiter.
+
+        Arguments :
+            waiter : LogWaiter.
+            line : str line encoded in UTF-8 or unicode line.
+        '''
+        waiter.fedLineCount += 1
+
+        # Keep the first matched result.
+        if not waiter.result:
+            waiter.result = waiter.matcher.feed(
+                self.__convertForMatcher(waiter.matcher, line))
+            if waiter.result:
+                waiter.matchedLineCount = waiter.fedLineCount
+
+    def __feedBatch(self, waiter, lines):
+        u'''
+        Feed lines to the matcher of the waiter at once.
+
+        This method must be called by the thread that owns the waiter.
+
+        Arguments :
+            waiter : LogWaiter.
+            lines : List of str lines encoded in UTF-8 or unicode lines.
+        '''
+        waiter.fedLineCount += len(lines)
+
+        if not waiter.result:
+            waiter.result = waiter.matcher.feed(
+                self.__convertForMatcher(waiter.matcher, ''.join(lines)))
+            if waiter.result:
+                waiter.matchedLineCount = waiter.fedLineCount
+
+    def __dispatch(self, isForced = False, waitsDispatching = False):
+        u'''
+        Dispatch pending lines to all registered waiters.
+
+        Unless LogMatcher is persistent, the lines are matched at once.
+        Persistent LogMatcher matches each line to move the checkpoint to
+        the matched line.
+
+        Only one thread dispatches lines at a time, and the lock is not held
+        while matchers run. If another thread is dispatching lines,
+        this method leaves pending lines to the thread.
+
+        This method must be called without the lock.
+
+        Arguments :
+            isForced : True if pending lines are dispatched even if they are
+                fewer than the batch size and they do not wait for
+                the latency.
+            waitsDispatching : True if this method waits for the thread that
+                is dispatching lines and dispatches the rest of pending lines.
+        '''
+        while True:
+            lockingTime = time.time()
+            with self.__lock:
+                self.__lockWaitTime += time.time() - lockingTime
+                while waitsDispatching and self.__isDispatching:
+                    self.__lock.wait()
+                if self.__isDispatching or not self.__waiters or \
+                        not self.__pendingLines:
+                    return
+                if not isForced and not self.__isBatchReady(time.time()):
+                    return
+
+                lines = self.__pendingLines
+                arrivals = self.__pendingArrivals
+                self.__pendingLines = []
+                self.__pendingArrivals = []
+                self.__pendingTime = None
+
+                beginIndex = self.__dispatchedLineCount
+                beginOffset = self.__dispatchedLength
+                self.__dispatchedLineCount += len(lines)
+                for line in lines:
+                    self.__dispatchedLength += len(line)
+
+                self.__evaluationCount += 1
+                self.__evaluatedLineCount += len(lines)
+                self.__maximumEvaluatedBatchSize = max(
+                    self.__maximumEvaluatedBatchSize, len(lines))
+
+                waiters = list(self.__waiters)
+                waitersVersion = self.__waitersVersion
+                self.__isDispatching = True
+
+            matchedWaiters = []
+            matchingTime = time.time()
+            if self.__profiler:
+                token = self.__profiler.begin(matchingStage)
+            try:
+                matchedWaiters = self.__feedWaiters(
+                    waiters, waitersVersion, lines, beginIndex, beginOffset)
+            finally:
+                if self.__profiler:
+                    self.__profiler.end(matchingStage, token)
+                matchedTime = time.time()
+                with self.__lock:
+                    self.__matchingTime += matchedTime - matchingTime
+                    self.__matcherEvaluationCount += len(waiters) * len(lines)
+                    for waiter in matchedWaiters:
+                        self.__recordLatency(waiter, arrivals, matchedTime)
+                        self.__unregisterWaiter(waiter)
+                        self.__matchResult = waiter.result
+                    self.__isDispatching = False
+                    self.__lock.notifyAll()
+
+            # If the lines are matched, terminate the logcat and
+            # wake the waiting events.
+            if matchedWaiters and not self.__isPersistent:
+                self.__logcatThread.terminate()
+            for waiter in matchedWaiters:
+                waiter.matchedEvent.set()
+                if waiter.handle:
+                    self.__finishAsyncWaiting(waiter)
+
+    def __recordLatency(self, waiter, arrivals, matchedTime):
+        u'''
+        Record seconds from receiving the matched line to matching it.
+
+        This method must be called with the lock.
+
+        Arguments :
+            waiter : Matched LogWaiter.
+            arrivals : List of tuples of the index after received lines and
+                the time when they are received.
+            matchedTime : Time when the line is matched.
+        '''
+        index = bisect.bisect_left(
+            [end for end, arrivalTime in arrivals], waiter.matchedLineCount)
+        if index == len(arrivals):
+            return
+
+        latency = matchedTime - arrivals[index][1]
+        self.__latencyHistogram[
+            bisect.bisect_left(latencyHistogramBounds, latency)] += 1
+        self.__totalLatency += latency
+        self.__maximumLatency = max(self.__maximumLatency, latency)
+
+    def __feedWaiters(self, waiters, waitersVersion, lines, beginIndex,
+            beginOffset):
+        u'''
+        Feed lines to waiters.
+
+        Strings of waiters that wait for a string are found by
+        the shared StringIndex. Lines are fed to matchers of other waiters.
+
+        This method must be called by the thread that is dispatching lines.
+
+        Arguments :
+            waiters : List of registered LogWaiter.
+            waitersVersion : Version of the registry of waiters.
+            lines : List of str lines encoded in UTF-8 or unicode lines.
+            beginIndex : Index of the first line.
+            beginOffset : Offset of the head of the first line in
+                the whole log.
+        Return :
+            List of matched LogWaiter.
+        '''
+        matchedWaiters = []
+        indexedWaiters = []
+        for waiter in waiters:
+            if waiter.indexedString is not None:
+                indexedWaiters.append(waiter)
+                continue
+
+            # Lines before the checkpoint of the waiter are skipped.
+            waiterLines = lines
+            if beginIndex < waiter.fedLineCount:
+                waiterLines = lines[waiter.fedLineCount - beginIndex:]
+
+            if self.__isPersistent:
+                for line in waiterLines:
+                    self.__feed(waiter, line)
+                    if waiter.result:
+                        break
+            elif waiterLines:
+                self.__feedBatch(waiter, waiterLines)
+
+            if waiter.result:
+                matchedWaiters.append(waiter)
+
+        if not indexedWaiters:
+            return matchedWaiters
+
+        # Rebuild the index if the registry is changed.
+        if self.__stringIndexVersion != waitersVersion:
+            tailLength = max([len(waiter.indexedString)
+                for waiter in indexedWaiters]) - 1
+            self.__stringIndex = StringIndex(
+                indexedWaiters, self.__getTail(beginIndex, tailLength))
+            self.__stringIndexVersion = waitersVersion
+
+        endIndex = beginIndex + len(lines)
+        for waiter in indexedWaiters:
+            waiter.fedLineCount = max(waiter.fedLineCount, endIndex)
+
+        for waiter, position in self.__stringIndex.search(
+                ''.join(lines), beginOffset):
+            waiter.result = True
+            waiter.matchedLineCount = endIndex
+
+            # Persistent LogMatcher moves the checkpoint to the line that
+            # contains the tail of the string.
+            if self.__isPersistent:
+                lineEnd = 0
+                for lineIndex, line in enumerate(lines):
+                    lineEnd += len(line)
+                    if position <= lineEnd:
+                        waiter.matchedLineCount = beginIndex + lineIndex + 1
+                        break
+            matchedWaiters.append(waiter)
+
+        return matchedWaiters
+
+    def __getTail(self, end, length):
+        u'''
+        Get the tail of log in memory before the line.
+
+        Arguments :
+            end : Index after the last line of the tail.
+            length : Minimum length of the tail.
+        Return :
+            Joined lines that are at least length characters if they are
+            in memory.
+        '''
+        snapshot = self.__log.getSnapshot()
+        lines = []
+        tailLength = 0
+        while tailLength < length and snapshot.getFirstLineIndex() < end:
+            end -= 1
+            line = snapshot.getLines(end, end + 1)[0]
+            lines.append(line)
+            tailLength += len(line)
+
+        lines.reverse()
+        return ''.join(lines)
+
+    def __registerWaiter(self, waiter):
+        u'''
+        Register a waiter that receives lines.
+
+        This method must be called with the lock.
+
+        Arguments :
+            waiter : LogWaiter.
+        '''
+        self.__waiters.append(waiter)
+        self.__waitersVersion += 1
+
+    def __unregisterWaiter(self, waiter):
+        u'''
+        Remove a waiter from the registry if it is registered.
+
+        If no waiter is registered, pending lines are discarded.
+
+        This method must be called with the lock.
+
+        Arguments :
+            waiter : LogWaiter.
+        '''
+        if waiter in self.__waiters:
+            self.__waiters.remove(waiter)
+            self.__waitersVersion += 1
+
+        if not self.__waiters:
+            self.__skipPendingLines()
+
+    def __skipPendingLines(self):
+        u'''
+        Skip lines that are not dispatched because no waiter is registered.
+
+        This method must be called with the lock.
+        '''
+        self.__pendingLines = []
+        self.__pendingTime = None
+        self.__pendingArrivals = []
+        self.__dispatchedLineCount = self.__log.getLineCount()
+        self.__dispatchedLength = self.__log.getLength()
+
+    def __isBatchReady(self, now):
+        u'''
+        Check whether pending lines are matched.
+
+        Pending lines are matched when they are as many as the batch size or
+        the oldest of them waits for the latency.
+
+        This method must be called with the lock.
+
+        Arguments :
+            now : Current time.
+        '''
+        return self.__matchingLatency is None or \
+            self.__batchSize <= len(self.__pendingLines) or \
+            self.__pendingTime + self.__matchingLatency <= now
+
+    def __updateBatchSize(self, lineCount, now):
+        u'''
+        Update the arrival rate of lines and the number of lines that are
+        matched at once.
+
+        The number of lines is the lines that are expected to arrive within
+        the matching latency.
+
+        This method must be called with the lock.
+
+        Arguments :
+            lineCount : Number of received lines.
+            now : Time when the lines are received.
+        '''
+        if self.__matchingLatency is None:
+            return
+
+        if self.__arrivalTime is not None:
+            rate = lineCount / max(now - self.__arrivalTime, 0.001)
+            self.__arrivalRate = \
+                self.__arrivalRate * 0.8 + rate * 0.2
+        self.__arrivalTime = now
+
+        self.__batchSize = int(min(
+            max(self.__arrivalRate * self.__matchingLatency, 1),
+            maximumBatchSize))
+
+    def getBatchStatistics(self):
+        u'''
+        Get statistics of matching lines at once.
+
+        This method may be called by other thread.
+
+        Return :
+            dict that has "batchSize" (the current number of lines that are
+            matched at once), "arrivalRate" (lines per second),
+            "evaluationCount", "evaluatedLineCount",
+            "averageBatchSize" and "maximumBatchSize".
+        '''
+        with self.__lock:
+            averageBatchSize = 0.0
+            if self.__evaluationCount:
+                averageBatchSize = \
+                    float(self.__evaluatedLineCount) / self.__evaluationCount
+
+            return {
+                'batchSize' : self.__batchSize,
+                'arrivalRate' : self.__arrivalRate,
+                'evaluationCount' : self.__evaluationCount,
+                'evaluatedLineCount' : self.__evaluatedLineCount,
+                'averageBatchSize' : averageBatchSize,
+                'maximumBatchSize' : self.__maximumEvaluatedBatchSize}
+
+    def stats(self):
+        u'''
+        Get statistics of reading and matching log.
+
+        This method may be called by other thread.
+
+        Return :
+            dict that has the following keys and the keys of
+            getBatchStatistics.
+            "receivedLineCount" and "receivedByteCount" : Lines and bytes
+                that are received from logcat.
+            "queueDepth", "maximumQueueDepth" and "droppedLineCount" :
+                Lines in the queue between reading and matching.
+            "decodingTime" : Seconds to decode lines.
+            "lockWaitTime" : Seconds to acquire the lock by receiving and
+                dispatching lines.
+            "matchingTime" : Seconds to feed dispatched lines to matchers.
+            "matcherEvaluationCount" : Dispatched lines that are counted for
+                each waiter.
+            "waiterCount" : Number of waiting threads.
+            "latencyHistogram" : List of pairs of the upper bound of seconds
+                from receiving a line to matching it and the number of
+                matched lines. The bound of the last pair is None.
+            "matchedCount", "averageLatency" and "maximumLatency" :
+                Statistics of the seconds.
+        '''
+        with self.__lock:
+            matchedCount = sum(self.__latencyHistogram)
+            averageLatency = 0.0
+            if matchedCount:
+                averageLatency = self.__totalLatency / matchedCount
+
+            statistics = {
+                'receivedLineCount' : self.__receivedLineCount,
+                'receivedByteCount' : self.__receivedByteCount,
+                'decodingTime' : self.__decodingTime,
+                'lockWaitTime' : self.__lockWaitTime,
+                'matchingTime' : self.__matchingTime,
+                'matcherEvaluationCount' : self.__matcherEvaluationCount,
+                'waiterCount' : len(self.__waiters),
+                'latencyHistogram' : zip(
+                    latencyHistogramBounds + [None], self.__latencyHistogram),
+                'matchedCount' : matchedCount,
+                'averageLatency' : averageLatency,
+                'maximumLatency' : self.__maximumLatency}
+
+        statistics.update(self.getBatchStatistics())
+        statistics['queueDepth'] = self.getQueueDepth()
+        statistics['maximumQueueDepth'] = self.getMaximumQueueDepth()
+        statistics['droppedLineCount'] = self.getDroppedLineCount()
+        return statistics
+
+    def __dumpStatistics(self, waiter):
+        u'''
+        Append the result of stats to the file of statisticsPath.
+
+        Arguments :
+            waiter : LogWaiter that finishes waiting.
+        '''
+        record = dumpJson({
+            'time' : time.time(),
+            'serial' : self.__serial,
+            'matched' : bool(waiter.result),
+            'statistics' : self.stats()})
+
+        with statisticsLock:
+            statisticsFile = open(self.__statisticsPath, 'a')
+            try:
+                statisticsFile.write(record + '\n')
+            finally:
+                statisticsFile.close()
+
+    def getEvictedLogSize(self):
+        u'''
+        Get bytes of log that is evicted from memory by maximumLogSize.
+
+        This method may be called by other thread.
+        '''
+        with self.__lock:
+            return self.__log.getEvictedSize()
+
+    def getSpilledLogSize(self):
+        u'''
+        Get bytes of log that is spilled to the temporary file.
+
+        This method may be called by other thread.
+        '''
+        with self.__lock:
+            return self.__log.getSpilledSize()
+
+    def getQueueDepth(self):
+        u'''
+        Get the number of lines in the queue between reading and matching.
+
+        This method may be called by other thread.
+        '''
+        if self.__logQueue:
+            return self.__logQueue.getDepth()
+        return 0
+
+    def getMaximumQueueDepth(self):
+        u'''
+        Get the maximum number of lines in the queue.
+
+        This method may be called by other thread.
+        '''
+        if self.__logQueue:
+            return self.__logQueue.getMaximumDepth()
+        return 0
+
+    def getDroppedLineCount(self):
+        u'''
+        Get the number of lines that are dropped because the queue is full.
+
+        This method may be called by other thread.
+        '''
+        if self.__logQueue:
+            return self.__logQueue.getDroppedLineCount()
+        return 0
+
+    def searchLog(self, pattern):
+        u'''
+        Search a pattern in each line of the received log
+        including spilled log.
+
+        This method may be called by other thread.
+
+        Arguments :
+            pattern : Searching pattern. str or unicode,
+                compiled regular expression pattern.
+        Return :
+            Match object of the first matched line, or None.
+        '''
+        if isinstance(pattern, basestring):
+            pattern = re.compile(unicode(pattern))
+
+        return self.__log.search(pattern)
+
+    def findLogLines(self, pattern = None, tag = None, pid = None):
+        u'''
+        Find received lines in memory that match a pattern and have a tag
+        and a process ID.
+
+        If the log is indexed, candidate lines are narrowed by the literals
+        required by the pattern, the tag and the process ID before
+        the pattern is matched. Otherwise, all lines in memory are matched.
+
+        This method may be called by other thread.
+
+        Arguments :
+            pattern : Searching pattern. str or unicode,
+                compiled regular expression pattern, or None.
+            tag : Tag of lines, or None.
+            pid : Process ID of lines, or None.
+        Return :
+            List of tuples of the index of the line, the unicode line and
+            Match object of the pattern, in order of lines. Match object is
+            None if the pattern is None.
+        '''
+        if isinstance(pattern, basestring):
+            pattern = re.compile(unicode(pattern))
+
+        snapshot = self.__log.getSnapshot()
+        begin = snapshot.getFirstLineIndex()
+        end = snapshot.getLineCount()
+
+        candidates = None
+        if self.__logIndex:
+            literals = []
+            if pattern is not None:
+                literals = findRequiredLiterals(pattern)
+            candidates = self.__logIndex.findLines(literals, tag, pid)
+        if candidates is None:
+            candidates = xrange(begin, end)
+
+        parser = LogRecordParser()
+        foundLines = []
+        for lineIndex in candidates:
+            if lineIndex < begin:
+                continue
+            if end <= lineIndex:
+                break
+
+            line = self.__decode(
+                snapshot.getLines(lineIndex, lineIndex + 1)[0])
+            if tag is not None or pid is not None:
+                record = parser.parse(line)
+                if not record or \
+                        (tag is not None and tag != record.tag) or \
+                        (pid is not None and pid != record.pid):
+                    continue
+
+            matchObject = None
+            if pattern is not None:
+                matchObject = pattern.search(line)
+                if not matchObject:
+                    continue
+            foundLines.append((lineIndex, line, matchObject))
+
+        return foundLines
+
+    def waitMatcher(self, matcher, timeout = defaultTimeout):
+        u'''
+        Wait called thread until the incremental matcher matches log.
+
+        If matcher returns not None or not False,
+        this method also return it.
+
+        Many threads can wait at the same time. Each received line is
+        dispatched once to all waiting threads.
+
+        Arguments:
+            matcher : Incremental matcher that has feed(log).
+                feed receives log that is received after the last feeding.
+                feed may be called by other thread.
+                If the matcher has getDeadline(), waiting also finishes
+                at the time that it returns.
+            timeout : Seconds until timeout.
+        '''
+        return self.__wait(LogWaiter(matcher, self.createMatchedEvent()),
+            timeout)
+
+    def __beginWaiting(self, waiter):
+        u'''
+        Match the log that has already been received and register the waiter
+        unless it matches.
+
+        Arguments :
+            waiter : LogWaiter that is not registered.
+        '''
+        matcher = waiter.matcher
+
+        # Strings that have the same type as stored lines are found by
+        # the shared index.
+        if isinstance(matcher, StringMatcher) and matcher.getString() and \
+                getattr(matcher, 'acceptsBytes', False) == \
+                    self.__matchesBytes:
+            waiter.indexedString = matcher.getString()
+
+        with self.__lock:
+            self.__matchResult = None
+            snapshot = self.__log.getSnapshot()
+            waiter.beginLineIndex = max(
+                self.__checkpoint, snapshot.getFirstLineIndex())
+            waiter.beginOffset = snapshot.getOffset(waiter.beginLineIndex)
+            waiter.fedLineCount = waiter.beginLineIndex
+            waiter.matchedLineCount = waiter.beginLineIndex
+
+        # Match the log that has already been dispatched without the lock
+        # and register the waiter when it catches up with dispatching.
+        waiter.result = matcher.feed(self.__convertForMatcher(matcher, u''))
+        while not waiter.result:
+            with self.__lock:
+                end = self.__dispatchedLineCount
+                if end <= waiter.fedLineCount:
+                    self.__registerWaiter(waiter)
+                    break
+                snapshot = self.__log.getSnapshot()
+
+            waiter.fedLineCount = max(
+                waiter.fedLineCount, snapshot.getFirstLineIndex())
+            for line in snapshot.getLines(waiter.fedLineCount, end):
+                self.__feed(waiter, line)
+                if waiter.result:
+                    break
+        if waiter.result:
+            self.__matchResult = waiter.result
+
+    def __getDeadlines(self, waiter, deadline):
+        u'''
+        Get the deadline of waiting and the deadline of pending lines.
+
+        Arguments :
+            waiter : LogWaiter.
+            deadline : Time of timeout.
+        Return :
+            Tuple of the earlier of timeout and the deadline of the matcher,
+            and the time when pending lines wait for the latency or None.
+        '''
+        waitingDeadline = deadline
+        with self.__lock:
+            if hasattr(waiter.matcher, 'getDeadline'):
+                matcherDeadline = waiter.matcher.getDeadline()
+                if matcherDeadline is not None:
+                    waitingDeadline = min(waitingDeadline, matcherDeadline)
+
+            pendingDeadline = None
+            if self.__pendingTime is not None:
+                pendingDeadline = self.__pendingTime + self.__matchingLatency
+
+        return waitingDeadline, pendingDeadline
+
+    def __wait(self, waiter, timeout):
+        u'''
+        Wait called thread until the matcher of the waiter matches log.
+
+        Arguments :
+            waiter : LogWaiter that is not registered.
+            timeout : Seconds until timeout.
+        Return :
+            Result of the matcher.
+        '''
+        try:
+            self.__beginWaiting(waiter)
+
+            # Wait matching until timeout or the deadline of the matcher.
+            # If the log has already matched, return immediately.
+            deadline = time.time() + timeout
+            while not waiter.result:
+                waitingDeadline, pendingDeadline = \
+                    self.__getDeadlines(waiter, deadline)
+
+                # Match pending lines if they wait for the latency.
+                now = time.time()
+                if pendingDeadline is not None and pendingDeadline <= now:
+                    self.__dispatch(True)
+                    continue
+                if waitingDeadline <= now:
+                    break
 
-# Default waiting timeout.
-defaultTimeout = 5
+                if pendingDeadline is not None:
+                    waitingDeadline = min(waitingDeadline, pendingDeadline)
+                waiter.matchedEvent.wait(waitingDeadline - now)
 
-class LogcatThread(Thread):
-    u'''
-    Thread that runs logcat.
-    '''
+            # Match lines that are received until timeout including lines
+            # in the queue.
+            if not waiter.result and self.__logQueue:
+                self.__logQueue.waitFinished(
+                    self.__logQueue.getPutLineCount(), maximumDrainingTime)
+            if not waiter.result:
+                self.__dispatch(True, True)
+        finally:
+            self.__finishWaiting(waiter)
 
-    def __init__(self, logListener, logcatArgument):
-        u'''
-        Constructor.
+        return waiter.result
 
-        Run logcat.
+    def __waitAsync(self, waiter, timeout, callback):
+        u'''
+        Start waiting that does not block called thread.
 
-        Argument :
-            logListener : Listener for log.
-                This listener has onLogReceived(line).
-            logcatArgument : String of arguments for logcat.
+        Arguments :
+            waiter : LogWaiter that is not registered.
+            timeout : Seconds until timeout.
+            callback : Function that is called with the result, or None.
+        Return :
+            WaitHandle.
         '''
-        Thread.__init__(self, name = u'LogcatThread')
+        waiter.handle = WaitHandle(
+            lambda: self.__finishAsyncWaiting(waiter), callback)
+        try:
+            self.__beginWaiting(waiter)
+        except:
+            self.__finishWaiting(waiter)
+            raise
 
-        # Start logcat after clear log.
-        #
-        # Do not start logcat in run(). Because run() runs on a created thread
-        # and log is forgotten between start() and run().
-        #
-        # Use shell on no Windows only. Because this script will kill the
-        # created process, but on windows, shell only is killed and adb process
-        # remains.
-        useShell = not isWindows
-        subprocess.Popen(
-            u'adb logcat -c ' + logcatArgument, stdout = subprocess.PIPE,
-            shell = useShell).wait()
-        self.__adb = subprocess.Popen(
-            u'adb logcat ' + logcatArgument, stdout = subprocess.PIPE,
-            shell = useShell)
+        if waiter.result:
+            self.__finishAsyncWaiting(waiter)
+        else:
+            self.__checkAsyncWaiting(waiter, time.time() + timeout)
 
-        # Lock object for this thread.
-        self.__lock = RLock()
+        return waiter.handle
 
-        self.__logListener = logListener
-        self.__isTerminated = False
+    def __checkAsyncWaiting(self, waiter, deadline):
+        u'''
+        Finish waiting that does not block if it times out, or schedule
+        the next check by the timer.
 
-        # This thread is daemon thread to prevent that this thread is running
-        # forever. Because this thread is blocked by reading with
-        # the standard output.
-        self.setDaemon(True)
+        Arguments :
+            waiter : LogWaiter.
+            deadline : Time of timeout.
+        '''
+        if waiter.handle.isDone():
+            return
 
-    def run(self):
-        # If this thread has already terminated, finish this thread.
-        with self.__lock:
-            if self.__isTerminated:
+        # Match pending lines if they wait for the latency.
+        waitingDeadline, pendingDeadline = \
+            self.__getDeadlines(waiter, deadline)
+        if pendingDeadline is not None and pendingDeadline <= time.time():
+            self.__dispatch(True)
+            if waiter.handle.isDone():
                 return
+            waitingDeadline, pendingDeadline = \
+                self.__getDeadlines(waiter, deadline)
 
-        # Notice received log until this thread is terminated.
-        with self.__adb.stdout as logcat:
-            for line in iter(logcat.readline, ''):
-                self.__logListener.onLogReceived(line)
+        now = time.time()
+        if waitingDeadline <= now:
+            # Check again until lines that are queued before timeout are
+            # matched.
+            if self.__logQueue:
+                if waiter.queuedLineCount is None:
+                    waiter.queuedLineCount = \
+                        self.__logQueue.getPutLineCount()
+                if not self.__logQueue.isFinished(waiter.queuedLineCount) \
+                        and now < deadline + maximumDrainingTime:
+                    waiter.timerEntry = self.__waitTimer.schedule(
+                        now + drainingCheckInterval,
+                        lambda: self.__checkAsyncWaiting(waiter, deadline))
+                    return
 
-                with self.__lock:
-                    if self.__isTerminated:
-                        break
+            self.__dispatch(True, True)
+            self.__finishAsyncWaiting(waiter)
+            return
 
-    def terminate(self):
+        if pendingDeadline is not None:
+            waitingDeadline = min(waitingDeadline, pendingDeadline)
+        waiter.timerEntry = self.__waitTimer.schedule(waitingDeadline,
+            lambda: self.__checkAsyncWaiting(waiter, deadline))
+
+    def __finishAsyncWaiting(self, waiter):
         u'''
-        Request terminating this thread.
-        '''
+        Finish waiting that does not block once, and notice the result to
+        the handle.
 
-        # Raise the termination flag.
+        Arguments :
+            waiter : LogWaiter.
+        '''
         with self.__lock:
-            isNeededProcessTerminating = not self.__isTerminated
-            self.__isTerminated = True
+            if waiter.isFinished:
+                return
+            waiter.isFinished = True
 
-        # Terminate adb process.
-        if isNeededProcessTerminating:
-            kill(self.__adb)
+        if waiter.timerEntry:
+            self.__waitTimer.cancel(waiter.timerEntry)
+        self.__finishWaiting(waiter)
+        waiter.handle.finish(waiter.result)
 
-class LogMatcher:
-    u'''
-    Monitor and match log from logcat.
-    '''
+    def waitMatcherAsync(self, matcher, timeout = defaultTimeout,
+            callback = None):
+        u'''
+        Start waiting until the incremental matcher matches log without
+        blocking called thread.
+
+        Log that has already been received is matched by called thread.
+        After that, no thread is blocked for the waiting, and timeout is
+        handled by a single timer thread of LogMatcher.
+
+        Arguments :
+            matcher : Incremental matcher that has feed(log).
+            timeout : Seconds until timeout.
+            callback : Function that is called with the result of the matcher
+                when waiting finishes, or None. It may be called by
+                other thread, so it must not block.
+        Return :
+            WaitHandle of the waiting.
+        '''
+        return self.__waitAsync(
+            LogWaiter(matcher, self.createMatchedEvent()), timeout, callback)
 
-    def start(self, logcatArgument = u''):
+    def waitAsync(self, match, timeout = defaultTimeout, callback = None):
         u'''
-        Start watching logcat.
+        Start waiting until the string is found in log without blocking
+        called thread.
 
         Arguments:
-            logcatArgument : String of arguments for logcat.
+            match : Searching string.
+            timeout : Seconds until timeout.
+            callback : Function that is called with True or False when
+                waiting finishes, or None.
+        Return :
+            WaitHandle of the waiting.
+        Exception :
+            ValueError : If type of match is not str or unicode.
         '''
-        self.__matchedEvent = self.createMatchedEvent()
-        self.__logcatThread = self.createLogcatThread(logcatArgument)
-        self.__lock = RLock()
-        self.__log = u''
-        self.__matchFunction = (lambda log: False)
+        return self.waitMatcherAsync(
+            self.__createStringMatcher(match), timeout, callback)
 
-        self.__logcatThread.start()
+    def waitPatternAsync(self, pattern, timeout = defaultTimeout,
+            callback = None):
+        u'''
+        Start waiting until the pattern is matched in log without blocking
+        called thread.
 
-    def createLogcatThread(self, logcatArgument):
+        Arguments :
+            pattern : Searching pattern. str or unicode,
+                compiled regular expression pattern.
+            timeout : Seconds until timeout.
+            callback : Function that is called with Match object or None when
+                waiting finishes, or None.
+        Return :
+            WaitHandle of the waiting.
+        '''
+        return self.waitMatcherAsync(
+            self.__createPatternMatcher(pattern), timeout, callback)
+
+    def readLines(self, begin = 0):
         u'''
-        Create LogcatThread.
+        Read received lines in memory without blocking.
 
-        This method is for testability.
+        Lines can be streamed by passing the returned index to the next
+        reading.
 
-        Arguments:
-            logcatArgument : String of arguments for logcat.
+        This method may be called by other thread.
+
+        Arguments :
+            begin : Index of the first line.
+        Return :
+            Tuple of the list of unicode lines and the index after them.
+            Evicted lines are not returned.
         '''
-        return LogcatThread(self, logcatArgument)
+        snapshot = self.__log.getSnapshot()
+        return ([self.__decode(line) for line in snapshot.getLines(begin)],
+            max(begin, snapshot.getLineCount()))
 
-    def createMatchedEvent(self):
+    def __finishWaiting(self, waiter):
         u'''
-        Create Event for matching.
+        Finish waiting.
 
-        This method is for testability.
+        Terminate logcat, or move the checkpoint if LogMatcher is persistent.
+        When many threads wait at the same time, the checkpoint moves to
+        the furthest line of them.
+
+        Arguments :
+            waiter : LogWaiter.
         '''
-        return Event()
+        if not self.__isPersistent:
+            self.__logcatThread.terminate()
+            if self.__profiler:
+                self.__profiler.finish()
+
+        with self.__lock:
+            while self.__isDispatching:
+                self.__lock.wait()
+            self.__unregisterWaiter(waiter)
+
+            if waiter.result:
+                checkpoint = waiter.matchedLineCount
+            else:
+                checkpoint = waiter.fedLineCount
+            self.__checkpoint = max(self.__checkpoint, checkpoint)
+            self.__matchResult = waiter.result
+
+        if self.__statisticsPath:
+            self.__dumpStatistics(waiter)
 
     def waitFunction(self, matchFunction, timeout= defaultTimeout):
         u'''
@@ -185,30 +5261,19 @@ class LogMatcher:
         If matchFunction returns not None or not False,
         this method also return it.
 
+        The function is called with the whole log whenever a line is received.
+        Use wait, waitPattern or waitMatcher for long log.
+
         Arguments:
             matchFunction : Matching function.
                 It has an argument that received log.
                 This function may be called by other thread.
             timeout : Seconds until timeout.
         '''
-
-        # Set matching.
-        with self.__lock:
-            self.__matchFunction = matchFunction
-
-        try:
-            # If the log has already matched, return immediately.
-            result = self.checkMatched()
-            if result:
-                return result
-
-            # Wait matching until timeout.
-            self.__matchedEvent.wait(timeout)
-        finally:
-            self.__logcatThread.terminate()
-
-        return self.checkMatched()
-
+        waiter = LogWaiter(None, self.createMatchedEvent())
+        waiter.matcher = FunctionMatcher(
+            matchFunction, lambda: self.__getFedLog(waiter))
+        return self.__wait(waiter, timeout)
 
     def wait(self, match, timeout = defaultTimeout):
         u'''
@@ -221,12 +5286,25 @@ class LogMatcher:
             ValueError : If type of match is not str or unicode.
         '''
 
+        return self.waitMatcher(self.__createStringMatcher(match), timeout)
+
+    def __createStringMatcher(self, match):
+        u'''
+        Create the incremental matcher of a string.
+
+        Arguments :
+            match : Searching string.
+        Exception :
+            ValueError : If type of match is not str or unicode.
+        '''
+
         # Verify argument.
         if not isinstance(match, basestring):
             raise ValueError(u'match type is ' + unicode(type(match)))
 
-        return self.waitFunction(
-            lambda log: 0 <= log.find(unicode(match)), timeout)
+        if self.__matchesBytes:
+            return BytesStringMatcher(unicode(match))
+        return StringMatcher(unicode(match))
 
     def waitPattern(self, pattern, timeout = defaultTimeout):
         u'''
@@ -238,14 +5316,216 @@ class LogMatcher:
             timeout : Seconds until timeout.
         '''
 
+        return self.waitMatcher(self.__createPatternMatcher(pattern), timeout)
+
+    def __createPatternMatcher(self, pattern):
+        u'''
+        Create the incremental matcher of a pattern.
+
+        Arguments :
+            pattern : Searching pattern. str or unicode,
+                compiled regular expression pattern.
+        '''
+
         # Convert compiled regex pattern if pattern is basestring.
         if isinstance(pattern, basestring):
             waitingPattern = re.compile(unicode(pattern))
         else:
             waitingPattern = pattern
 
-        return self.waitFunction(
-            lambda log: waitingPattern.search(log), timeout)
+        # Match raw log only if the pattern has required literals.
+        if self.__matchesBytes:
+            literals = findRequiredLiterals(waitingPattern)
+        else:
+            literals = []
+
+        if literals:
+            return BytesPatternMatcher(waitingPattern, literals)
+        return PatternMatcher(waitingPattern)
+
+    def waitSequence(self, steps, timeout = defaultTimeout):
+        u'''
+        Wait called thread until the strings and the patterns are found
+        in order.
+
+        Arguments :
+            steps : List of steps. A step is a searching string,
+                a compiled regular expression pattern or a tuple of one of them
+                and seconds until the step is found after the previous step.
+                A string is not treated as a pattern.
+            timeout : Seconds until timeout of the whole sequence.
+        Return :
+            List of PatternHit objects of all steps, or None if any of them is
+            not found in order until timeout.
+        Exception :
+            ValueError : If type of a step is not str, unicode,
+                compiled regular expression pattern or tuple.
+        '''
+        waitingSteps = []
+        for step in steps:
+            if isinstance(step, tuple):
+                match, stepTimeout = step
+            else:
+                match, stepTimeout = step, None
+
+            if isinstance(match, basestring):
+                match = unicode(match)
+            elif not hasattr(match, 'search'):
+                raise ValueError(u'step type is ' + unicode(type(match)))
+            waitingSteps.append((match, stepTimeout))
+
+        return self.waitMatcher(SequenceMatcher(waitingSteps), timeout)
+
+    def waitRecord(self, tag = None, level = None, message = None, pid = None,
+            timeout = defaultTimeout):
+        u'''
+        Wait called thread until a line that satisfies the fields is found
+        in log.
+
+        Lines of "threadtime", "time" and "brief" formats are parsed.
+
+        Arguments :
+            tag : Tag of the line, or None.
+            level : The lowest priority of the line such as u'I', or None.
+            message : String that is found in the message of the line,
+                compiled regular expression pattern that is searched in
+                the message, or None.
+            pid : Process ID of the line, or None.
+            timeout : Seconds until timeout.
+        Return :
+            LogRecord of the found line, or None if it is not found.
+        Exception :
+            ValueError : If level is unknown.
+        '''
+        if isinstance(tag, str):
+            tag = unicode(tag)
+        if isinstance(message, str):
+            message = unicode(message)
+
+        return self.waitMatcher(RecordMatcher(
+            [RecordPredicate(tag, level, message, pid)]), timeout)
+
+    def waitAny(self, matches = (), patterns = (), timeout = defaultTimeout):
+        u'''
+        Wait called thread until any of the strings and the patterns is found
+        in log.
+
+        Arguments :
+            matches : List of searching strings.
+            patterns : List of searching patterns. str or unicode,
+                compiled regular expression pattern.
+            timeout : Seconds until timeout.
+        Return :
+            List of PatternHit objects that are found at first in order of
+            their positions, or None if nothing is found.
+        Exception :
+            ValueError : If type of a string is not str or unicode.
+        '''
+        return self.waitMatcher(
+            self.__createMultiMatcher(matches, patterns, False), timeout)
+
+    def waitAll(self, matches = (), patterns = (), timeout = defaultTimeout):
+        u'''
+        Wait called thread until all of the strings and the patterns are found
+        in log.
+
+        Arguments :
+            matches : List of searching strings.
+            patterns : List of searching patterns. str or unicode,
+                compiled regular expression pattern.
+            timeout : Seconds until timeout.
+        Return :
+            List of PatternHit objects of the strings and then the patterns
+            in order of arguments, or None if any of them is not found.
+        Exception :
+            ValueError : If type of a string is not str or unicode.
+        '''
+        return self.waitMatcher(
+            self.__createMultiMatcher(matches, patterns, True), timeout)
+
+    def __createMultiMatcher(self, matches, patterns, requiresAll):
+        u'''
+        Create MultiMatcher from arguments of waitAny and waitAll.
+        '''
+        for match in matches:
+            if not isinstance(match, basestring):
+                raise ValueError(u'match type is ' + unicode(type(match)))
+
+        waitingPatterns = []
+        for pattern in patterns:
+            if isinstance(pattern, basestring):
+                pattern = re.compile(unicode(pattern))
+            waitingPatterns.append(pattern)
+
+        return MultiMatcher(
+            [unicode(match) for match in matches], waitingPatterns,
+            requiresAll)
+
+    def onLogsReceived(self, lines):
+        u'''
+        Called when lines are received at once.
+
+        The lock is acquired once for the lines, and it is released before
+        the lines are matched. The lines are dispatched once to all waiters.
+
+        This method is called by other thread.
+
+        Arguments :
+            lines : List of str that represents log.
+        '''
+        decodingTime = 0.0
+        if self.__matchesBytes:
+            storedLines = lines
+        else:
+            decodingTime = time.time()
+            if self.__profiler:
+                token = self.__profiler.begin(decodingStage)
+            storedLines = [self.__decode(line) for line in lines]
+            if self.__profiler:
+                self.__profiler.end(decodingStage, token)
+            decodingTime = time.time() - decodingTime
+
+        # Index the lines before storing them, so that stored lines are
+        # always indexed.
+        if self.__logIndex:
+            self.__logIndex.removeLines(self.__log.getFirstLineIndex())
+            self.__logIndex.appendLines(storedLines)
+
+        # Store the lines and keep them pending for waiters.
+        sizes = [len(line) for line in lines]
+        lockingTime = time.time()
+        with self.__lock:
+            now = time.time()
+            self.__lockWaitTime += now - lockingTime
+            self.__decodingTime += decodingTime
+            self.__receivedLineCount += len(lines)
+            self.__receivedByteCount += sum(sizes)
+            if self.__logIndex:
+                self.__log.appendLines(
+                    storedLines, sizes, self.__logIndex.getSize())
+            else:
+                self.__log.appendLines(storedLines, sizes)
+
+            if not self.__waiters:
+                self.__skipPendingLines()
+                return
+
+            self.__pendingLines.extend(storedLines)
+            self.__pendingArrivals.append((self.__log.getLineCount(), now))
+            self.__updateBatchSize(len(lines), now)
+
+            # Match the lines by the timer when they wait for the latency,
+            # because waiting threads sleep until the deadlines that are
+            # known before the lines arrive.
+            if self.__pendingTime is None:
+                self.__pendingTime = now
+                if not self.__isBatchReady(now):
+                    self.__waitTimer.schedule(
+                        now + self.__matchingLatency, self.__dispatch)
+
+        # Match the lines when enough lines are pending or the oldest
+        # pending line waits for the latency.
+        self.__dispatch()
 
     def onLogReceived(self, line):
         u'''
@@ -259,26 +5539,16 @@ class LogMatcher:
         if not isinstance(line, str):
             raise ValueError(u'line is not str : ' + unicode(type(line)))
 
-        # Store the line.
-        with self.__lock:
-            # logcat outputs logs in UTF-8.
-            self.__log += unicode(line, 'utf8', 'replace')
-
-        # If the line is matched, terminate the logcat and
-        # wake the waiting event.
-
-        if self.checkMatched():
-            self.__logcatThread.terminate()
-            self.__matchedEvent.set()
+        self.onLogsReceived([line])
 
     def checkMatched(self):
         u'''
-        Check whether the log is matched.
+        Check whether the log is matched by the latest waiting.
 
-        This method may be called by other thread.
+        This method may be called by other thread, and it does not wait for
+        running matchers.
         '''
-        with self.__lock:
-            return self.__matchFunction(self.__log)
+        return self.__matchResult
 
 class LogMatcherRunningException(Exception):
     u'''
@@ -295,14 +5565,46 @@ class LogMatcherNotStartedException(Exception):
 # Global LogMatcher.
 currentLogcatMatcher = None
 
-def start(logcatArgument = u''):
+def start(logcatArgument = u'', maximumLogSize = None, spillLog = False,
+        startMode = clearStartMode, predicates = None, matchesBytes = False,
+        queueSize = None, queuePolicy = blockPolicy,
+        matchingLatency = None, serial = None, adbClient = None,
+        statisticsPath = None, profiler = None, indexesLog = False,
+        filtersPid = False):
     u'''
     Start watching logcat.
 
     Arguments :
         logcatArgument : String of arguments for logcat.
+        maximumLogSize : Maximum bytes of log that is kept in memory.
+            If it is None, the whole log is kept in memory.
+        spillLog : True if log over maximumLogSize is spilled to
+            a temporary file. Otherwise, the log is discarded.
+        startMode : Mode to start logcat. clearStartMode, timeStartMode
+            or markerStartMode.
+        predicates : List of RecordPredicate that represents lines to be
+            waited, or None. Filterspecs are created from them.
+        matchesBytes : True if strings and patterns are matched without
+            decoding log.
+        queueSize : Maximum number of lines in the queue between reading
+            logcat and matching, or None.
+        queuePolicy : blockPolicy, dropOldestPolicy or dropNewestPolicy.
+        matchingLatency : Maximum seconds that received lines wait for
+            matching at once, or None.
+        serial : Serial number of the device, or None.
+        adbClient : AdbClient that requests logcat to the adb server, or None
+            to run adb.
+        statisticsPath : Path of the file that statistics are appended to as
+            JSON at the end of waiting, or None.
+        profiler : Profiler such as StageTracer, or None.
+        indexesLog : True if received lines are indexed for findLogLines.
+        filtersPid : True if logcat also filters the process ID of
+            predicates. It requires Android 7.0 or above.
     Exception :
         LogMatcherRunningException : When log matcher is running.
+        ValueError : If startMode is unknown or cannot be used with
+            logcatArgument.
+        IOError : If the adb server refuses requests of adbClient.
     '''
 
     global currentLogcatMatcher
@@ -314,9 +5616,126 @@ def start(logcatArgument = u''):
 
     currentLogcatMatcher = LogMatcher()
     try:
-        currentLogcatMatcher.start(logcatArgument)
+        currentLogcatMatcher.start(logcatArgument,
+            maximumLogSize = maximumLogSize, spillLog = spillLog,
+            persistent = False, startMode = startMode,
+            predicates = predicates, matchesBytes = matchesBytes,
+            queueSize = queueSize, queuePolicy = queuePolicy,
+            matchingLatency = matchingLatency, serial = serial,
+            adbClient = adbClient, statisticsPath = statisticsPath,
+            profiler = profiler, indexesLog = indexesLog,
+            filtersPid = filtersPid)
     except:
+        # Release the global LogMatcher so that it can be started again,
+        # and notice the error to the caller.
         currentLogcatMatcher = None
+        raise
+
+def startSession(logcatArgument = u'', maximumLogSize = None,
+        spillLog = False, startMode = clearStartMode, predicates = None,
+        matchesBytes = False, queueSize = None,
+        queuePolicy = blockPolicy, matchingLatency = None, serial = None,
+        adbClient = None, statisticsPath = None, profiler = None,
+        indexesLog = False, filtersPid = False):
+    u'''
+    Start a session that keeps watching logcat across many waits.
+
+    The session is independent of the global LogMatcher.
+
+    Arguments :
+        logcatArgument : String of arguments for logcat.
+        maximumLogSize : Maximum bytes of log that is kept in memory.
+            If it is None, the whole log is kept in memory.
+        spillLog : True if log over maximumLogSize is spilled to
+            a temporary file. Otherwise, the log is discarded.
+        startMode : Mode to start logcat. clearStartMode, timeStartMode
+            or markerStartMode.
+        predicates : List of RecordPredicate that represents lines to be
+            waited, or None. Filterspecs are created from them.
+        matchesBytes : True if strings and patterns are matched without
+            decoding log.
+        queueSize : Maximum number of lines in the queue between reading
+            logcat and matching, or None.
+        queuePolicy : blockPolicy, dropOldestPolicy or dropNewestPolicy.
+        matchingLatency : Maximum seconds that received lines wait for
+            matching at once, or None.
+        serial : Serial number of the device, or None.
+        adbClient : AdbClient that requests logcat to the adb server, or None
+            to run adb. One AdbClient can be shared by sessions.
+        statisticsPath : Path of the file that statistics are appended to as
+            JSON at the end of each waiting, or None.
+        profiler : Profiler such as StageTracer, or None. Give a profiler to
+            each session to write a profile file per session.
+        indexesLog : True if received lines are indexed for findLogLines.
+        filtersPid : True if logcat also filters the process ID of
+            predicates. It requires Android 7.0 or above.
+    Return :
+        Persistent LogMatcher. Call stop of it at the end.
+    '''
+    session = LogMatcher()
+    session.start(logcatArgument, maximumLogSize = maximumLogSize,
+        spillLog = spillLog, persistent = True, startMode = startMode,
+        predicates = predicates, matchesBytes = matchesBytes,
+        queueSize = queueSize, queuePolicy = queuePolicy,
+        matchingLatency = matchingLatency, serial = serial,
+        adbClient = adbClient, statisticsPath = statisticsPath,
+        profiler = profiler, indexesLog = indexesLog,
+        filtersPid = filtersPid)
+    return session
+
+def startDevices(serials, logcatArgument = u'', maximumLogSize = None,
+        spillLog = False, startMode = clearStartMode, predicates = None,
+        matchesBytes = False, queueSize = None, queuePolicy = blockPolicy,
+        matchingLatency = None, adbClient = None, statisticsPath = None,
+        profiler = None, indexesLog = False, filtersPid = False):
+    u'''
+    Start sessions of devices.
+
+    logcat of all devices is read by a single thread if
+    isMultiplexingSupported is True. Lines are matched by the thread unless
+    queueSize is specified, so the number of threads does not grow with
+    devices.
+
+    Arguments :
+        serials : List of serial numbers of devices.
+        statisticsPath : Path of the file that statistics of all sessions are
+            appended to as JSON at the end of each waiting, or None. Each line
+            has the serial number of the session.
+        profiler : Profiler such as StageTracer that is shared by
+            the sessions, or None. Its file is written when each session
+            stops, with the timings of all sessions.
+        The others : The same as startSession.
+    Return :
+        dict of persistent LogMatcher by serial numbers. Call stop of each
+        of them at the end.
+    '''
+    multiplexer = None
+    if isMultiplexingSupported:
+        multiplexer = LogcatMultiplexer()
+
+    # Connect to the adb server for all devices at once.
+    if adbClient:
+        adbClient.prepare(len(serials))
+
+    sessions = {}
+    try:
+        for serial in serials:
+            session = LogMatcher()
+            session.start(logcatArgument, maximumLogSize = maximumLogSize,
+                spillLog = spillLog, persistent = True, startMode = startMode,
+                predicates = predicates, matchesBytes = matchesBytes,
+                queueSize = queueSize, queuePolicy = queuePolicy,
+                matchingLatency = matchingLatency, serial = serial,
+                multiplexer = multiplexer, adbClient = adbClient,
+                statisticsPath = statisticsPath, profiler = profiler,
+                indexesLog = indexesLog, filtersPid = filtersPid)
+            sessions[serial] = session
+    except:
+        for session in sessions.values():
+            session.stop()
+        raise
+
+    return sessions
 
 def waitFunction(callingWaitFunction):
     u'''
@@ -373,4 +5792,76 @@ def waitPattern(pattern, timeout = defaultTimeout):
     '''
 
     return waitFunction(
-        lambda logMatcher: logMatcher.waitPattern(pattern, timeout))
\ No newline at end of file
+        lambda logMatcher: logMatcher.waitPattern(pattern, timeout))
+
+def waitRecord(tag = None, level = None, message = None, pid = None,
+        timeout = defaultTimeout):
+    u'''
+    Wait until a line that satisfies the fields is found.
+
+    Arguments :
+        tag : Tag of the line, or None.
+        level : The lowest priority of the line such as u'I', or None.
+        message : String that is found in the message of the line,
+            compiled regular expression pattern that is searched in
+            the message, or None.
+        pid : Process ID of the line, or None.
+        timeout : Timeout seconds.
+    Return :
+        LogRecord of the found line.
+        None if such a line is not found until timeout.
+    '''
+
+    return waitFunction(lambda logMatcher: logMatcher.waitRecord(
+        tag, level, message, pid, timeout))
+
+def waitAny(matches = (), patterns = (), timeout = defaultTimeout):
+    u'''
+    Wait until any of the strings and the patterns is found.
+
+    Arguments :
+        matches : List of searching strings.
+        patterns : List of searching patterns. str or unicode,
+            compiled regular expression pattern.
+        timeout : Timeout seconds.
+    Return :
+        List of PatternHit objects that are found at first.
+        None if nothing is found until timeout.
+    '''
+
+    return waitFunction(
+        lambda logMatcher: logMatcher.waitAny(matches, patterns, timeout))
+
+def waitAll(matches = (), patterns = (), timeout = defaultTimeout):
+    u'''
+    Wait until all of the strings and the patterns are found.
+
+    Arguments :
+        matches : List of searching strings.
+        patterns : List of searching patterns. str or unicode,
+            compiled regular expression pattern.
+        timeout : Timeout seconds.
+    Return :
+        List of PatternHit objects of the strings and then the patterns.
+        None if any of them is not found until timeout.
+    '''
+
+    return waitFunction(
+        lambda logMatcher: logMatcher.waitAll(matches, patterns, timeout))
+
+def waitSequence(steps, timeout = defaultTimeout):
+    u'''
+    Wait until the strings and the patterns are found in order.
+
+    Arguments :
+        steps : List of steps. A step is a searching string,
+            a compiled regular expression pattern or a tuple of one of them
+            and seconds until the step is found after the previous step.
+        timeout : Timeout seconds of the whole sequence.
+    Return :
+        List of PatternHit objects of all steps.
+        None if any of them is not found in order until timeout.
+    '''
+
+    return waitFunction(
+        lambda logMatcher: logMatcher.waitSequence(steps, timeout))
\ No newline at end of file
@@ -18,8 +18,14 @@
 # Test for matching part of LogMatcher.
 
 import dummy_threading
+import json
+import os
+import pstats
 import re
+import socket
+import tempfile
 import threading
+import time
 import unittest
 
 import logmatcher
@@ -133,5 +139,1983 @@ class TestMatchingLog(unittest.TestCase):
         self.assertEquals(u'123',
             self.__matcher.waitPattern(ur'a(\d{3})b').group(1))
 
+    def testMatchedPatternAcrossLines(self):
+        u'''
+        LogMatcher matches pattern that spans received lines.
+        '''
+        self.__matcher.onLogReceived('ba1')
+        self.__matcher.onLogReceived('23b')
+
+        self.assertEqual(u'123',
+            self.__matcher.waitPattern(re.compile(ur'a(\d+)b'), 0.1).group(1))
+
+    def testMatchedFunctionWithWholeLog(self):
+        u'''
+        LogMatcher calls the function of waitFunction with the whole log.
+        '''
+        self.__matcher.onLogReceived('first\n')
+        self.__matcher.onLogReceived('second\n')
+
+        self.assertEqual(u'first\nsecond\n',
+            self.__matcher.waitFunction(
+                lambda log: u'second' in log and log, 0.1))
+
+    def testMatchedAny(self):
+        u'''
+        LogMatcher matches any of strings and patterns.
+        '''
+        self.__matcher.onLogReceived('first\n')
+        self.__matcher.onLogReceived('a123b\n')
+
+        hits = self.__matcher.waitAny(
+            [u'second', u'123'], [ur'a(\d+)b', u'third'], 0.1)
+
+        self.assertEqual([ur'a(\d+)b', u'123'],
+            [getattr(hit.match, 'pattern', hit.match) for hit in hits])
+        self.assertEqual([6, 7], [hit.start for hit in hits])
+        self.assertEqual(u'123', hits[0].matchObject.group(1))
+
+    def testNotMatchedAll(self):
+        u'''
+        LogMatcher does not match when any of strings is not found.
+        '''
+        self.__matcher.onLogReceived('first\n')
+
+        self.assert_(
+            self.__matcher.waitAll([u'first', u'second'], [], 0.1) is None)
+
+    def testMatchedAll(self):
+        u'''
+        LogMatcher matches when all of strings and patterns are found.
+        '''
+        self.__matcher.onLogReceived('sec')
+        self.__matcher.onLogReceived('ond first\n')
+        self.__matcher.onLogReceived('a1b\n')
+
+        hits = self.__matcher.waitAll(
+            [u'first', u'second'], [re.compile(ur'a\d'), ur'(b)\1?'], 0.1)
+
+        self.assertEqual([7, 0, 13, 15], [hit.start for hit in hits])
+
+    def testMatchedSequence(self):
+        u'''
+        LogMatcher matches steps in order.
+        '''
+        self.__matcher.onLogReceived('ready START\n')
+        self.__matcher.onLogReceived('Displayed a1')
+        self.__matcher.onLogReceived('23b ready\n')
+
+        hits = self.__matcher.waitSequence(
+            [u'START', re.compile(ur'a(\d+)b'), u'ready'], 0.1)
+
+        self.assertEqual([6, 22, 28], [hit.start for hit in hits])
+        self.assertEqual(u'123', hits[1].matchObject.group(1))
+
+    def testNotMatchedSequenceInReverseOrder(self):
+        u'''
+        LogMatcher does not match steps in reverse order.
+        '''
+        self.__matcher.onLogReceived('ready\n')
+        self.__matcher.onLogReceived('START\n')
+
+        self.assert_(
+            self.__matcher.waitSequence([u'START', u'ready'], 0.1) is None)
+
+    def testStepTimeout(self):
+        u'''
+        LogMatcher finishes waiting when a step is timed out.
+        '''
+        def sendLog(logMatcher):
+            logMatcher.onLogReceived('ready\n')
+
+        self.__matcher.onLogReceived('START\n')
+        threading.Timer(1, sendLog, [self.__matcher]).start()
+
+        startTime = time.time()
+        self.assert_(self.__matcher.waitSequence(
+            [u'START', (u'ready', 0.5)], 2) is None)
+        self.assert_(time.time() - startTime < 1)
+
+    def testMatchedRecord(self):
+        u'''
+        LogMatcher matches fields of a line.
+        '''
+        self.__matcher.onLogReceived(
+            '10-18 12:34:56.789  100  101 D ActivityManager: Displayed a\n')
+        self.__matcher.onLogReceived(
+            '10-18 12:34:56.790  100  101 I Other   : Displayed b\n')
+        self.__matcher.onLogReceived(
+            '10-18 12:34:56.791  100  102 I ActivityM')
+        self.__matcher.onLogReceived('anager: Displayed c\n')
+
+        record = self.__matcher.waitRecord(u'ActivityManager', u'I',
+            re.compile(ur'Displayed (\w)'), timeout = 0.1)
+
+        self.assertEqual(u'10-18 12:34:56.791', record.timestamp)
+        self.assertEqual(102, record.tid)
+        self.assertEqual(u'Displayed c', record.message)
+
+    def testNotMatchedRecordWithLowerLevel(self):
+        u'''
+        LogMatcher does not match a line that has lower priority.
+        '''
+        self.__matcher.onLogReceived('D/ActivityManager(  100): Displayed\n')
+
+        self.assert_(self.__matcher.waitRecord(
+            level = u'I', message = u'Displayed', timeout = 0.1) is None)
+
+class TestLogRecordParser(unittest.TestCase):
+    u'''
+    Test LogRecordParser.
+    '''
+
+    def setUp(self):
+        self.__parser = logmatcher.LogRecordParser()
+
+    def testThreadtime(self):
+        u'''
+        LogRecordParser parses "threadtime" format.
+        '''
+        record = self.__parser.parse(
+            u'10-18 12:34:56.789  100  101 W Tag     : a: b\r\n')
+
+        self.assertEqual(
+            (u'10-18 12:34:56.789', 100, 101, u'W', u'Tag', u'a: b'),
+            (record.timestamp, record.pid, record.tid, record.level,
+                record.tag, record.message))
+
+    def testTime(self):
+        u'''
+        LogRecordParser parses "time" format.
+        '''
+        record = self.__parser.parse(
+            u'10-18 12:34:56.789 E/Tag     (  100): message\n')
+
+        self.assertEqual(
+            (u'10-18 12:34:56.789', 100, None, u'E', u'Tag', u'message'),
+            (record.timestamp, record.pid, record.tid, record.level,
+                record.tag, record.message))
+
+    def testBrief(self):
+        u'''
+        LogRecordParser parses "brief" format.
+        '''
+        record = self.__parser.parse(u'I/Tag(12345): \u65e5\u672c\n')
+
+        self.assertEqual(
+            (None, 12345, u'I', u'Tag', u'\u65e5\u672c'),
+            (record.timestamp, record.pid, record.level, record.tag,
+                record.message))
+
+    def testUnknownFormat(self):
+        u'''
+        LogRecordParser does not parse an unknown line.
+        '''
+        self.assert_(
+            self.__parser.parse(u'--------- beginning of main\n') is None)
+
+class TestFilterspec(unittest.TestCase):
+    u'''
+    Test creating filterspecs from predicates.
+    '''
+
+    def testTaggedPredicates(self):
+        u'''
+        Only tags of predicates are output.
+        '''
+        self.assertEqual(u'A:I B:D *:S', logmatcher.createFilterspec([
+            logmatcher.RecordPredicate(u'B', u'D'),
+            logmatcher.RecordPredicate(u'A', u'W'),
+            logmatcher.RecordPredicate(u'A', u'I', u'message')]))
+
+    def testUntaggedPredicate(self):
+        u'''
+        Levels of tags are lowered by a predicate without tag.
+        '''
+        self.assertEqual(u'A:I *:I', logmatcher.createFilterspec([
+            logmatcher.RecordPredicate(u'A', u'E'),
+            logmatcher.RecordPredicate(level = u'I'),
+            logmatcher.RecordPredicate(u'tag with space', u'W')]))
+
+    def testPid(self):
+        u'''
+        A process ID is output only if it is requested and all predicates
+        have it.
+        '''
+        self.assertEqual(u'A:V *:S', logmatcher.createFilterspec([
+            logmatcher.RecordPredicate(u'A', pid = 100)]))
+        self.assertEqual(u'--pid=100 A:V *:S', logmatcher.createFilterspec([
+            logmatcher.RecordPredicate(u'A', pid = 100)], True))
+        self.assertEqual(u'A:V *:V', logmatcher.createFilterspec([
+            logmatcher.RecordPredicate(u'A', pid = 100),
+            logmatcher.RecordPredicate()], True))
+
+    def testArgumentOfLogcat(self):
+        u'''
+        LogMatcher appends filterspecs to the argument of logcat.
+        '''
+        arguments = []
+        matcher = MockLogMatcher()
+        matcher.createLogcatThread = \
+            lambda logcatArgument: arguments.append(logcatArgument) or \
+                MockLogcatThread()
+        matcher.start(u'-v time', predicates = [
+            logmatcher.RecordPredicate(u'ActivityManager', u'I')])
+
+        self.assertEqual([u'-v time ActivityManager:I *:S'], arguments)
+
+    def testPidInMarkerStartMode(self):
+        u'''
+        A process ID is not filtered by logcat in markerStartMode, because
+        the marker is written by another process.
+        '''
+        arguments = []
+        matcher = MockLogMatcher()
+        matcher.createLogcatThread = \
+            lambda logcatArgument: arguments.append(logcatArgument) or \
+                MockLogcatThread()
+        predicates = [logmatcher.RecordPredicate(u'A', pid = 100)]
+        matcher.start(u'', predicates = predicates, filtersPid = True)
+        matcher.start(u'', predicates = predicates, filtersPid = True,
+            startMode = logmatcher.markerStartMode)
+
+        self.assertEqual([u' --pid=100 A:V *:S', u' A:V *:S'], arguments)
+        for argument in [u'--pid=100', u'-v brief --pid 100']:
+            self.assertRaises(ValueError, logmatcher.checkStartMode,
+                argument, logmatcher.markerStartMode)
+        logmatcher.checkStartMode(u'--pid=100', logmatcher.clearStartMode)
+
+class TestAhoCorasick(unittest.TestCase):
+    u'''
+    Test AhoCorasick.
+    '''
+
+    def testOverlappedKeywords(self):
+        u'''
+        AhoCorasick finds overlapped keywords across searches.
+        '''
+        automaton = logmatcher.AhoCorasick([u'he', u'she', u'his', u'hers'])
+
+        self.assertEqual([(1, 4), (0, 4)], automaton.search(u'ushe'))
+        self.assertEqual([(3, 2)], automaton.search(u'rs'))
+        self.assertEqual([], automaton.search(u'hi'))
+
+class TestMatchingLines(unittest.TestCase):
+    u'''
+    Test matching lines that are received at once.
+    '''
+
+    def testMatchedLines(self):
+        u'''
+        LogMatcher matches lines that are received at once.
+        '''
+        matcher = MockLogMatcher()
+        matcher.start()
+        matcher.onLogsReceived(['first\n', 'second\n'])
+
+        self.assertEqual(u'first\nsecond\n', matcher.getLog())
+        self.assert_(matcher.wait(u'st\nsec', 0.1))
+
+    def testMatchedLinesWhileWaiting(self):
+        u'''
+        Persistent LogMatcher moves the checkpoint to the matched line in
+        lines that are received at once.
+        '''
+        def sendLog(logMatcher):
+            logMatcher.onLogsReceived(['first\n', 'second\n', 'first\n'])
+
+        matcher = MockLogMatcher()
+        matcher.start(persistent = True)
+        threading.Timer(0.5, sendLog, [matcher]).start()
+
+        self.assert_(matcher.wait(u'first', 2))
+        self.assert_(matcher.wait(u'second', 0.1))
+        self.assert_(matcher.wait(u'first', 0.1))
+
+    def testReadLineBatches(self):
+        u'''
+        readLineBatches splits blocks into lines.
+        '''
+        reading, writing = os.pipe()
+        os.write(writing, 'first\nsec')
+        os.write(writing, 'ond\nthird')
+        os.close(writing)
+
+        logcat = os.fdopen(reading, 'rb')
+        try:
+            self.assertEqual(['first\n', 'second\n', 'third'], sum(
+                logmatcher.readLineBatches(logcat, 4), []))
+        finally:
+            logcat.close()
+
+    def testReadLineBatchesFromSocket(self):
+        u'''
+        readLineBatches reads blocks from a socket.
+        '''
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            server.bind(('127.0.0.1', 0))
+            server.listen(1)
+            writing = socket.create_connection(server.getsockname())
+            reading = server.accept()[0]
+        finally:
+            server.close()
+
+        try:
+            writing.sendall('first\nsec')
+            writing.sendall('ond\nthird')
+            writing.close()
+            self.assertEqual(['first\n', 'second\n', 'third'], sum(
+                logmatcher.readLineBatches(reading, 4), []))
+        finally:
+            reading.close()
+
+class TestMatchingLatency(unittest.TestCase):
+    u'''
+    Test matching lines at once within the matching latency.
+    '''
+
+    def testMatchedAfterLatency(self):
+        u'''
+        Pending lines are matched when they wait for the latency.
+        '''
+        def sendLog(logMatcher):
+            logMatcher.onLogsReceived(['first\n', 'second\n'])
+
+        matcher = MockLogMatcher()
+        matcher.start(persistent = True, matchingLatency = 0.2)
+        threading.Timer(0.2, sendLog, [matcher]).start()
+
+        self.assert_(matcher.wait(u'first', 2))
+        self.assert_(matcher.wait(u'second', 0.1))
+
+    def testMatchedAtTimeout(self):
+        u'''
+        Pending lines are matched before waiting times out.
+        '''
+        def sendLog(logMatcher):
+            logMatcher.onLogReceived('matched\n')
+
+        matcher = MockLogMatcher()
+        matcher.start(matchingLatency = 10)
+        threading.Timer(0.2, sendLog, [matcher]).start()
+
+        self.assert_(matcher.wait(u'matched', 0.5))
+
+    def testBatchSize(self):
+        u'''
+        Lines are matched at once when they arrive quickly.
+        '''
+        def sendLog(logMatcher):
+            for count in xrange(100):
+                logMatcher.onLogsReceived(['line\n'] * 10)
+                time.sleep(0.001)
+            logMatcher.onLogReceived('matched\n')
+
+        matcher = MockLogMatcher()
+        matcher.start(matchingLatency = 0.1)
+        threading.Timer(0.2, sendLog, [matcher]).start()
+
+        self.assert_(matcher.wait(u'matched', 2))
+
+        statistics = matcher.getBatchStatistics()
+        self.assertEqual(1001, statistics['evaluatedLineCount'])
+        self.assert_(1 < statistics['batchSize'])
+        self.assert_(10 < statistics['maximumBatchSize'])
+        self.assert_(
+            statistics['evaluationCount'] < statistics['evaluatedLineCount'])
+
+    def testMatchedWithinLatencyAfterBatches(self):
+        u'''
+        Lines that arrive after waiting starts are matched within
+        the latency, although they are fewer than the batch size.
+        '''
+        def sendLog(logMatcher):
+            # The second batch raises the batch size by the arrival rate.
+            logMatcher.onLogsReceived(['line\n'] * 10)
+            logMatcher.onLogsReceived(['line\n'] * 10)
+            logMatcher.onLogReceived('matched\n')
+
+        for waitsAsync in (False, True):
+            matcher = MockLogMatcher()
+            matcher.start(persistent = True, matchingLatency = 0.5)
+            try:
+                startTime = time.time()
+                if waitsAsync:
+                    handle = matcher.waitAsync(u'matched', 10)
+                    sendLog(matcher)
+                    self.assert_(handle.wait(10))
+                else:
+                    threading.Timer(0.2, sendLog, [matcher]).start()
+                    self.assert_(matcher.wait(u'matched', 10))
+                self.assert_(time.time() - startTime < 5)
+            finally:
+                matcher.stop()
+
+class TestStatistics(unittest.TestCase):
+    u'''
+    Test statistics of reading and matching log.
+    '''
+
+    def setUp(self):
+        self.__matcher = MockLogMatcher()
+        self.__path = os.path.join(tempfile.mkdtemp(), 'statistics.json')
+        self.__matcher.start(persistent = True, statisticsPath = self.__path)
+
+    def testCounters(self):
+        u'''
+        Received lines and matched lines are counted.
+        '''
+        results = []
+        thread = threading.Thread(target = lambda: results.append(
+            self.__matcher.wait(u'beta', 2)))
+        thread.start()
+        time.sleep(0.2)
+
+        self.__matcher.onLogsReceived(['alpha\n', 'beta\n'])
+        thread.join()
+
+        statistics = self.__matcher.stats()
+        self.assert_(results[0])
+        self.assertEqual(2, statistics['receivedLineCount'])
+        self.assertEqual(11, statistics['receivedByteCount'])
+        self.assertEqual(1, statistics['matchedCount'])
+        self.assertEqual(1, sum([count for bound, count
+            in statistics['latencyHistogram']]))
+        self.assertEqual(0, statistics['waiterCount'])
+        self.assert_('batchSize' in statistics)
+
+    def testStatisticsFile(self):
+        u'''
+        Statistics are appended to the file at the end of each waiting.
+        '''
+        self.__matcher.onLogReceived('alpha\n')
+        self.assert_(self.__matcher.wait(u'alpha', 0.1))
+        self.assert_(not self.__matcher.wait(u'beta', 0.1))
+
+        statisticsFile = open(self.__path)
+        try:
+            records = [json.loads(line) for line in statisticsFile]
+        finally:
+            statisticsFile.close()
+        self.assertEqual([True, False],
+            [record['matched'] for record in records])
+        self.assertEqual(1, records[1]['statistics']['receivedLineCount'])
+
+    def testJsonWithoutJsonModule(self):
+        u'''
+        Values are converted to JSON without json module.
+        '''
+        value = {'lines' : [1, 2.5, None, True], u'log' : u'日本語"\n'}
+        jsonModule = logmatcher.json
+        logmatcher.json = None
+        try:
+            self.assertEqual(value, json.loads(logmatcher.dumpJson(value)))
+        finally:
+            logmatcher.json = jsonModule
+
+class TestStageTracer(unittest.TestCase):
+    u'''
+    Test profiling stages of reading and matching log.
+    '''
+
+    def setUp(self):
+        self.__path = os.path.join(tempfile.mkdtemp(), 'profile.json')
+
+    def __waitWithTracer(self, tracer):
+        u'''
+        Wait for a line with a session that is given the tracer.
+        '''
+        matcher = MockLogMatcher()
+        matcher.start(persistent = True, profiler = tracer)
+        results = []
+        thread = threading.Thread(
+            target = lambda: results.append(matcher.wait(u'beta', 2)))
+        thread.start()
+        time.sleep(0.2)
+
+        matcher.onLogsReceived(['alpha\n', 'beta\n'])
+        thread.join()
+        matcher.stop()
+        self.assert_(results[0])
+
+    def testTimings(self):
+        u'''
+        Timings of stages are written to the profile file.
+        '''
+        tracer = logmatcher.StageTracer(self.__path)
+        self.__waitWithTracer(tracer)
+
+        profileFile = open(self.__path)
+        try:
+            timings = json.load(profileFile)
+        finally:
+            profileFile.close()
+        self.assertEqual(1, timings[logmatcher.decodingStage]['count'])
+        self.assertEqual(1, timings[logmatcher.matchingStage]['sampledCount'])
+        self.assertEqual(timings, tracer.getTimings())
+
+    def testProfilingMatching(self):
+        u'''
+        cProfile profiles matching only.
+        '''
+        self.__waitWithTracer(
+            logmatcher.StageTracer(self.__path, profilesMatching = True))
+
+        functions = [function for fileName, line, function
+            in pstats.Stats(self.__path + '.prof').stats]
+        self.assert_('__feedWaiters' in functions)
+        self.assert_('onLogsReceived' not in functions)
+
+    def testSampling(self):
+        u'''
+        Stages are timed once in the sampling interval.
+        '''
+        tracer = logmatcher.StageTracer(sampleInterval = 2)
+        for index in range(3):
+            tracer.end(logmatcher.readingStage,
+                tracer.begin(logmatcher.readingStage))
+
+        timing = tracer.getTimings()[logmatcher.readingStage]
+        self.assertEqual(3, timing['count'])
+        self.assertEqual(2, timing['sampledCount'])
+
+class PipeProcess:
+    u'''
+    LogcatProcess that outputs what is written to a pipe.
+    '''
+
+    def __init__(self):
+        reading, self.writing = os.pipe()
+        self.output = os.fdopen(reading, 'rb')
+        self.isKilled = False
+
+    def getOutput(self):
+        return self.output
+
+    def filterLines(self, lines):
+        return lines
+
+    def kill(self):
+        self.isKilled = True
+
+class LineCollector:
+    u'''
+    Listener for log that collects lines.
+    '''
+
+    def __init__(self):
+        self.lines = []
+
+    def onLogsReceived(self, lines):
+        self.lines.extend(lines)
+
+class TestLogcatMultiplexer(unittest.TestCase):
+    u'''
+    Test reading logcat of many devices in a single thread.
+    '''
+
+    def setUp(self):
+        self.__multiplexer = logmatcher.LogcatMultiplexer(4)
+
+    def __waitUntilNoStream(self):
+        u'''
+        Wait until the multiplexer reads no process.
+        '''
+        deadline = time.time() + 2
+        while self.__multiplexer.getStreamCount() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(0, self.__multiplexer.getStreamCount())
+
+    def testReadingProcesses(self):
+        u'''
+        Lines of each process are noticed to its listener.
+        '''
+        first = PipeProcess()
+        second = PipeProcess()
+        firstCollector = LineCollector()
+        secondCollector = LineCollector()
+        self.__multiplexer.add(first, firstCollector)
+        self.__multiplexer.add(second, secondCollector)
+
+        os.write(first.writing, 'first\nsec')
+        os.write(second.writing, 'alpha\n')
+        os.write(first.writing, 'ond\nthird')
+        os.close(first.writing)
+        os.close(second.writing)
+        self.__waitUntilNoStream()
+
+        self.assertEqual(
+            ['first\n', 'second\n', 'third'], firstCollector.lines)
+        self.assertEqual(['alpha\n'], secondCollector.lines)
+
+    def testRemove(self):
+        u'''
+        A removed process is killed and not read.
+        '''
+        process = PipeProcess()
+        collector = LineCollector()
+        self.__multiplexer.add(process, collector)
+        self.__multiplexer.remove(process)
+        self.__waitUntilNoStream()
+
+        os.write(process.writing, 'first\n')
+        os.close(process.writing)
+        time.sleep(0.1)
+
+        self.assert_(process.isKilled)
+        self.assertEqual([], collector.lines)
+
+    def testAdbCommand(self):
+        u'''
+        adb commands have the serial number of the device.
+        '''
+        self.assertEqual(u'adb -s emulator-5554 logcat',
+            logmatcher.createAdbCommand(u'emulator-5554', u'logcat'))
+        self.assertEqual(
+            u'adb logcat', logmatcher.createAdbCommand(None, u'logcat'))
+
+class FakeAdbServer:
+    u'''
+    Server that speaks the protocol of the adb server for a device.
+
+    logcat outputs the lines that are given, and keeps the connection
+    until the client closes it.
+    '''
+
+    def __init__(self, serial, lines):
+        self.serial = serial
+        self.lines = lines
+        self.services = []
+        self.connectionCount = 0
+        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__server.bind(('127.0.0.1', 0))
+        self.__server.listen(16)
+        self.port = self.__server.getsockname()[1]
+
+        thread = threading.Thread(target = self.__accept)
+        thread.setDaemon(True)
+        thread.start()
+
+    def close(self):
+        self.__server.close()
+
+    def __accept(self):
+        while True:
+            try:
+                connection = self.__server.accept()[0]
+            except socket.error:
+                return
+            self.connectionCount += 1
+            thread = threading.Thread(
+                target = self.__serve, args = (connection,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def __serve(self, connection):
+        try:
+            transport = self.__receive(connection)
+            if transport not in ('host:transport-any',
+                    'host:transport:' + self.serial):
+                message = "device '%s' not found" % transport.split(':')[-1]
+                connection.sendall('FAIL%04x%s' % (len(message), message))
+                return
+            connection.sendall('OKAY')
+
+            service = self.__receive(connection)
+            self.services.append(service)
+            connection.sendall('OKAY')
+            if service.startswith('shell:logcat') and \
+                    not service.startswith('shell:logcat -c'):
+                connection.sendall(''.join(self.lines))
+                connection.recv(1)
+        finally:
+            connection.close()
+
+    def __receive(self, connection):
+        length = int(logmatcher.readExactly(connection, 4), 16)
+        return logmatcher.readExactly(connection, length)
+
+class TestAdbClient(unittest.TestCase):
+    u'''
+    Test requesting logcat to the adb server directly.
+    '''
+
+    def setUp(self):
+        self.__server = FakeAdbServer('emulator-5554', ['alpha\n', 'beta\n'])
+        self.__client = logmatcher.AdbClient(port = self.__server.port)
+
+    def tearDown(self):
+        self.__client.close()
+        self.__server.close()
+
+    def testWaiting(self):
+        u'''
+        logcat is cleared and read through the adb server.
+        '''
+        matcher = logmatcher.LogMatcher()
+        matcher.start(u'-v brief', persistent = True, queueSize = None,
+            serial = u'emulator-5554', adbClient = self.__client)
+        try:
+            self.assert_(matcher.wait(u'beta', 2))
+        finally:
+            matcher.stop()
+
+        self.assertEqual(['shell:logcat -c -v brief', 'shell:logcat -v brief'],
+            self.__server.services)
+
+    def testUnknownDevice(self):
+        u'''
+        IOError is raised when the adb server refuses the device.
+        '''
+        self.assertRaises(IOError, self.__client.runService,
+            u'unknown', u'shell:logcat -c')
+
+    def testPool(self):
+        u'''
+        Services use the connections that are opened ahead.
+        '''
+        self.__client.prepare(2)
+        self.__client.runService(None, u'shell:logcat -c')
+        self.__client.runService(u'emulator-5554', u'shell:logcat -c')
+        self.assertEqual(2, self.__server.connectionCount)
+
+        self.__client.runService(None, u'shell:logcat -c')
+        self.assertEqual(3, self.__server.connectionCount)
+
+class SlowLogMatcher(logmatcher.LogMatcher):
+    u'''
+    LogMatcher that takes time to receive lines.
+    '''
+
+    def __init__(self, delay):
+        self.receivingEvent = threading.Event()
+        self.__delay = delay
+
+    def onLogsReceived(self, lines):
+        self.receivingEvent.set()
+        time.sleep(self.__delay)
+        logmatcher.LogMatcher.onLogsReceived(self, lines)
+
+class TestFakeAdb(unittest.TestCase):
+    u'''
+    Test LogcatThread end to end with the fake adb in tools/fake-adb.
+    '''
+
+    def setUp(self):
+        self.__environment = dict(os.environ)
+        os.environ['PATH'] = os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), os.pardir, os.pardir, 'tools',
+            'fake-adb') + os.pathsep + os.environ.get('PATH', '')
+        os.environ['FAKE_ADB_STATE'] = tempfile.mkdtemp()
+        os.environ['FAKE_ADB_RATE'] = '1000'
+        self.__matcher = logmatcher.LogMatcher()
+
+    def tearDown(self):
+        self.__matcher.stop()
+        os.environ.clear()
+        os.environ.update(self.__environment)
+
+    def testClearStartMode(self):
+        u'''
+        Log before clearing is not received, and Japanese lines are decoded.
+        '''
+        self.__matcher.start(u'-v brief', persistent = True,
+            queueSize = None)
+        self.assert_(self.__matcher.wait(u'日本語のログ', 5))
+        self.assert_(not self.__matcher.searchLog(u'history'))
+
+    def testMarkerStartMode(self):
+        u'''
+        Log before the marker is skipped.
+        '''
+        self.__matcher.start(u'-s AndroidLogMatcher:I', persistent = True,
+            startMode = logmatcher.markerStartMode, queueSize = None)
+        self.assert_(self.__matcher.waitPattern(ur'AndroidLogMatcher: \S+ ', 5))
+        self.assert_(not self.__matcher.searchLog(u'history|Marker'))
+
+    def testPidInMarkerStartMode(self):
+        u'''
+        Lines of a process ID are found after the marker that is written by
+        another process.
+        '''
+        self.__matcher.start(u'', persistent = True,
+            startMode = logmatcher.markerStartMode, queueSize = None,
+            predicates = [logmatcher.RecordPredicate(
+                tag = u'ActivityManager', pid = 1000)], filtersPid = True)
+        record = self.__matcher.waitRecord(u'ActivityManager', pid = 1000,
+            timeout = 5)
+        self.assert_(record)
+        self.assertEqual(1000, record.pid)
+
+    def testQueuedLinesAtTimeout(self):
+        u'''
+        Lines that are queued before timeout are matched before waiting
+        times out.
+        '''
+        self.__matcher = SlowLogMatcher(0.5)
+        self.__matcher.start(u'-v brief', persistent = True,
+            queueSize = logmatcher.defaultQueueSize)
+        self.assert_(self.__matcher.receivingEvent.wait(5) is not False)
+
+        self.assert_(self.__matcher.waitPattern(ur'\S', 0.1))
+        self.assert_(self.__matcher.waitPatternAsync(ur'\S', 0).wait(5))
+
+    def testTimeStartMode(self):
+        u'''
+        logcat starts from the time of the device.
+        '''
+        self.__matcher.start(u'-v brief', persistent = True,
+            startMode = logmatcher.timeStartMode, queueSize = None)
+        self.assert_(self.__matcher.wait(u'日本語のログ', 5))
+        self.assert_(not self.__matcher.searchLog(u'history'))
+
+    def testAssertLevel(self):
+        u'''
+        Lines of the assert level are output, and "*:A" filters lines like
+        "*:F".
+        '''
+        path = os.path.join(os.environ['FAKE_ADB_STATE'], 'recorded.txt')
+        recordedFile = open(path, 'wb')
+        try:
+            recordedFile.write(u'E/Test( 1000): error line\n'
+                u'F/Test( 1000): fatal line\n'
+                u'A/Test( 1000): assert line\n'.encode('utf-8'))
+        finally:
+            recordedFile.close()
+        os.environ['FAKE_ADB_LOG'] = path
+        self.__matcher.start(u'-v brief *:A', persistent = True,
+            queueSize = None)
+        self.assert_(self.__matcher.wait(u'assert line', 5))
+        self.assert_(self.__matcher.wait(u'fatal line', 5))
+        self.assert_(not self.__matcher.searchLog(u'error line'))
+
+class TestStartMode(unittest.TestCase):
+    u'''
+    Test checking arguments of start modes.
+    '''
+
+    def testStartTime(self):
+        u'''
+        The start time has milliseconds if date of the device supports them.
+        '''
+        self.assertEqual(u'10-18 12:00:01.123',
+            logmatcher.createStartTime('10-18 12:00:01.123456789\r\n'))
+        self.assertEqual(u'10-18 12:00:01.000',
+            logmatcher.createStartTime('10-18 12:00:01.N\n'))
+        self.assertRaises(IOError, logmatcher.createStartTime, 'date: error')
+
+    def testMarkerBuffer(self):
+        u'''
+        markerStartMode is refused when the main buffer is not read.
+        '''
+        for argument in [u'', u'-v brief', u'-b main', u'-b radio -b main',
+                u'--buffer=events,main', u'-ball', u'-b default']:
+            self.assert_(logmatcher.readsMarkerBuffer(argument), argument)
+        for argument in [u'-b radio', u'-b events,crash', u'--buffer=system']:
+            self.assert_(not logmatcher.readsMarkerBuffer(argument), argument)
+
+        self.assertRaises(ValueError, logmatcher.LogcatProcess,
+            u'-b radio', logmatcher.markerStartMode)
+        self.assertRaises(ValueError, logmatcher.AdbLogcatProcess,
+            None, u'-b events', logmatcher.markerStartMode)
+
+    def testGlobalStartError(self):
+        u'''
+        logmatcher.start raises the error of starting, and the global
+        LogMatcher can be started again.
+        '''
+        self.assertRaises(
+            ValueError, logmatcher.start, startMode = u'unknown')
+        self.assert_(logmatcher.currentLogcatMatcher is None)
+
+class TestFakeAdbDevices(unittest.TestCase):
+    u'''
+    Test startDevices end to end with the fake adb in tools/fake-adb.
+    '''
+
+    def setUp(self):
+        self.__environment = dict(os.environ)
+        os.environ['PATH'] = os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), os.pardir, os.pardir, 'tools',
+            'fake-adb') + os.pathsep + os.environ.get('PATH', '')
+        os.environ['FAKE_ADB_STATE'] = tempfile.mkdtemp()
+        os.environ['FAKE_ADB_RATE'] = '1000'
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.__environment)
+
+    def testDevicesWithSharedOptions(self):
+        u'''
+        Statistics, the profiler and the index are given to sessions of
+        devices.
+        '''
+        directory = tempfile.mkdtemp()
+        statisticsPath = os.path.join(directory, 'statistics.json')
+        profilePath = os.path.join(directory, 'profile.json')
+        tracer = logmatcher.StageTracer(profilePath)
+        serials = [u'emulator-5554', u'emulator-5556']
+
+        sessions = logmatcher.startDevices(serials, u'-v brief',
+            statisticsPath = statisticsPath, profiler = tracer,
+            indexesLog = True)
+        try:
+            for serial in serials:
+                self.assert_(sessions[serial].wait(u'日本語のログ', 5))
+                self.assert_(sessions[serial].findLogLines(u'日本語のログ'))
+        finally:
+            for session in sessions.values():
+                session.stop()
+
+        statisticsFile = open(statisticsPath)
+        try:
+            records = [json.loads(line) for line in statisticsFile]
+        finally:
+            statisticsFile.close()
+        self.assertEqual(serials,
+            sorted([record['serial'] for record in records]))
+        self.assert_(tracer.getTimings()[logmatcher.matchingStage]['count'])
+        self.assert_(os.path.exists(profilePath))
+
+class TestLogQueue(unittest.TestCase):
+    u'''
+    Test LogQueue.
+    '''
+
+    def testGet(self):
+        u'''
+        LogQueue returns all queued lines at once.
+        '''
+        queue = logmatcher.LogQueue(10)
+        queue.onLogReceived('first\n')
+        queue.onLogsReceived(['second\n', 'third\n'])
+
+        self.assertEqual(3, queue.getDepth())
+        self.assertEqual(['first\n', 'second\n', 'third\n'], queue.get())
+        self.assertEqual(0, queue.getDepth())
+        self.assertEqual(3, queue.getMaximumDepth())
+
+    def testBlockPolicy(self):
+        u'''
+        LogQueue blocks putting until lines are taken.
+        '''
+        queue = logmatcher.LogQueue(2)
+        queue.put(['first\n', 'second\n'])
+        threading.Timer(0.5, queue.get).start()
+
+        startTime = time.time()
+        queue.put(['third\n'])
+
+        self.assert_(0.4 < time.time() - startTime)
+        self.assertEqual(['third\n'], queue.get())
+        self.assertEqual(0, queue.getDroppedLineCount())
+
+    def testDropOldestPolicy(self):
+        u'''
+        LogQueue drops the oldest lines.
+        '''
+        queue = logmatcher.LogQueue(2, logmatcher.dropOldestPolicy)
+        queue.put(['first\n'])
+        queue.put(['second\n'])
+        queue.put(['third\n', 'fourth\n', 'fifth\n'])
+
+        self.assertEqual(['fourth\n', 'fifth\n'], queue.get())
+        self.assertEqual(3, queue.getDroppedLineCount())
+
+    def testDropNewestPolicy(self):
+        u'''
+        LogQueue drops received lines and counts them.
+        '''
+        queue = logmatcher.LogQueue(2, logmatcher.dropNewestPolicy)
+        queue.put(['first\n'])
+        queue.put(['second\n', 'third\n'])
+
+        self.assertEqual(['first\n', 'second\n'], queue.get())
+        self.assertEqual(1, queue.getDroppedLineCount())
+
+    def testClose(self):
+        u'''
+        LogQueue returns None after it is closed.
+        '''
+        queue = logmatcher.LogQueue(10)
+        queue.put(['first\n'])
+        threading.Timer(0.1, queue.close).start()
+
+        self.assertEqual(['first\n'], queue.get())
+        self.assert_(queue.get() is None)
+
+    def testFinishedLines(self):
+        u'''
+        LogQueue counts lines that are finished by the listener or dropped.
+        '''
+        queue = logmatcher.LogQueue(2, logmatcher.dropOldestPolicy)
+        queue.put(['first\n'])
+        queue.put(['second\n', 'third\n'])
+        self.assertEqual(3, queue.getPutLineCount())
+        self.assert_(queue.isFinished(1))
+        self.assert_(not queue.waitFinished(3, 0.1))
+
+        lines = queue.get()
+        threading.Timer(0.2, queue.finish, [len(lines)]).start()
+        self.assert_(queue.waitFinished(3, 2))
+
+    def testMatchingThread(self):
+        u'''
+        MatchingThread notices lines in the queue to the listener.
+        '''
+        matcher = MockLogMatcher()
+        matcher.start()
+        queue = logmatcher.LogQueue(10)
+        logmatcher.MatchingThread(queue, matcher).start()
+
+        threading.Timer(0.5, queue.put, [['first\n', 'second\n']]).start()
+
+        self.assert_(matcher.wait(u'second', 2))
+        queue.close()
+
+class TestMatchingBytes(unittest.TestCase):
+    u'''
+    Test matching log without decoding.
+    '''
+
+    def setUp(self):
+        self.__matcher = MockLogMatcher()
+        self.__matcher.start(matchesBytes = True)
+
+    def testMatchedJapaneseString(self):
+        u'''
+        LogMatcher matches Japanese string that spans lines.
+        '''
+        self.__matcher.onLogReceived(u'\u65e5\u672c'.encode('utf8'))
+        self.__matcher.onLogReceived(u'\u8a9e\u306e\u30ed\u30b0\n'.encode('utf8'))
+
+        self.assert_(self.__matcher.wait(u'\u65e5\u672c\u8a9e\u306e', 0.1))
+
+    def testMatchedJapanesePattern(self):
+        u'''
+        LogMatcher matches Japanese pattern and returns decoded Match object.
+        '''
+        self.__matcher.onLogReceived('first\n')
+        self.__matcher.onLogReceived(
+            u'\u65e5\u672c\u8a9e\u306e\u30ed\u30b0\n'.encode('utf8'))
+
+        self.assertEqual(u'\u306e', self.__matcher.waitPattern(
+            u'\u65e5\u672c\u8a9e(.)\u30ed\u30b0', 0.1).group(1))
+
+    def testMatchedPatternWithoutLiteral(self):
+        u'''
+        LogMatcher matches pattern that has no literal.
+        '''
+        self.__matcher.onLogReceived(u'\u65e5123\n'.encode('utf8'))
+
+        self.assertEqual(u'123',
+            self.__matcher.waitPattern(ur'\d+', 0.1).group(0))
+        self.assertEqual(u'\u65e5123\n', self.__matcher.getLog())
+
+    def testRequiredLiterals(self):
+        u'''
+        Required literals are found from patterns.
+        '''
+        self.assertEqual([u'ab', u'c', u'e'],
+            logmatcher.findRequiredLiterals(
+                re.compile(ur'ab(c|d)?(c)[a-z]+e*e+')))
+        self.assertEqual([], logmatcher.findRequiredLiterals(
+            re.compile(ur'abc', re.IGNORECASE)))
+
+class TestPersistentLogMatcher(unittest.TestCase):
+    u'''
+    Test LogMatcher that keeps watching logcat across waits.
+    '''
+
+    def setUp(self):
+        self.__matcher = MockLogMatcher()
+        self.__matcher.start(persistent = True)
+
+    def testSequentialWaits(self):
+        u'''
+        Each wait matches lines after the previous matched line.
+        '''
+        self.__matcher.onLogReceived('first\n')
+        self.__matcher.onLogReceived('second\n')
+        self.__matcher.onLogReceived('first\n')
+
+        self.assert_(self.__matcher.wait(u'first', 0.1))
+        self.assert_(self.__matcher.wait(u'second', 0.1))
+        self.assert_(self.__matcher.wait(u'first', 0.1))
+        self.assert_(not self.__matcher.wait(u'first', 0.1))
+        self.assert_(not self.__matcher.wait(u'second', 0.1))
+
+    def testMark(self):
+        u'''
+        Waiting after mark does not match lines before mark.
+        '''
+        self.__matcher.onLogReceived('first\n')
+        self.assertEqual(1, self.__matcher.mark())
+        self.__matcher.onLogReceived('second\n')
+
+        self.assertEqual(u'second',
+            self.__matcher.waitPattern(ur'first|second', 0.1).group(0))
+
+    def testNotTerminated(self):
+        u'''
+        Waiting does not terminate logcat until stop is called.
+        '''
+        thread = self.__matcher.createLogcatThread(u'')
+        self.__matcher.createLogcatThread = lambda logcatArgument: thread
+        self.__matcher.start(persistent = True)
+
+        self.__matcher.onLogReceived('matched\n')
+        self.assert_(self.__matcher.wait(u'match', 0.1))
+        self.assert_(not thread.isTerminated)
+
+        self.__matcher.stop()
+        self.assert_(thread.isTerminated)
+
+    def testReceivingWhileMatching(self):
+        u'''
+        Receiving lines does not wait for the running matcher.
+        '''
+        class BlockingMatcher:
+            def __init__(self):
+                self.isFeeding = threading.Event()
+                self.isReleased = threading.Event()
+
+            def feed(self, log):
+                if u'first' in log:
+                    self.isFeeding.set()
+                    self.isReleased.wait(2)
+                return u'second' in log
+
+        self.__matcher.onLogReceived('first\n')
+
+        blockingMatcher = BlockingMatcher()
+        results = []
+        thread = threading.Thread(target = lambda: results.append(
+            self.__matcher.waitMatcher(blockingMatcher, 2)))
+        thread.start()
+        try:
+            blockingMatcher.isFeeding.wait(2)
+            self.__matcher.onLogReceived('second\n')
+
+            self.assert_(not self.__matcher.checkMatched())
+            self.assertEqual(u'first\nsecond\n', self.__matcher.getLog())
+        finally:
+            blockingMatcher.isReleased.set()
+            thread.join()
+        self.assertEqual([True], results)
+
+class TestConcurrentWaiters(unittest.TestCase):
+    u'''
+    Test many threads that wait at the same time.
+    '''
+
+    def setUp(self):
+        self.__matcher = MockLogMatcher()
+        self.__matcher.start(persistent = True)
+        self.__results = {}
+
+    def __startWaiting(self, name, wait, *arguments):
+        u'''
+        Start a thread that waits and stores the result.
+        '''
+        def waitLog():
+            self.__results[name] = wait(*arguments)
+
+        thread = threading.Thread(target = waitLog)
+        thread.start()
+        return thread
+
+    def testWaitingTogether(self):
+        u'''
+        Each waiting thread receives lines from one logcat.
+        '''
+        threads = [
+            self.__startWaiting('alpha', self.__matcher.wait, u'alpha', 2),
+            self.__startWaiting('beta', self.__matcher.wait, u'beta', 2),
+            self.__startWaiting('gamma',
+                self.__matcher.waitPattern, ur'gam+a', 2),
+            self.__startWaiting('delta', self.__matcher.wait, u'delta', 0.5)]
+        time.sleep(0.2)
+
+        self.__matcher.onLogsReceived(['beta\n', 'gammma\n'])
+        self.__matcher.onLogReceived('al')
+        self.__matcher.onLogReceived('pha\n')
+        for thread in threads:
+            thread.join()
+
+        self.assert_(self.__results['alpha'])
+        self.assert_(self.__results['beta'])
+        self.assertEqual(u'gammma', self.__results['gamma'].group(0))
+        self.assert_(not self.__results['delta'])
+
+    def testStringAfterCheckpoint(self):
+        u'''
+        The shared index does not find a string that begins before
+        the checkpoint.
+        '''
+        thread = self.__startWaiting('beta', self.__matcher.wait, u'beta', 2)
+        time.sleep(0.2)
+
+        self.__matcher.onLogReceived('al')
+        self.__matcher.mark()
+        alphaThread = self.__startWaiting(
+            'alpha', self.__matcher.wait, u'alpha', 0.5)
+        time.sleep(0.2)
+
+        self.__matcher.onLogReceived('pha\n')
+        self.__matcher.onLogReceived('beta\n')
+        thread.join()
+        alphaThread.join()
+
+        self.assert_(self.__results['beta'])
+        self.assert_(not self.__results['alpha'])
+
+class TestAsyncWaiting(unittest.TestCase):
+    u'''
+    Test waiting that does not block called thread.
+    '''
+
+    def setUp(self):
+        self.__matcher = MockLogMatcher()
+        self.__matcher.start(persistent = True)
+
+    def testMatched(self):
+        u'''
+        The handle and the callback receive the result when log matches.
+        '''
+        results = []
+        handle = self.__matcher.waitPatternAsync(
+            ur'gam+a', 2, results.append)
+        self.assert_(not handle.isDone())
+
+        self.__matcher.onLogsReceived(['alpha\n', 'gammma\n'])
+        self.assert_(handle.isDone())
+        self.assertEqual(u'gammma', handle.wait().group(0))
+        self.assertEqual([handle.getResult()], results)
+
+    def testAlreadyMatched(self):
+        u'''
+        Log that has already been received matches immediately.
+        '''
+        self.__matcher.onLogReceived('alpha\n')
+        handle = self.__matcher.waitAsync(u'alpha', 2)
+        self.assert_(handle.isDone())
+        self.assert_(handle.getResult())
+
+    def testTimeout(self):
+        u'''
+        The timer finishes the waiting at timeout.
+        '''
+        handles = [self.__matcher.waitAsync(u'beta', 0.2) for i in range(100)]
+        self.__matcher.onLogReceived('alpha\n')
+        for handle in handles:
+            self.assert_(not handle.wait(2))
+            self.assert_(handle.isDone())
+
+    def testCancel(self):
+        u'''
+        Cancelled waiting finishes and does not match later log.
+        '''
+        handle = self.__matcher.waitAsync(u'alpha', 2)
+        handle.cancel()
+        self.assert_(handle.isDone())
+        self.__matcher.onLogReceived('alpha\n')
+        self.assert_(not handle.getResult())
+
+    def testAnchorsAcrossBatches(self):
+        u'''
+        Lines that are received at once and one by one give the same result
+        of anchors, before and after waiting begins.
+        '''
+        for pattern, expected in [(ur'^a', None), (ur'(?m)^a', u'a'),
+                (ur'x$', u'x'), (ur'\bab\b', u'ab')]:
+            for persistent in [False, True]:
+                for receivesAtOnce in [False, True]:
+                    for receivesBeforeWaiting in [False, True]:
+                        matcher = MockLogMatcher()
+                        matcher.start(persistent = persistent)
+                        if not receivesBeforeWaiting:
+                            handle = matcher.waitPatternAsync(pattern, 0.1)
+                        if receivesAtOnce:
+                            matcher.onLogsReceived(['x\n', 'ab\n'])
+                        else:
+                            matcher.onLogReceived('x\n')
+                            matcher.onLogReceived('ab\n')
+                        if receivesBeforeWaiting:
+                            handle = matcher.waitPatternAsync(pattern, 0.1)
+                        result = handle.wait(2)
+                        matcher.stop()
+                        self.assertEqual(
+                            expected, result and result.group(0),
+                            (pattern, persistent, receivesAtOnce,
+                                receivesBeforeWaiting))
+
+    def testReadLines(self):
+        u'''
+        Received lines are read from the returned index.
+        '''
+        self.__matcher.onLogsReceived(['alpha\n', 'beta\n'])
+        lines, index = self.__matcher.readLines()
+        self.assertEqual([u'alpha\n', u'beta\n'], lines)
+
+        self.__matcher.onLogReceived('gamma\n')
+        lines, index = self.__matcher.readLines(index)
+        self.assertEqual([u'gamma\n'], lines)
+        self.assertEqual(([], index), self.__matcher.readLines(index))
+
+class RecordingPattern:
+    u'''
+    Compiled pattern that records the length of each searched string.
+    '''
+
+    def __init__(self, pattern):
+        self.__pattern = re.compile(pattern)
+        self.pattern = self.__pattern.pattern
+        self.flags = self.__pattern.flags
+        self.groups = self.__pattern.groups
+        self.searchedLengths = []
+
+    def search(self, string, pos = 0):
+        self.searchedLengths.append(len(string) - pos)
+        return self.__pattern.search(string, pos)
+
+class TestIncrementalMatcher(unittest.TestCase):
+    u'''
+    Test incremental matchers.
+    '''
+
+    def testStringMatcherAcrossFeeding(self):
+        u'''
+        StringMatcher finds the string that spans fed logs.
+        '''
+        matcher = logmatcher.StringMatcher(u'match')
+
+        self.assert_(not matcher.feed(u'xxmat'))
+        self.assert_(matcher.feed(u'chxx'))
+
+    def testPatternMatcherBeyondCarryOver(self):
+        u'''
+        PatternMatcher does not find the pattern longer than carry over.
+        '''
+        matcher = logmatcher.PatternMatcher(re.compile(ur'a\d+b'), 3)
+
+        self.assert_(matcher.feed(u'a1234') is None)
+        self.assert_(matcher.feed(u'b') is None)
+        self.assert_(matcher.feed(u'a12b'))
+
+    def testAnchorInCarryOver(self):
+        u'''
+        Anchors do not match at the head of the carried over log in
+        the middle of a line.
+        '''
+        for matcher in [
+                logmatcher.PatternMatcher(re.compile(ur'(?m)^E/crash\s'), 4),
+                logmatcher.SequenceMatcher(
+                    [re.compile(ur'(?m)^E/crash\s')], 4)]:
+            self.assert_(not matcher.feed(u'I/tag: E/cr'))
+            self.assert_(not matcher.feed(u'ash now\n'))
+            self.assert_(matcher.feed(u'E/crash now\n'))
+
+        matcher = logmatcher.BytesPatternMatcher(
+            re.compile(ur'(?m)^E/crash\s'), [u'E/crash'], 4)
+        self.assert_(not matcher.feed('I/tag: E/cr'))
+        self.assert_(not matcher.feed('ash now\n'))
+        self.assert_(matcher.feed('E/crash now\n'))
+
+    def testAnchorsAcrossFeeding(self):
+        u'''
+        Anchors and boundaries give the same result whether lines are fed
+        at once, line by line or split in the middle.
+        '''
+        lines = [u'x\n', u'ab\n', u'ba b\n']
+        log = u''.join(lines)
+        feedings = [[log], lines, [u'x\na', u'b\nba', u' b\n'], list(log)]
+        expectations = [(ur'^a', None), (ur'\Ax', u'x'), (ur'(?m)^a', u'a'),
+            (ur'x$', u'x'), (ur'(?m)b$', u'b'), (ur'b\Z', None),
+            (ur'a\b', u'a'), (ur'\bb\b', u'b'), (ur'\Bb', u'b'),
+            (ur'(?m)^a\w*$', u'ab'), (ur'a b$', u'a b')]
+
+        def feedAll(matcher, feeding):
+            matcher.feed(feeding[0][:0])
+            for log in feeding:
+                result = matcher.feed(log)
+                if result:
+                    return result
+            return None
+
+        for pattern, expected in expectations:
+            pattern = re.compile(pattern)
+            for feeding in feedings:
+                result = feedAll(logmatcher.PatternMatcher(pattern), feeding)
+                self.assertEqual(expected, result and result.group(0))
+                result = feedAll(logmatcher.MultiMatcher(
+                    [], [pattern, re.compile(u'z')], False), feeding)
+                self.assertEqual(
+                    expected, result and result[0].matchObject.group(0))
+                result = feedAll(
+                    logmatcher.SequenceMatcher([u'', pattern]), feeding)
+                self.assertEqual(
+                    expected, result and result[1].matchObject.group(0))
+
+                literals = logmatcher.findRequiredLiterals(pattern)
+                result = feedAll(
+                    logmatcher.BytesPatternMatcher(pattern, literals),
+                    [log.encode('utf8') for log in feeding])
+                self.assertEqual(expected, result and result.group(0))
+
+    def testCarryOverIncompleteLine(self):
+        u'''
+        Only the incomplete last line is searched again by a pattern that
+        cannot span lines.
+        '''
+        pattern = RecordingPattern(ur'crash (\d+)')
+        matcher = logmatcher.PatternMatcher(pattern)
+        for index in range(100):
+            self.assert_(not matcher.feed(u'I/tag: line %d\n' % index))
+        self.assert_(max(pattern.searchedLengths) <= len(u'I/tag: line 99\n'))
+
+        self.assert_(not matcher.feed(u'E/tag: cra'))
+        self.assertEqual(u'12', matcher.feed(u'sh 12\n').group(1))
+
+    def testMultiMatcherCarryOver(self):
+        u'''
+        MultiMatcher searches only the incomplete last line again with
+        patterns that cannot span lines, and it keeps the window of patterns
+        that can span lines.
+        '''
+        pattern = RecordingPattern(ur'(?i)crash (\d+)')
+        patterns = [re.compile(ur'sig%d (\w+)' % index)
+            for index in range(200)]
+        matcher = logmatcher.MultiMatcher([], patterns + [pattern,
+            re.compile(ur'begin\s+end')], False)
+        for index in range(100):
+            self.assert_(not matcher.feed(u'I/tag: line %d\n' % index))
+        self.assert_(max(pattern.searchedLengths) <= len(u'I/tag: line 99\n'))
+
+        self.assert_(not matcher.feed(u'begin\n'))
+        hits = matcher.feed(u'end CRA')
+        self.assertEqual(
+            [ur'begin\s+end'], [hit.match.pattern for hit in hits])
+        hits = matcher.feed(u'SH 12\n')
+        self.assertEqual(u'12', hits[-1].matchObject.group(1))
+
+    def testMultiMatcherWithManyGroups(self):
+        u'''
+        MultiMatcher combines patterns that have more groups than a pattern
+        can have.
+        '''
+        patterns = [re.compile(ur'crash (\d+) sig%d\b' % index)
+            for index in range(150)]
+        matcher = logmatcher.MultiMatcher([], patterns, False)
+
+        hits = matcher.feed(u'E/tag: crash 12 sig140\n')
+        self.assertEqual([patterns[140]], [hit.match for hit in hits])
+        self.assertEqual(u'12', hits[0].matchObject.group(1))
+
+    def testMultiMatcherWithConditionalReference(self):
+        u'''
+        MultiMatcher does not combine a pattern whose conditional reference
+        would refer to a group of another pattern.
+        '''
+        patterns = [re.compile(ur'(crash) (\d+)'),
+            re.compile(ur'(<)?tag(?(1)>|:)'),
+            re.compile(ur'(<)?name(?P<end>>)?(?(end)!|:)')]
+        matcher = logmatcher.MultiMatcher([], patterns, True)
+
+        self.assert_(not matcher.feed(u'I/<tag>\n'))
+        hits = matcher.feed(u'I/<name>! crash 12\n')
+        self.assertEqual(patterns, [hit.match for hit in hits])
+        self.assertEqual(u'<tag>', hits[1].matchObject.group(0))
+        self.assertEqual(u'<name>!', hits[2].matchObject.group(0))
+
+    def testCanSpanLines(self):
+        u'''
+        Patterns that can match a line break are found.
+        '''
+        for pattern in [ur'a.b', ur'a[^\n]*b', ur'a\S+\d\w', ur'a[b-z]$']:
+            self.assert_(not logmatcher.canSpanLines(re.compile(pattern)),
+                pattern)
+        for pattern in [ur'(?s)a.b', ur'a\sb', ur'a[^x]b', ur'a\nb',
+                ur'(a)\1', ur'a(?:b|\W)', ur'a[\x00-\x20]']:
+            self.assert_(logmatcher.canSpanLines(re.compile(pattern)),
+                pattern)
+
+class TestLogFile(unittest.TestCase):
+    u'''
+    Test matching a saved log file.
+    '''
+
+    def setUp(self):
+        self.__path = os.path.join(tempfile.mkdtemp(), 'logcat.txt')
+        logFile = open(self.__path, 'wb')
+        try:
+            logFile.write(
+                '10-18 12:00:00.000  100  100 I Tag: alpha\n' +
+                'I/Test(  12): 日本語のログ beta\n' +
+                'beta gamma\n' +
+                '10-18 12:00:01.500  100  100 W Tag: alpha alpha')
+        finally:
+            logFile.close()
+        self.__logFile = logmatcher.LogFile(self.__path)
+
+    def tearDown(self):
+        self.__logFile.close()
+
+    def testString(self):
+        u'''
+        Lines that contain a string are found once with line numbers and
+        timestamps.
+        '''
+        hits = self.__logFile.findAll(u'alpha')
+        self.assertEqual([1, 4], [hit.lineNumber for hit in hits])
+        self.assertEqual([u'10-18 12:00:00.000', u'10-18 12:00:01.500'],
+            [hit.timestamp for hit in hits])
+        self.assertEqual(0, hits[0].offset)
+
+    def testJapaneseString(self):
+        u'''
+        Japanese strings are found in the raw log.
+        '''
+        hits = self.__logFile.findAll(u'日本語')
+        self.assertEqual([2], [hit.lineNumber for hit in hits])
+        self.assertEqual(u'I/Test(  12): 日本語のログ beta\n', hits[0].line)
+        self.assertEqual(None, hits[0].timestamp)
+
+    def testPattern(self):
+        u'''
+        Patterns are matched with lines that contain their literals, or
+        all lines if they have no literal.
+        '''
+        hits = self.__logFile.findAllPattern(ur'be+ta \w+')
+        self.assertEqual([3], [hit.lineNumber for hit in hits])
+        self.assertEqual(u'beta gamma', hits[0].matchObject.group(0))
+
+        hits = self.__logFile.findAllPattern(ur'(?i)ALPHA|GAMMA')
+        self.assertEqual([1, 3, 4], [hit.lineNumber for hit in hits])
+
+    def testLiteralAcrossLines(self):
+        u'''
+        Strings and patterns that span lines are not found, because lines
+        are matched one by one.
+        '''
+        self.assertEqual([], self.__logFile.findAll(u'beta\nbeta'))
+        self.assertEqual([], self.__logFile.findAllPattern(ur'beta\nbeta'))
+        hits = self.__logFile.findAll(u'beta\n')
+        self.assertEqual([(2, u'I/Test(  12): \u65e5\u672c\u8a9e\u306e' +
+                u'\u30ed\u30b0 beta\n')],
+            [(hit.lineNumber, hit.line) for hit in hits])
+
+    def testOtherLineSeparators(self):
+        u'''
+        Lines are split only by "\\n" whether the pattern has required
+        literals or not.
+        '''
+        path = self.__path + '.separators'
+        logFile = open(path, 'wb')
+        try:
+            logFile.write('alpha\rbeta\x0cgamma\nbeta\r\n')
+        finally:
+            logFile.close()
+        logFile = logmatcher.LogFile(path)
+        try:
+            for pattern in [ur'beta', ur'(?i)BETA']:
+                hits = logFile.findAllPattern(pattern)
+                self.assertEqual(
+                    [(1, 0, u'alpha\rbeta\x0cgamma\n'), (2, 17, u'beta\r\n')],
+                    [(hit.lineNumber, hit.offset, hit.line) for hit in hits])
+        finally:
+            logFile.close()
+
+    def testEmptyFile(self):
+        u'''
+        Nothing is found in an empty file.
+        '''
+        path = self.__path + '.empty'
+        open(path, 'wb').close()
+        logFile = logmatcher.LogFile(path)
+        try:
+            self.assertEqual([], logFile.findAll(u'alpha'))
+            self.assertEqual([], logFile.findAllPattern(ur'.'))
+        finally:
+            logFile.close()
+
+    def testScanRange(self):
+        u'''
+        Strings and patterns are scanned in a range of lines, and line
+        numbers are counted from the head of the range.
+        '''
+        ranges = self.__logFile.splitLines(40)
+        self.assertEqual(0, ranges[0][0])
+        self.assertEqual(self.__logFile.getSize(), ranges[-1][1])
+        for (begin, end), (nextBegin, nextEnd) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, nextBegin)
+
+        begin = ranges[1][0]
+        hits = self.__logFile.scan([u'alpha'], [ur'gam+a'], begin)
+        self.assertEqual([(2, u'gam+a'), (3, u'alpha')],
+            [(hit.lineNumber, getattr(hit.match, 'pattern', hit.match))
+                for hit in hits])
+        self.assertEqual(2, self.__logFile.countLines(begin))
+
+class TestScanLogFiles(unittest.TestCase):
+    u'''
+    Test scanning log files in parallel.
+    '''
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.__paths = []
+        for index in range(2):
+            path = os.path.join(directory, 'logcat%d.txt' % index)
+            logFile = open(path, 'wb')
+            try:
+                for lineNumber in range(1, 301):
+                    logFile.write('10-18 12:00:00.000  100  100 I Tag: ' +
+                        'line %d of file %d\n' % (lineNumber, index))
+            finally:
+                logFile.close()
+            self.__paths.append(path)
+
+    def __scan(self, processes):
+        hits = logmatcher.scanLogFiles(self.__paths, [u'line 7'],
+            [ur'line (\d+)0 of file 1'], processes, 1000)
+        return [(os.path.basename(hit.path), hit.lineNumber,
+                hit.matchObject and hit.matchObject.group(1))
+            for hit in hits]
+
+    def testSequential(self):
+        u'''
+        Found lines are in order of files, lines, and then strings and
+        patterns.
+        '''
+        hits = self.__scan(1)
+        self.assertEqual(('logcat0.txt', 7, None), hits[0])
+        self.assertEqual(('logcat0.txt', 70, None), hits[1])
+        self.assertEqual(('logcat1.txt', 10, '1'), hits[12])
+        self.assertEqual(('logcat1.txt', 70, None), hits[18])
+        self.assertEqual(('logcat1.txt', 70, '7'), hits[19])
+        self.assertEqual(11 * 2 + 30, len(hits))
+
+    def testParallel(self):
+        u'''
+        Found lines by worker processes are the same as by this process.
+        '''
+        if not logmatcher.multiprocessing:
+            return
+        self.assertEqual(self.__scan(1), self.__scan(2))
+
+    def testDuplicatedMatches(self):
+        u'''
+        Each of duplicated strings and patterns reports its own hits in order
+        of the strings and the patterns.
+        '''
+        pattern = re.compile(ur'line (\d+)5 of file 0')
+        matches = [u'line 7 ', u'line 7', u'line 7 ']
+        hits = logmatcher.scanLogFiles(
+            self.__paths[:1], matches, [pattern, pattern], 1, 1000)
+
+        self.assertEqual([matches[0], matches[1], matches[2]],
+            [hit.match for hit in hits[:3]])
+        self.assertEqual([(15, pattern), (15, pattern)],
+            [(hit.lineNumber, hit.match) for hit in hits[3:5]])
+        self.assertEqual(2 + 11 + 29 * 2, len(hits))
+
+    def testDuplicatedMatchesInRange(self):
+        u'''
+        A worker reports hits of duplicated strings and patterns for each of
+        their indexes.
+        '''
+        pattern = re.compile(ur'line 1 of')
+        foundLines, lineCount = logmatcher.scanLogFileRange(
+            (self.__paths[0], 0, 1000, [u'line 2 ', u'line 2 '],
+                [pattern, pattern]))
+
+        self.assertEqual([(1, 2), (1, 3), (2, 0), (2, 1)],
+            [(foundLine[0], foundLine[4]) for foundLine in foundLines])
+
+class TestLogBuffer(unittest.TestCase):
+    u'''
+    Test LogBuffer.
+    '''
+
+    def setUp(self):
+        self.__buffer = logmatcher.LogBuffer()
+        for line in [u'first\n', u'second\n', u'third\n']:
+            self.__buffer.append(line)
+
+    def testText(self):
+        u'''
+        LogBuffer joins lines.
+        '''
+        self.assertEqual(u'first\nsecond\nthird\n', self.__buffer.getText())
+        self.assertEqual(u'second\n', self.__buffer.getText(1, 2))
+        self.assertEqual(u'first\n', self.__buffer.getText(0, 1))
+
+    def testTextAfterAppending(self):
+        u'''
+        LogBuffer joins lines that are appended after joining.
+        '''
+        self.__buffer.getText()
+        self.__buffer.append(u'fourth\n')
+
+        self.assertEqual(
+            u'first\nsecond\nthird\nfourth\n', self.__buffer.getText())
+        self.assertEqual(4, self.__buffer.getLineCount())
+
+    def testLines(self):
+        u'''
+        LogBuffer slices lines by line range.
+        '''
+        self.assertEqual([u'second\n', u'third\n'], self.__buffer.getLines(1))
+        self.assertEqual(2, self.__buffer.getLineIndex(13))
+
+    def testSnapshot(self):
+        u'''
+        The snapshot is not changed by lines appended later.
+        '''
+        snapshot = self.__buffer.getSnapshot()
+        self.__buffer.append(u'fourth\n')
+
+        self.assertEqual(3, snapshot.getLineCount())
+        self.assertEqual(u'first\nsecond\nthird\n', snapshot.getText())
+        self.assertEqual(
+            u'first\nsecond\nthird\nfourth\n', self.__buffer.getText())
+        self.assertEqual(u'first\nsecond\nthird\n', snapshot.getText())
+
+class TestLogIndex(unittest.TestCase):
+    u'''
+    Test finding lines by the index.
+    '''
+
+    def setUp(self):
+        self.__lines = [
+            '10-18 12:00:00.000  100  101 I ActivityManager: Start proc\n',
+            '10-18 12:00:00.100  200  201 W Camera: open failed\n',
+            u'10-18 12:00:00.200  100  102 I Camera: \u65e5\u672c open\n',
+            'plain line without a record\n']
+
+    def testFindLines(self):
+        u'''
+        Candidate lines are in segments that have all trigrams of literals,
+        and they have the tag and the process ID.
+        '''
+        length = logmatcher.segmentLength
+        index = logmatcher.LogIndex()
+        index.appendLines(self.__lines)
+        index.appendLines(['filler\n'] * (length - len(self.__lines)))
+        index.appendLines(self.__lines[1:2])
+
+        self.assertEqual(None, index.findLines([u'ab']))
+        self.assertEqual(range(length + 1), index.findLines([u'open']))
+        self.assertEqual(range(length), index.findLines([u'Start proc']))
+        self.assertEqual([2], index.findLines([u'open'], u'Camera', 100))
+        self.assertEqual([1, 2, length],
+            index.findLines([u'open'], u'Camera'))
+        self.assertEqual(range(length),
+            index.findLines([u'\u65e5\u672c o']))
+        self.assertEqual([0, 2], index.findLines(pid = 100))
+        self.assertEqual([], index.findLines([u'missing']))
+
+    def testMaximumSize(self):
+        u'''
+        The oldest segments are dropped over the maximum size, and their
+        lines are always candidates.
+        '''
+        length = logmatcher.segmentLength
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        index = logmatcher.LogIndex(maximumSize = 100000)
+        for segment in range(100):
+            index.appendLines(['segment-%03d-line %s\n' % (segment,
+                ''.join([letters[(segment * lineIndex + i * 7) % 26]
+                    for i in range(8)])) for lineIndex in range(length)])
+            self.assert_(index.getSize() <= 100000)
+
+        candidates = index.findLines([u'segment-000-'])
+        self.assertEqual(0, candidates[0])
+        self.assert_(len(candidates) < 100 * length)
+        candidates = index.findLines([u'segment-099-'])
+        self.assertEqual(range(99 * length, 100 * length),
+            candidates[-length:])
+        self.assert_(len(candidates) < 100 * length)
+
+    def testRemoveLines(self):
+        u'''
+        Removed lines are not found.
+        '''
+        index = logmatcher.LogIndex()
+        for count in range(logmatcher.indexPruningLineCount):
+            index.appendLines(self.__lines)
+        index.removeLines(5001)
+
+        self.assertEqual(5001, index.findLines([u'plain'])[0])
+        self.assert_(5003 in index.findLines([u'plain']))
+        self.assertEqual(5002, index.findLines(tag = u'Camera', pid = 100)[0])
+        self.assertEqual(len(self.__lines) * logmatcher.indexPruningLineCount,
+            index.getLineCount())
+
+    def testFindLogLines(self):
+        u'''
+        LogMatcher finds lines with and without the index.
+        '''
+        for indexesLog in (False, True):
+            matcher = MockLogMatcher()
+            matcher.start(indexesLog = indexesLog)
+            try:
+                for line in self.__lines:
+                    if isinstance(line, unicode):
+                        line = line.encode('utf8')
+                    matcher.onLogReceived(line)
+
+                foundLines = matcher.findLogLines(ur'(\w+) failed')
+                self.assertEqual([1], [lineIndex
+                    for lineIndex, line, matchObject in foundLines])
+                self.assertEqual(u'open', foundLines[0][2].group(1))
+
+                foundLines = matcher.findLogLines(
+                    ur'o[a-z]+', tag = u'Camera', pid = 100)
+                self.assertEqual(
+                    [(2, u'open')], [(lineIndex, matchObject.group(0))
+                        for lineIndex, line, matchObject in foundLines])
+                self.assertEqual(
+                    [0, 2], [lineIndex for lineIndex, line, matchObject
+                        in matcher.findLogLines(pid = 100)])
+            finally:
+                matcher.stop()
+
+    def testIndexAgreesWithScan(self):
+        u'''
+        Lines that are found with the index are the same as lines that are
+        found by matching all lines.
+        '''
+        matchers = []
+        for indexesLog in (False, True):
+            matcher = MockLogMatcher()
+            matcher.start(indexesLog = indexesLog)
+            matcher.onLogsReceived(['I/tag(  1): first\r\n',
+                'I/tag(  1): second\n', 'third line', 'I/tag(  2): end\n'])
+            matchers.append(matcher)
+
+        try:
+            for pattern in [ur'st\r\n', ur'nd\n', ur'end\r', ur'ne$',
+                    ur'first\r?\n', ur'\): (\w+)\n', ur'd\nI/t', ur'line']:
+                foundLines = [[(lineIndex, line, matchObject.group(0))
+                        for lineIndex, line, matchObject
+                        in matcher.findLogLines(pattern)]
+                    for matcher in matchers]
+                self.assertEqual(foundLines[0], foundLines[1], pattern)
+            self.assertEqual([0, 1],
+                [lineIndex for lineIndex, line, matchObject
+                    in matchers[1].findLogLines(ur'\w+\r?\n', pid = 1)])
+        finally:
+            for matcher in matchers:
+                matcher.stop()
+
+    def testIndexSizeInMaximumLogSize(self):
+        u'''
+        The index is counted in maximumLogSize, and lines that are not
+        indexed are still found.
+        '''
+        evictedSizes = []
+        for indexesLog in (False, True):
+            matcher = MockLogMatcher()
+            matcher.start(maximumLogSize = 200000, indexesLog = indexesLog)
+            try:
+                matcher.onLogsReceived(['I/Tag(%5d): line %d %x\n' % (
+                    index, index, index * 7919) for index in range(10000)])
+                evictedSizes.append(matcher.getEvictedLogSize())
+
+                foundLines = matcher.findLogLines(u'line 9000 ')
+                self.assertEqual([9000], [lineIndex
+                    for lineIndex, line, matchObject in foundLines])
+            finally:
+                matcher.stop()
+        self.assert_(evictedSizes[0] < evictedSizes[1])
+
+    def testFindEvictedLogLines(self):
+        u'''
+        Evicted lines are not found.
+        '''
+        matcher = MockLogMatcher()
+        matcher.start(maximumLogSize = 100, indexesLog = True)
+        try:
+            for index in range(100):
+                matcher.onLogReceived('line %d\n' % index)
+
+            self.assertEqual([u'line 99\n'], [line
+                for lineIndex, line, matchObject
+                in matcher.findLogLines(u'line 9')][-1:])
+            self.assertEqual([], matcher.findLogLines(u'line 1\n'))
+        finally:
+            matcher.stop()
+
+class TestBoundedLogBuffer(unittest.TestCase):
+    u'''
+    Test LogBuffer with the maximum size.
+    '''
+
+    def testEviction(self):
+        u'''
+        LogBuffer evicts the oldest lines over the maximum size.
+        '''
+        buffer = logmatcher.LogBuffer(12)
+        for line in [u'first\n', u'second\n', u'third\n']:
+            buffer.append(line)
+
+        self.assertEqual(u'third\n', buffer.getText())
+        self.assertEqual(13, buffer.getEvictedSize())
+        self.assertEqual(0, buffer.getSpilledSize())
+        self.assertEqual(2, buffer.getFirstLineIndex())
+        self.assertEqual(3, buffer.getLineCount())
+        self.assert_(buffer.getLineIndex(8) is None)
+
+    def testManyEviction(self):
+        u'''
+        LogBuffer keeps the latest lines while many lines are evicted.
+        '''
+        buffer = logmatcher.LogBuffer(10)
+        for index in range(5000):
+            buffer.append(u'%04d\n' % index)
+            buffer.getText()
+
+        self.assertEqual(u'4998\n4999\n', buffer.getText())
+        self.assertEqual([u'4999\n'], buffer.getLines(4999))
+        self.assertEqual(4999, buffer.getLineIndex(4999 * 5))
+
+    def testSnapshotAfterEviction(self):
+        u'''
+        The snapshot keeps lines that are evicted after it is taken.
+        '''
+        buffer = logmatcher.LogBuffer(10)
+        for index in range(1000):
+            buffer.append(u'%04d\n' % index)
+        snapshot = buffer.getSnapshot()
+        for index in range(1000, 2000):
+            buffer.append(u'%04d\n' % index)
+
+        self.assertEqual([u'0998\n', u'0999\n'], snapshot.getLines())
+        self.assertEqual(u'1998\n1999\n', buffer.getText())
+        self.assertEqual(1999, buffer.getLineIndex(1999 * 5))
+
+    def testSpill(self):
+        u'''
+        LogBuffer spills evicted lines and searches them.
+        '''
+        buffer = logmatcher.LogBuffer(12, True)
+        try:
+            for line in [u'first\n', u'\u65e5\u672c\n', u'third\n']:
+                buffer.append(line, len(line.encode('utf8')))
+
+            self.assertEqual(13, buffer.getSpilledSize())
+            self.assertEqual(
+                [u'first\n', u'\u65e5\u672c\n'],
+                list(buffer.getSpilledLines()))
+            self.assertEqual(u'\u65e5',
+                buffer.search(re.compile(u'\u65e5')).group(0))
+            self.assertEqual(u'third',
+                buffer.search(re.compile(ur'th\w+')).group(0))
+        finally:
+            buffer.close()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
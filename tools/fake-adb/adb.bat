@@ -0,0 +1,3 @@
+@echo off
+rem Run the fake adb on Windows.
+python "%~dp0adb" %*